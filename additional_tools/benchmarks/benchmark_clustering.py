@@ -0,0 +1,175 @@
+"""
+Benchmark for the FastJet reclustering in SUEP_utils.FastJetReclustering.
+Compares clustering the whole chunk in one ClusterSequence with clustering it in
+batches of events over a pool of threads (or processes), on synthetic high
+multiplicity SUEP-like events: a few hundred soft, isotropic tracks per event.
+The jets and constituents of the batched clustering are checked to be identical.
+With --memory, the peak memory of clustering the chunk is measured instead, in a
+fresh process for each method: computing all the jets and constituents and cutting
+on pT afterwards, as done before, against extracting only the jets above threshold,
+with their constituents or only their constituent indices, and in sequential
+batches of --batchSize events (10000 by default).
+
+To run this script, do:
+    python benchmark_clustering.py --nevents 5000 --workers 1 2 4
+    python benchmark_clustering.py --nevents 100000 --memory --batchSize 10000
+"""
+
+import argparse
+import resource
+import subprocess
+import sys
+from time import time
+
+import awkward as ak
+import fastjet
+import numpy as np
+import vector
+
+sys.path.append("../..")
+import workflows.SUEP_utils as SUEP_utils
+
+vector.register_awkward()
+
+
+def makeTracks(nevents, ntracks=300, seed=2023):
+    rng = np.random.default_rng(seed)
+    counts = rng.poisson(ntracks, size=nevents)
+    n = counts.sum()
+    return ak.unflatten(
+        ak.zip(
+            {
+                "pt": 0.75 + rng.exponential(1.5, n),
+                "eta": rng.uniform(-2.5, 2.5, n),
+                "phi": rng.uniform(-np.pi, np.pi, n),
+                "mass": np.full(n, 0.13957),
+            },
+            with_name="Momentum4D",
+        ),
+        counts,
+    )
+
+
+def allJetsThenCut(tracks, r, minPt):
+    jetdef = fastjet.JetDefinition(fastjet.antikt_algorithm, r)
+    cluster = fastjet.ClusterSequence(tracks, jetdef)
+    ak_inclusive_jets = cluster.inclusive_jets()
+    ak_inclusive_cluster = cluster.constituents()
+    minPtCut = ak_inclusive_jets.pt > minPt
+    return ak_inclusive_jets[minPtCut], ak_inclusive_cluster[minPtCut]
+
+
+MEMORY_METHODS = {
+    "all jets, then cut": lambda tracks, r, minPt, batch_size: allJetsThenCut(
+        tracks, r, minPt
+    ),
+    "above threshold": lambda tracks, r, minPt, batch_size: (
+        SUEP_utils.FastJetReclustering(tracks, r=r, minPt=minPt)
+    ),
+    "above threshold, indices": lambda tracks, r, minPt, batch_size: (
+        SUEP_utils.FastJetReclustering(tracks, r=r, minPt=minPt, return_indices=True)
+    ),
+    "indices, in batches": lambda tracks, r, minPt, batch_size: (
+        SUEP_utils.FastJetReclustering(
+            tracks, r=r, minPt=minPt, batch_size=batch_size, return_indices=True
+        )
+    ),
+}
+
+
+def peakMemory(options):
+    """
+    Peak RSS in MB of clustering the tracks with options.peakMemory, over the one
+    after building them. Run in a fresh process for each method.
+    """
+    tracks = makeTracks(options.nevents, options.ntracks)
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    start = time()
+    jets, _ = MEMORY_METHODS[options.peakMemory](
+        tracks, 1.5, options.minPt, options.batchSize or 10000
+    )
+    elapsed = time() - start
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{after - before:.0f} {elapsed:.2f} {ak.sum(ak.num(jets))}")
+
+
+def compareMemory(options):
+    for method in MEMORY_METHODS:
+        result = subprocess.run(
+            [
+                sys.executable,
+                __file__,
+                "--nevents",
+                str(options.nevents),
+                "--ntracks",
+                str(options.ntracks),
+                "--minPt",
+                str(options.minPt),
+                "--batchSize",
+                str(options.batchSize),
+                "--peakMemory",
+                method,
+            ],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        memory, elapsed, njets = result.stdout.strip().split("\n")[-1].split()
+        print(
+            f"{method:>25}: peak memory +{memory} MB, {elapsed} s, {njets} jets"
+            f" for {options.nevents} events"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark FastJet reclustering")
+    parser.add_argument("--nevents", type=int, default=5000)
+    parser.add_argument("--ntracks", type=int, default=300)
+    parser.add_argument("--minPt", type=float, default=150)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--batchSize", type=int, default=0)
+    parser.add_argument("--executor", type=str, default="thread")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--memory", action="store_true")
+    parser.add_argument("--peakMemory", type=str, default=None, help=argparse.SUPPRESS)
+    options = parser.parse_args()
+
+    if options.peakMemory:
+        peakMemory(options)
+        return
+    if options.memory:
+        compareMemory(options)
+        return
+
+    tracks = makeTracks(options.nevents, options.ntracks)
+    ref_jets, ref_cluster = SUEP_utils.FastJetReclustering(
+        tracks, r=1.5, minPt=options.minPt
+    )
+
+    timings = {}
+    for workers in [0] + options.workers:
+        name = "single sequence" if workers == 0 else f"{workers} {options.executor}s"
+        best = np.inf
+        for _ in range(options.repeat):
+            start = time()
+            jets, cluster = SUEP_utils.FastJetReclustering(
+                tracks,
+                r=1.5,
+                minPt=options.minPt,
+                workers=max(workers, 1),
+                batch_size=options.batchSize if workers else 0,
+                executor=options.executor,
+            )
+            best = min(best, time() - start)
+        timings[name] = best
+        assert ak.to_list(jets.pt) == ak.to_list(ref_jets.pt)
+        assert ak.to_list(cluster.pt) == ak.to_list(ref_cluster.pt)
+        print(f"{name:>20}: {best:.4f} s for {options.nevents} events")
+
+    reference = timings["single sequence"]
+    for name, best in timings.items():
+        print(f"{name:>20}: {reference / best:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Micro-benchmark for the gen-SUEP extraction in storeEventVars.
+Compares the per-event list comprehensions that were used to grab the last
+particle in the chain with the columnar SUEP_utils.getChainParticle selector,
+on a synthetic GenPart-like collection.
+
+To run this script, do:
+    python benchmark_gen_chain.py --nevents 20000
+"""
+
+import argparse
+import sys
+from time import time
+
+import awkward as ak
+import numpy as np
+
+sys.path.append("../..")
+import workflows.SUEP_utils as SUEP_utils
+
+
+def makeGenParts(nevents, seed=2023):
+    rng = np.random.default_rng(seed)
+    counts = rng.integers(50, 150, size=nevents)
+    nparts = counts.sum()
+    pdgID = rng.choice(
+        [1, 2, 21, 25, 999999], size=nparts, p=[0.3, 0.3, 0.3, 0.02, 0.08]
+    )
+    return ak.unflatten(
+        ak.zip(
+            {
+                "pt": rng.exponential(10.0, nparts),
+                "eta": rng.uniform(-4.0, 4.0, nparts),
+                "phi": rng.uniform(-np.pi, np.pi, nparts),
+                "mass": rng.uniform(0.0, 200.0, nparts),
+                "pdgID": pdgID,
+            }
+        ),
+        counts,
+    )
+
+
+def listComprehension(genSUEP):
+    SUEP_genMass = [g[-1].mass if len(g) > 0 else 0 for g in genSUEP]
+    SUEP_genPt = [g[-1].pt if len(g) > 0 else 0 for g in genSUEP]
+    SUEP_genPhi = [g[-1].phi if len(g) > 0 else 0 for g in genSUEP]
+    SUEP_genEta = [g[-1].eta if len(g) > 0 else 0 for g in genSUEP]
+    return SUEP_genMass, SUEP_genPt, SUEP_genPhi, SUEP_genEta
+
+
+def columnar(genSUEP):
+    genSUEP = SUEP_utils.getChainParticle(genSUEP)
+    SUEP_genMass = ak.to_numpy(ak.fill_none(genSUEP.mass, 0))
+    SUEP_genPt = ak.to_numpy(ak.fill_none(genSUEP.pt, 0))
+    SUEP_genPhi = ak.to_numpy(ak.fill_none(genSUEP.phi, 0))
+    SUEP_genEta = ak.to_numpy(ak.fill_none(genSUEP.eta, 0))
+    return SUEP_genMass, SUEP_genPt, SUEP_genPhi, SUEP_genEta
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark gen-SUEP extraction")
+    parser.add_argument("--nevents", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=3)
+    options = parser.parse_args()
+
+    genParts = makeGenParts(options.nevents)
+    genSUEP = genParts[abs(genParts.pdgID) == 25]
+
+    timings = {}
+    results = {}
+    for name, method in [
+        ("list comprehension", listComprehension),
+        ("columnar", columnar),
+    ]:
+        best = np.inf
+        for _ in range(options.repeat):
+            start = time()
+            results[name] = method(genSUEP)
+            best = min(best, time() - start)
+        timings[name] = best
+        print(f"{name:>20}: {best:.4f} s for {options.nevents} events")
+
+    for old, new in zip(results["list comprehension"], results["columnar"]):
+        assert np.array_equal(np.asarray(old, dtype=float), new)
+    print(f"Speedup: {timings['list comprehension'] / timings['columnar']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
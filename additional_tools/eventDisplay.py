@@ -35,7 +35,7 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 parent_dir = os.path.abspath(os.path.join(current_dir, ".."))
 sys.path.append(parent_dir)
 
-from workflows import SUEP_utils
+from workflows import SUEP_utils, track_utils
 
 vector.register_awkward()
 
@@ -98,36 +98,34 @@ def getParamsFromSampleName(sample):
         return None
 
 
+# track selections for the displays, in the format of workflows.track_utils
+DISPLAY_TRACK_CUTS = [
+    ("fromPV", ">", 1),
+    ("abs(eta)", "<=", 2.5),
+    ("abs(dz)", "<", 10),
+    ("dzErr", "<", 0.05),
+]
+DISPLAY_TRACK_SELECTIONS = {
+    "ggF": {
+        "collection": "PFCands",
+        "fields": {"pt": "pt", "eta": "eta", "phi": "phi", "mass": "mass"},
+        "cuts": DISPLAY_TRACK_CUTS + [("pt", ">=", 0.75)],
+    },
+    "WH": {
+        "collection": "PFCands",
+        "fields": {"pt": "pt", "eta": "eta", "phi": "phi", "mass": "mass"},
+        "cuts": DISPLAY_TRACK_CUTS + [("pt", ">=", 1.0), ("puppiWeight", ">", 0.1)],
+    },
+}
+
+
 def getTracks(tree, channel, lepton=None):
-    tracks = ak.zip(
-        {
-            "pt": get_branch(tree, "PFCands_pt"),
-            "phi": get_branch(tree, "PFCands_phi"),
-            "eta": get_branch(tree, "PFCands_eta"),
-            "mass": get_branch(tree, "PFCands_mass"),
-        },
-        with_name="Momentum4D",
+    tracks, _ = track_utils.getTracks(
+        lambda collection, branch: get_branch(tree, collection + "_" + branch),
+        [DISPLAY_TRACK_SELECTIONS[channel]],
+        leptons=[lepton[:, 0]] if channel == "WH" else [],
+        isolation=0.4 if channel == "WH" else None,
     )
-    # Apply track selection
-    if channel == "ggF":
-        trackSelection = (
-            (get_branch(tree, "PFCands_fromPV") > 1)
-            & (tracks.pt >= 0.75)
-            & (abs(tracks.eta) <= 2.5)
-            & (abs(get_branch(tree, "PFCands_dz")) < 10)
-            & (get_branch(tree, "PFCands_dzErr") < 0.05)
-        )
-    elif channel == "WH":
-        trackSelection = (
-            (get_branch(tree, "PFCands_fromPV") > 1)
-            & (tracks.pt >= 1.0)
-            & (abs(tracks.eta) <= 2.5)
-            & (abs(get_branch(tree, "PFCands_dz")) < 10)
-            & (get_branch(tree, "PFCands_dzErr") < 0.05)
-            & (get_branch(tree, "PFCands_puppiWeight") > 0.1)
-            & (tracks.deltaR(lepton[:, 0]) >= 0.4)
-        )
-    tracks = tracks[trackSelection]
     return tracks
 
 
@@ -0,0 +1,77 @@
+"""
+Tests for the output of the ggF processor, workflows.SUEP_coffea, on chunks where no
+event passes the preselection: with the track systematics, the _track_down and the
+nominal variations both run on the empty chunk and share the same output table.
+
+To run this script, do:
+    python -m pytest test_SUEP_coffea.py
+
+Date: October 2026
+"""
+
+import os
+import sys
+from types import SimpleNamespace
+
+import awkward as ak
+import numpy as np
+import pytest
+
+pytest.importorskip("coffea")
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../.."))
+import workflows.SUEP_coffea as SUEP_coffea
+
+
+class EmptyChunkEvents:
+    """
+    The few attributes of NanoEvents used by process before the preselection.
+    """
+
+    metadata = {"dataset": "test"}
+    behavior = {"__events_factory__": SimpleNamespace(_partition_key="test/0")}
+
+    def __init__(self, nevents):
+        self.genWeight = np.ones(nevents)
+
+
+def makeProcessor(accum):
+    processor = SUEP_coffea.SUEP_cluster(
+        isMC=1,
+        era="2018",
+        scouting=0,
+        sample="test",
+        do_syst=True,
+        syst_var="",
+        weight_syst=False,
+        flag=False,
+        do_inf=False,
+        output_location=None,
+        accum=accum,
+    )
+    # no event passes the preselection
+    processor.preselection = lambda events: ak.Array([])
+    return processor
+
+
+def test_empty_chunk_pandas_merger(monkeypatch):
+    saved = []
+    monkeypatch.setattr(
+        SUEP_coffea.pandas_utils,
+        "save_dfs",
+        lambda processor, dfs, names, fname: saved.append(dfs),
+    )
+    makeProcessor("pandas_merger").process(EmptyChunkEvents(10))
+
+    (out_vars,) = saved[0]
+    assert list(out_vars.columns) == ["empty"]
+    assert out_vars["empty"].to_list() == ["empty"]
+
+
+def test_empty_chunk_iterative():
+    output = makeProcessor("iterative").process(EmptyChunkEvents(10))
+
+    out_vars = output["test"]
+    assert len(out_vars) == 0
+    assert "SUEP_S1_CL" in out_vars.columns
+    assert "SUEP_S1_CL_track_down" in out_vars.columns
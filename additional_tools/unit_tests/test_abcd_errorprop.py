@@ -0,0 +1,189 @@
+"""
+Tests for the vectorized error propagation of the ABCD methods in plot_utils:
+the predicted signal region and its variance are compared bin-by-bin against the
+sympy expressions (symbolic derivatives and substitution) used previously.
+
+To run this script, do:
+    python -m pytest test_abcd_errorprop.py
+
+Date: October 2026
+"""
+
+import os
+import sys
+
+import hist
+import numpy as np
+import pytest
+import sympy
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../.."))
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../plotting")
+)
+import plot_utils
+
+XREGIONS = [[0j, 0.3j], [0.3j, 0.5j], [0.5j, 1.0j]]
+YREGIONS = [[0j, 50j], [50j, 100j], [100j, 300j]]
+
+
+@pytest.fixture(scope="module")
+def hist_abcd():
+    rng = np.random.default_rng(42)
+    h = hist.Hist(
+        hist.axis.Regular(20, 0, 1, name="x"),
+        hist.axis.Regular(15, 0, 300, name="y"),
+        storage=hist.storage.Weight(),
+    )
+    n = 50000
+    h.fill(
+        x=rng.uniform(0, 1, n),
+        y=rng.exponential(80, n),
+        weight=rng.uniform(0.5, 1.5, n),
+    )
+    return h
+
+
+def sympy_errorProp(exp, variables, accs):
+    """
+    Value and first order propagated variance of exp, as done by plot_utils before.
+    accs are (value, variance) pairs of the variables.
+    """
+    alpha = exp
+    for var, (value, _) in zip(variables, accs):
+        alpha = alpha.subs(var, value)
+    variance = 0
+    for var, (_, var_value) in zip(variables, accs):
+        variance += sympy.diff(exp, var) ** 2 * abs(var_value)
+    for var, (value, _) in zip(variables, accs):
+        variance = variance.subs(var, value)
+    if type(alpha) != sympy.core.numbers.Float or alpha <= 0:
+        alpha = 0
+    return float(alpha), float(variance)
+
+
+def acc(h):
+    s = h.sum()
+    return s.value, s.variance
+
+
+def test_monomial_against_sympy():
+    rng = np.random.default_rng(1)
+    values = rng.uniform(0.5, 10, 4)
+    variances = rng.uniform(0.1, 2, 4)
+    powers = [2, -1, 1, -4]
+    x = sympy.symbols("x0:4")
+    exp = sympy.Mul(*[xi**p for xi, p in zip(x, powers)])
+
+    result, variance = plot_utils.errorProp_monomial(
+        list(zip(values, variances, powers))
+    )
+    expected = sympy_errorProp(exp, x, list(zip(values, variances)))
+    assert result == pytest.approx(expected[0], rel=1e-12)
+    assert variance == pytest.approx(expected[1], rel=1e-12)
+
+
+def test_monomial_zero_denominator():
+    result, variance = plot_utils.errorProp_monomial(
+        [(np.array([1.0, 2.0]), np.array([1.0, 1.0]), 1), (0.0, 1.0, -1)]
+    )
+    assert np.all(result == 0)
+    assert np.all(np.isinf(variance))
+
+
+@pytest.mark.parametrize("sum_var", ["x", "y"])
+def test_ABCD_4regions(hist_abcd, sum_var):
+    SR, SR_exp = plot_utils.ABCD_4regions_errorProp(
+        hist_abcd, XREGIONS[1:], YREGIONS[1:], sum_var=sum_var
+    )
+    A, B, C, _ = plot_utils.make_ABCD_4regions(
+        hist_abcd, XREGIONS[1:], YREGIONS[1:], sum_var=sum_var
+    )
+    hNUM, hDEN = (B, C) if sum_var == "x" else (C, B)
+
+    a, hnum_bin, hden = sympy.symbols("A hnum_bin hden")
+    exp = hnum_bin * hden * a**-1
+    for i in range(len(hNUM.values())):
+        accs = [acc(A), (hNUM[i].value, hNUM[i].variance), acc(hDEN)]
+        value, variance = sympy_errorProp(exp, [a, hnum_bin, hden], accs)
+        assert SR_exp.values()[i] == pytest.approx(value, rel=1e-12)
+        assert SR_exp.variances()[i] == pytest.approx(variance, rel=1e-12)
+
+
+@pytest.mark.parametrize(
+    "xregions, yregions, sum_var",
+    [
+        (XREGIONS, YREGIONS[1:], "x"),
+        (XREGIONS[1:], YREGIONS, "x"),
+        (XREGIONS, YREGIONS[1:], "y"),
+        (XREGIONS[1:], YREGIONS, "y"),
+    ],
+)
+def test_ABCD_6regions(hist_abcd, xregions, yregions, sum_var):
+    SR, SR_exp = plot_utils.ABCD_6regions_errorProp(
+        hist_abcd, xregions, yregions, sum_var=sum_var
+    )
+    A, B, C, D, E, _ = plot_utils.make_ABCD_6regions(
+        hist_abcd, xregions, yregions, sum_var=sum_var
+    )
+    mode1 = (sum_var == "x") == (len(xregions) == 3)
+    hNUM, hNUM2, hDEN = (E, C, D) if mode1 else (C, E, D)
+
+    a, b, hnum_bin, hnum2, hden_bin, hden = sympy.symbols(
+        "A B hNUM_bin hNUM2 hDEN_bin hDEN"
+    )
+    if mode1:
+        exp = hnum_bin**2 * hnum2 * a * hden_bin**-1 * b**-2
+    else:
+        exp = hnum_bin * hnum2**2 * a * b**-2 * hden**-1
+    variables = [a, b, hnum_bin, hnum2, hden_bin, hden]
+    for i in range(len(hNUM.values())):
+        hDEN_bin = (hDEN[i].value, hDEN[i].variance) if mode1 else (0, 0)
+        accs = [
+            acc(A),
+            acc(B),
+            (hNUM[i].value, hNUM[i].variance),
+            acc(hNUM2),
+            hDEN_bin,
+            acc(hDEN),
+        ]
+        value, variance = sympy_errorProp(exp, variables, accs)
+        assert SR_exp.values()[i] == pytest.approx(value, rel=1e-12)
+        assert SR_exp.variances()[i] == pytest.approx(variance, rel=1e-12)
+
+
+@pytest.mark.parametrize("approx", [True, False])
+def test_ABCD_9regions(hist_abcd, approx):
+    SR, SR_exp = plot_utils.ABCD_9regions_errorProp(
+        hist_abcd, XREGIONS, YREGIONS, sum_var="x", approx=approx
+    )
+    A, B, C, D, E, F, G, H, _ = plot_utils.make_ABCD_9regions(
+        hist_abcd, XREGIONS, YREGIONS, sum_var="x"
+    )
+
+    a, b, c, c_bin, d, e, f_bin, f_other, g, h = sympy.symbols(
+        "A B C C_bin D E F_bin F_other G H"
+    )
+    if approx:
+        exp = f_bin * (f_other + f_bin) * h**2 * d**2 * b**2 / (g * c * a * e**4)
+    else:
+        exp = f_bin**2 * h**2 * d**2 * b**2 / (g * c_bin * a * e**4)
+    variables = [a, b, c, c_bin, d, e, f_bin, f_other, g, h]
+    for i in range(len(F.values())):
+        F_other = F.copy()
+        F_other[i] = hist.accumulators.WeightedSum()
+        accs = [
+            acc(A),
+            acc(B),
+            acc(C),
+            (C[i].value, C[i].variance),
+            acc(D),
+            acc(E),
+            (F[i].value, F[i].variance),
+            acc(F_other),
+            acc(G),
+            acc(H),
+        ]
+        value, variance = sympy_errorProp(exp, variables, accs)
+        assert SR_exp.values()[i] == pytest.approx(value, rel=1e-9)
+        assert SR_exp.variances()[i] == pytest.approx(variance, rel=1e-9)
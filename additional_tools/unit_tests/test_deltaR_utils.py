@@ -0,0 +1,93 @@
+"""
+Tests for the numba deltaR matching kernels in workflows.deltaR_utils, against the
+ak.cartesian cross products (and argmin) they replace, including events without
+any object to match to.
+
+To run this script, do:
+    python -m pytest test_deltaR_utils.py
+
+Date: October 2026
+"""
+
+import os
+import sys
+
+import awkward as ak
+import numpy as np
+import pytest
+import vector
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../.."))
+import workflows.deltaR_utils as deltaR_utils
+
+vector.register_awkward()
+
+
+def makeObjects(rng, nevents, mean):
+    counts = rng.poisson(mean, nevents)
+    n = counts.sum()
+    return ak.unflatten(
+        ak.zip(
+            {
+                "pt": rng.exponential(20, n),
+                "eta": rng.uniform(-2.5, 2.5, n),
+                "phi": rng.uniform(-np.pi, np.pi, n),
+                "mass": np.zeros(n),
+            },
+            with_name="Momentum4D",
+        ),
+        counts,
+    )
+
+
+@pytest.fixture(scope="module")
+def objects():
+    rng = np.random.default_rng(11)
+    return makeObjects(rng, 300, 6), makeObjects(rng, 300, 1.5)
+
+
+def test_minDeltaR(objects):
+    jets, muons = objects
+    product = ak.cartesian({"jet": jets, "muon": muons}, nested=True)
+    deltaR = product.jet.deltaR(product.muon)
+    expected = ak.fill_none(ak.min(deltaR, axis=-1), np.inf)
+    assert ak.to_list(ak.num(deltaR_utils.minDeltaR(jets, muons))) == ak.to_list(
+        ak.num(jets)
+    )
+    assert np.allclose(
+        ak.flatten(deltaR_utils.minDeltaR(jets, muons)), ak.flatten(expected)
+    )
+    assert ak.to_list(deltaR_utils.anyWithinCone(jets, muons, 0.4)) == ak.to_list(
+        ~ak.all(deltaR >= 0.4, axis=-1)
+    )
+
+
+def test_nearest(objects):
+    jets, genJets = objects
+    product = ak.cartesian({"jet": jets, "genJet": genJets}, nested=True)
+    deltaR = product.jet.deltaR(product.genJet)
+    argmin = ak.fill_none(ak.argmin(deltaR, axis=-1), -1)
+    within = ak.fill_none(ak.min(deltaR, axis=-1) <= 0.2, False)
+
+    index, _ = deltaR_utils.nearest(jets, genJets)
+    assert ak.to_list(index) == ak.to_list(argmin)
+
+    index, _ = deltaR_utils.nearest(jets, genJets, threshold=0.2)
+    assert ak.to_list(index) == ak.to_list(ak.where(within, argmin, -1))
+
+    # as jets.nearest(genJets, threshold=0.2) in coffea
+    mmin = ak.argmin(deltaR, axis=-1, keepdims=True)
+    matched_pt = ak.firsts(product.genJet.pt[mmin], axis=-1)
+    expected = ak.fill_none(ak.mask(matched_pt, within), 0)
+    pt_gen = deltaR_utils.takeNearest(genJets.pt, index, fill=0)
+    assert ak.to_list(pt_gen) == ak.to_list(expected)
+
+
+def test_one_per_event(objects):
+    tracks, _ = objects
+    leptons = tracks[ak.num(tracks) > 0][:, 0]
+    tracks = tracks[ak.num(tracks) > 0]
+    expected = tracks.deltaR(leptons)
+    assert np.allclose(
+        ak.flatten(deltaR_utils.minDeltaR(tracks, leptons)), ak.flatten(expected)
+    )
@@ -0,0 +1,48 @@
+"""
+Tests for workflows.utils.merger.StreamingMerger: DataFrames with longer strings than
+the output table was sized for, or with extra columns, start a new output file instead
+of failing the merge, while DataFrames missing some columns get them filled with NaN.
+
+To run this script, do:
+    python -m pytest test_merger.py
+
+Date: October 2026
+"""
+
+import os
+import sys
+
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../.."))
+from workflows.utils.merger import StreamingMerger
+
+
+def test_longer_strings_roll_over(tmp_path):
+    merger = StreamingMerger(str(tmp_path / "out.hdf5"), isMC=False)
+    merger.append(pd.DataFrame({"x": [1.0, 2.0], "label": ["a", "b"]}), {"era": 1})
+    merger.append(pd.DataFrame({"x": [3.0], "label": ["c" * 100]}), {"era": 1})
+    merger.append(pd.DataFrame({"x": [4.0], "label": ["d"]}), {"era": 1})
+    files = merger.close()
+
+    assert [os.path.basename(f) for f in files] == ["out.hdf5", "out_1.hdf5"]
+    merged = pd.concat([pd.read_hdf(f, "vars") for f in files])
+    assert merged["x"].to_list() == [1.0, 2.0, 3.0, 4.0]
+    assert merged["label"].to_list() == ["a", "b", "c" * 100, "d"]
+
+
+def test_changed_columns(tmp_path):
+    merger = StreamingMerger(str(tmp_path / "out.hdf5"), isMC=False)
+    merger.append(pd.DataFrame({"x": [1.0], "y": [2.0]}), {"era": 1})
+    # missing columns are filled with NaN, in the same file
+    merger.append(pd.DataFrame({"x": [3.0]}), {"era": 1})
+    # extra columns start a new file
+    merger.append(pd.DataFrame({"x": [4.0], "y": [5.0], "z": [6.0]}), {"era": 1})
+    files = merger.close()
+
+    assert [os.path.basename(f) for f in files] == ["out.hdf5", "out_1.hdf5"]
+    first = pd.read_hdf(files[0], "vars")
+    assert list(first.columns) == ["x", "y"]
+    assert first["x"].to_list() == [1.0, 3.0]
+    assert first["y"].isna().to_list() == [False, True]
+    assert list(pd.read_hdf(files[1], "vars").columns) == ["x", "y", "z"]
@@ -0,0 +1,86 @@
+"""
+Tests for fill_utils.PartialHistCache, config_hash and file_hash, used by make_hists
+--cacheDir: entries are invalidated when the ntuple or the configuration (including
+the content of the scaling weights file) changes, and the configuration hash is
+stable for configurations with lambdas.
+
+To run this script, do:
+    python -m pytest test_partial_cache.py
+
+Date: October 2026
+"""
+
+import os
+import sys
+
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../histmaker")
+)
+import fill_utils
+
+
+def make_config(cut):
+    return {
+        "Cluster": {
+            "selections": [["ht_JEC", ">", cut]],
+            "new_variables": [["dphi", lambda x, y: abs(x - y), ["phi1", "phi2"]]],
+        }
+    }
+
+
+def test_config_hash():
+    assert fill_utils.config_hash(make_config(1200)) == fill_utils.config_hash(
+        make_config(1200)
+    )
+    assert fill_utils.config_hash(make_config(1200)) != fill_utils.config_hash(
+        make_config(560)
+    )
+    other_lambda = make_config(1200)
+    other_lambda["Cluster"]["new_variables"][0][1] = lambda x, y: x - y
+    assert fill_utils.config_hash(make_config(1200)) != fill_utils.config_hash(
+        other_lambda
+    )
+
+
+def test_file_hash(tmp_path):
+    weights = tmp_path / "weights.npy"
+    weights.write_bytes(b"weights 1")
+    first = fill_utils.file_hash(str(weights))
+    assert first == fill_utils.file_hash(str(weights))
+    weights.write_bytes(b"weights 2")
+    assert first != fill_utils.file_hash(str(weights))
+    assert fill_utils.file_hash(str(tmp_path / "missing.npy")) is None
+
+
+def test_partial_cache(tmp_path):
+    ntuple = tmp_path / "ntuple.hdf5"
+    ntuple.write_bytes(b"0" * 100)
+    partial = {"hists": {}, "cutflow": {"cutflow_total": 10.0}, "gensumweight": 5.0}
+
+    cache = fill_utils.PartialHistCache(str(tmp_path / "cache"), "config1")
+    assert not cache.has(str(ntuple))
+    cache.save(str(ntuple), partial)
+    assert (
+        fill_utils.PartialHistCache(str(tmp_path / "cache"), "config1").load(
+            str(ntuple)
+        )
+        == partial
+    )
+
+    # a different configuration
+    assert not fill_utils.PartialHistCache(str(tmp_path / "cache"), "config2").has(
+        str(ntuple)
+    )
+
+    # a changed ntuple
+    ntuple.write_bytes(b"0" * 200)
+    assert not fill_utils.PartialHistCache(str(tmp_path / "cache"), "config1").has(
+        str(ntuple)
+    )
+
+    # files that can't be stat'ed are kept in memory
+    missing = str(tmp_path / "missing.hdf5")
+    cache.save(missing, partial)
+    assert cache.load(missing) == partial
+    assert cache.path(missing) is None
+    assert len(os.listdir(tmp_path / "cache")) == 1
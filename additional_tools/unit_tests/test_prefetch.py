@@ -0,0 +1,82 @@
+"""
+Tests for fill_utils.FilePrefetcher, using a local directory as a stand-in for xrootd.
+Checks that files come out in order, that failed copies are reported as None,
+and that no local copies are left behind.
+
+To run this script, do:
+    python -m pytest test_prefetch.py
+
+Date: October 2026
+"""
+
+import os
+import sys
+
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../histmaker")
+)
+import fill_utils
+
+
+def make_files(tmp_path, n):
+    src = tmp_path / "src"
+    src.mkdir()
+    files = []
+    for i in range(n):
+        path = src / f"ntuple_{i}.hdf5"
+        path.write_bytes(bytes([i]) * 1000 * (i + 1))
+        files.append(str(path))
+    return files
+
+
+def test_prefetcher_copies_in_order(tmp_path):
+    files = make_files(tmp_path, 5)
+    files.insert(2, str(tmp_path / "src" / "missing.hdf5"))
+    scratch = tmp_path / "scratch"
+    scratch.mkdir()
+
+    prefetcher = fill_utils.FilePrefetcher(
+        files,
+        nprefetch=2,
+        scratch_dir=str(scratch),
+        retry_wait=0,
+        max_attempts=2,
+        copy_local=True,
+    )
+    seen = []
+    for ifile, local_file in prefetcher:
+        seen.append(ifile)
+        if ifile.endswith("missing.hdf5"):
+            assert local_file is None
+            continue
+        with open(ifile, "rb") as f, open(local_file, "rb") as g:
+            assert f.read() == g.read()
+        # the current file, plus at most nprefetch more
+        assert len(os.listdir(scratch)) <= 3
+
+    assert seen == files
+    assert os.listdir(scratch) == []
+    assert prefetcher.stats["ncopied"] == 5
+    assert prefetcher.stats["nfailed"] == 1
+    assert prefetcher.stats["bytes"] == 1000 * (1 + 2 + 3 + 4 + 5)
+
+
+def test_prefetcher_cleans_up_when_stopped(tmp_path):
+    files = make_files(tmp_path, 5)
+    scratch = tmp_path / "scratch"
+    scratch.mkdir()
+
+    prefetcher = fill_utils.FilePrefetcher(
+        files, nprefetch=3, scratch_dir=str(scratch), copy_local=True
+    )
+    iterator = iter(prefetcher)
+    next(iterator)
+    iterator.close()
+    assert os.listdir(scratch) == []
+
+
+def test_prefetcher_local_files_in_place(tmp_path):
+    files = make_files(tmp_path, 3)
+    prefetcher = fill_utils.FilePrefetcher(files)
+    assert list(prefetcher) == [(f, f) for f in files]
+    assert all(os.path.exists(f) for f in files)
@@ -0,0 +1,109 @@
+"""
+Tests for workflows.track_utils: the tracks selected with the fused mask on the
+flat branches are compared against the per-collection awkward selection
+(Momentum4D zips, cuts, concatenation and lepton cleaning with deltaR) used before.
+
+To run this script, do:
+    python -m pytest test_track_utils.py
+
+Date: October 2026
+"""
+
+import os
+import sys
+
+import awkward as ak
+import numpy as np
+import pytest
+import vector
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "../.."))
+import workflows.track_utils as track_utils
+
+vector.register_awkward()
+
+NEVENTS = 200
+
+
+def makeCollection(rng, branches, mean):
+    counts = rng.poisson(mean, NEVENTS)
+    n = counts.sum()
+    fields = {}
+    for branch in branches:
+        if branch == "fromPV":
+            fields[branch] = rng.integers(0, 4, n).astype(np.uint8)
+        elif branch in ("trkPhi", "phi"):
+            fields[branch] = rng.uniform(-np.pi, np.pi, n).astype(np.float32)
+        elif branch in ("trkEta", "eta"):
+            fields[branch] = rng.uniform(-3, 3, n).astype(np.float32)
+        else:
+            fields[branch] = rng.exponential(0.5, n).astype(np.float32)
+    return ak.unflatten(ak.zip(fields), counts)
+
+
+@pytest.fixture(scope="module")
+def events():
+    rng = np.random.default_rng(7)
+    cuts = ["fromPV", "dz", "d0", "puppiWeight"]
+    pfcands = makeCollection(rng, ["trkPt", "trkEta", "trkPhi", "mass"] + cuts, 80)
+    lost = makeCollection(rng, ["pt", "eta", "phi"] + cuts, 10)
+    lepton = ak.zip(
+        {
+            "pt": np.full(NEVENTS, 30.0, dtype=np.float32),
+            "eta": rng.uniform(-2, 2, NEVENTS).astype(np.float32),
+            "phi": rng.uniform(-np.pi, np.pi, NEVENTS).astype(np.float32),
+            "mass": np.zeros(NEVENTS, dtype=np.float32),
+        },
+        with_name="Momentum4D",
+    )
+    return ak.zip({"PFCands": pfcands, "lostTracks": lost}, depth_limit=1), lepton
+
+
+def reference_WH(events, lepton):
+    pf, lost = events.PFCands, events.lostTracks
+    cands = ak.zip(
+        {"pt": pf.trkPt, "eta": pf.trkEta, "phi": pf.trkPhi, "mass": pf.mass},
+        with_name="Momentum4D",
+    )[
+        (pf.fromPV > 1)
+        & (pf.trkPt >= 1)
+        & (abs(pf.trkEta) <= 2.5)
+        & (abs(pf.dz) < 0.05)
+        & (abs(pf.d0) < 0.05)
+        & (pf.puppiWeight > 0.1)
+    ]
+    lostTracks = ak.zip(
+        {"pt": lost.pt, "eta": lost.eta, "phi": lost.phi, "mass": 0.0},
+        with_name="Momentum4D",
+    )[
+        (lost.fromPV > 1)
+        & (lost.pt >= 0.1)
+        & (abs(lost.eta) <= 2.5)
+        & (abs(lost.dz) < 0.05)
+        & (abs(lost.d0) < 0.05)
+        & (lost.puppiWeight > 0.1)
+    ]
+    tracks = ak.concatenate([cands, lostTracks], axis=1)
+    return tracks[tracks.deltaR(lepton) >= 0.4]
+
+
+def test_WH_tracks(events):
+    events, lepton = events
+    report = track_utils.TrackReport()
+    tracks, _ = track_utils.getTracks(
+        track_utils.nanoEventsGetter(events),
+        "WH",
+        leptons=[lepton],
+        isolation=0.4,
+        report=report,
+    )
+    expected = reference_WH(events, lepton)
+
+    assert ak.to_list(ak.num(tracks)) == ak.to_list(ak.num(expected))
+    for field in ["pt", "eta", "phi", "mass"]:
+        assert ak.to_numpy(ak.flatten(tracks[field])).dtype == np.float32
+        assert ak.to_list(tracks[field]) == ak.to_list(expected[field])
+
+    # only the branches of the selection are read: 7 float32 branches and fromPV
+    ntracks = ak.sum(ak.num(events.PFCands))
+    assert report.nbytes["read PFCands"] == (7 * 4 + 1) * ntracks
@@ -44,12 +44,30 @@ def main():
         "--output",
         "-o",
         default="out.hdf5",
-        help="Output file, can be a path or xrootd path.",
+        help="Output file (.hdf5 or .parquet), can be a path or xrootd path.",
         type=str,
     )
     parser.add_argument("--dataset", type=str, default="X", help="")
     parser.add_argument("--maxChunks", type=int, default=None, help="")
     parser.add_argument("--chunkSize", type=int, default=100000, help="")
+    parser.add_argument(
+        "--clusterWorkers",
+        type=int,
+        default=1,
+        help="Number of threads used for the FastJet reclustering.",
+    )
+    parser.add_argument(
+        "--clusterBatchSize",
+        type=int,
+        default=0,
+        help="Events per FastJet reclustering batch (default: one batch per thread).",
+    )
+    parser.add_argument(
+        "--reportTimings",
+        type=int,
+        default=0,
+        help="Print the stage timings and track selection report of each chunk.",
+    )
     parser.add_argument(
         "--doInf",
         type=str,
@@ -68,6 +86,9 @@ def main():
             sample=options.dataset,
             flag=False,
             output_location=os.getcwd(),
+            cluster_workers=options.clusterWorkers,
+            cluster_batch_size=options.clusterBatchSize,
+            report_timings=options.reportTimings,
         )
     )
 
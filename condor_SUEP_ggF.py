@@ -20,6 +20,24 @@ parser.add_argument("--infile", required=True, type=str, default=None, help="")
 parser.add_argument("--dataset", type=str, default="X", help="")
 parser.add_argument("--nevt", type=str, default=-1, help="")
 parser.add_argument("--doInf", type=int, default=0, help="")
+parser.add_argument(
+    "--clusterWorkers",
+    type=int,
+    default=1,
+    help="Number of threads used for the FastJet reclustering.",
+)
+parser.add_argument(
+    "--clusterBatchSize",
+    type=int,
+    default=0,
+    help="Events per FastJet reclustering batch (default: one batch per thread).",
+)
+parser.add_argument(
+    "--reportTimings",
+    type=int,
+    default=0,
+    help="Print the stage timings and track selection report of each chunk.",
+)
 options = parser.parse_args()
 
 out_dir = os.getcwd()
@@ -38,6 +56,9 @@ modules_era.append(
         do_inf=options.doInf,
         output_location=out_dir,
         accum="pandas_merger",
+        cluster_workers=options.clusterWorkers,
+        cluster_batch_size=options.clusterBatchSize,
+        report_timings=options.reportTimings,
     )
 )
 
@@ -1,104 +1,108 @@
-import matplotlib.pyplot as plt
 import numpy as np
 
+# numbers taken from table 1 here: https://cds.cern.ch/record/2669113/files/LHCHXSWG-2019-002.pdf
+HIGGS_BINS = np.array(
+    [
+        0,
+        400,
+        450,
+        500,
+        550,
+        600,
+        650,
+        700,
+        750,
+        800,
+        850,
+        900,
+        950,
+        1000,
+        1050,
+        1100,
+        1150,
+        1200,
+        1250,
+        15000,
+    ]
+)
+HIGGS_FACTOR = np.array(
+    [
+        1.25,
+        1.25,
+        1.25,
+        1.25,
+        1.25,
+        1.24,
+        1.24,
+        1.24,
+        1.24,
+        1.24,
+        1.24,
+        1.24,
+        1.24,
+        1.24,
+        1.24,
+        1.24,
+        1.24,
+        1.24,
+        1.24,
+    ]
+)
+UP_FACTOR = np.array(
+    [
+        1.092,
+        1.092,
+        1.089,
+        1.088,
+        1.088,
+        1.087,
+        1.087,
+        1.087,
+        1.087,
+        1.087,
+        1.085,
+        1.086,
+        1.086,
+        1.086,
+        1.087,
+        1.087,
+        1.087,
+        1.086,
+        1.086,
+    ]
+)
+DOWN_FACTOR = np.array(
+    [
+        0.88,
+        0.88,
+        0.89,
+        0.89,
+        0.89,
+        0.89,
+        0.89,
+        0.89,
+        0.89,
+        0.89,
+        0.89,
+        0.89,
+        0.89,
+        0.89,
+        0.89,
+        0.89,
+        0.88,
+        0.88,
+        0.88,
+    ]
+)
+
 
 def higgs_reweight(gen_pt):
-    # numbers taken from table 1 here: https://cds.cern.ch/record/2669113/files/LHCHXSWG-2019-002.pdf
-    bins = np.array(
-        [
-            0,
-            400,
-            450,
-            500,
-            550,
-            600,
-            650,
-            700,
-            750,
-            800,
-            850,
-            900,
-            950,
-            1000,
-            1050,
-            1100,
-            1150,
-            1200,
-            1250,
-            15000,
-        ]
-    )
-    Higgs_factor = np.array(
-        [
-            1.25,
-            1.25,
-            1.25,
-            1.25,
-            1.25,
-            1.24,
-            1.24,
-            1.24,
-            1.24,
-            1.24,
-            1.24,
-            1.24,
-            1.24,
-            1.24,
-            1.24,
-            1.24,
-            1.24,
-            1.24,
-            1.24,
-        ]
-    )
-    up_factor = np.array(
-        [
-            1.092,
-            1.092,
-            1.089,
-            1.088,
-            1.088,
-            1.087,
-            1.087,
-            1.087,
-            1.087,
-            1.087,
-            1.085,
-            1.086,
-            1.086,
-            1.086,
-            1.087,
-            1.087,
-            1.087,
-            1.086,
-            1.086,
-        ]
-    )
-    down_factor = np.array(
-        [
-            0.88,
-            0.88,
-            0.89,
-            0.89,
-            0.89,
-            0.89,
-            0.89,
-            0.89,
-            0.89,
-            0.89,
-            0.89,
-            0.89,
-            0.89,
-            0.89,
-            0.89,
-            0.89,
-            0.88,
-            0.88,
-            0.88,
-        ]
-    )
+    bins = HIGGS_BINS
+    Higgs_factor = HIGGS_FACTOR
+    up_factor = UP_FACTOR
+    down_factor = DOWN_FACTOR
 
-    vals = plt.hist(gen_pt, bins=bins)
+    vals = np.histogram(gen_pt, bins=bins)
 
     freqs = vals[0] * Higgs_factor
     ups = freqs * up_factor
@@ -36,14 +36,32 @@ def get_trigSF_weight(
     return trigSF
 
 
-def get_scout_trigSF_weight(htarray, sys, era="2018"):
+def scout_triggerSF(era):
+    """
+    Read the scouting trigger SF table: ht bins, weights and their errors, with an
+    underflow bin of 0 prepended. None for 2016, where no SF is applied.
+    """
+    if "16" in era:
+        return None
+    bins, trigwgts, wgterr = np.loadtxt(
+        f"../data/trigSF/scout_trigSF_{era}.txt", delimiter=","
+    )
+    trigwgts = np.insert(trigwgts, 0, 0)
+    wgterr = np.insert(wgterr, 0, 0)
+    return bins, trigwgts, wgterr
+
+
+def get_scout_trigSF_weight(htarray, sys, era="2018", tables=None):
+    """
+    tables: the output of scout_triggerSF(era), read from file if not passed.
+    """
     if "16" in era:
         scaleFactor = 1
     else:
-        bins, trigwgts, wgterr = np.loadtxt(f"../data/trigSF/scout_trigSF_{era}.txt")
+        if tables is None:
+            tables = scout_triggerSF(era)
+        bins, trigwgts, wgterr = tables
         htbin = np.digitize(htarray, bins)
-        trigwgts = np.insert(trigwgts, 0, 0)
-        wgterr = np.insert(wgterr, 0, 0)
         scaleFactorNom = np.take(trigwgts, htbin)
         scaleFactorErr = np.take(wgterr, htbin)
         if "trigSF_up" in sys:
@@ -0,0 +1,135 @@
+import numpy as np
+from CMS_corrections import higgs_reweight, pileup_weight, triggerSF
+
+
+class WeightProvider:
+    """
+    Event weights for the histmaker: generator weights, pileup, PS, prefire, trigger SF
+    and Higgs pT weights, with their up/down variations.
+    The pileup and trigger SF tables are read from file once, when the provider is built,
+    instead of for every file and systematic. Build one per run, then call
+    weights(df, syst) for each file and systematic.
+    """
+
+    def __init__(
+        self,
+        era: str,
+        channel: str = "ggF",
+        scouting: bool = False,
+        isMC: bool = True,
+    ):
+        self.era = era
+        self.channel = channel
+        self.scouting = scouting
+        self.isMC = isMC
+        if not isMC:
+            return
+
+        (
+            self.puweights,
+            self.puweights_up,
+            self.puweights_down,
+        ) = pileup_weight.pileup_weight(era)
+        if channel == "ggF":
+            if scouting != 1:
+                (
+                    self.trig_bins,
+                    self.trig_weights,
+                    self.trig_weights_up,
+                    self.trig_weights_down,
+                ) = triggerSF.triggerSF(era)
+            else:
+                self.scout_trig_tables = triggerSF.scout_triggerSF(era)
+
+    def uses_higgs_weights(self, sample: str) -> bool:
+        return self.isMC and self.channel == "ggF" and "mS125" in sample
+
+    def weights(
+        self, df, syst: str = "", sample: str = "", higgs_tables=None
+    ) -> np.ndarray:
+        """
+        Event weights of df for the systematic syst ("" for the nominal).
+        sample is used to decide whether to apply the Higgs pT weights (mS125 samples).
+        These are looked up in higgs_tables, the output of higgs_reweight.higgs_reweight
+        for the whole file, which make_hists computes once per file for all the
+        systematics. Without it, the tables are built from the gen pT distribution of df.
+        """
+        if not self.isMC:
+            return np.ones(df.shape[0])
+
+        event_weight = df["genweight"].to_numpy()
+
+        # 1) pileup weights
+        pu = pileup_weight.get_pileup_weights(
+            df, syst, self.puweights, self.puweights_up, self.puweights_down
+        )
+        event_weight = event_weight * pu
+
+        # 2) PS weights
+        if "PSWeight" in syst and syst in df.keys():
+            event_weight = event_weight * df[syst].to_numpy()
+
+        # 3) prefire weights
+        if self.era == "2016" or self.era == "2017":
+            if "prefire" in syst and syst in df.keys():
+                event_weight = event_weight * df[syst].to_numpy()
+            else:
+                event_weight = event_weight * df["prefire_nom"].to_numpy()
+
+        if self.channel == "ggF":
+            if self.scouting != 1:
+                # 2) TriggerSF weights
+                trigSF = triggerSF.get_trigSF_weight(
+                    df,
+                    syst,
+                    self.trig_bins,
+                    self.trig_weights,
+                    self.trig_weights_up,
+                    self.trig_weights_down,
+                )
+                event_weight = event_weight * trigSF
+
+            else:
+                # 2) TriggerSF weights
+                trigSF = triggerSF.get_scout_trigSF_weight(
+                    np.array(df["ht"]).astype(int),
+                    syst,
+                    self.era,
+                    tables=self.scout_trig_tables,
+                )
+                event_weight = event_weight * trigSF
+
+                # 4) prefire weights
+                # no prefire weights for scouting
+
+            # 5) Higgs_pt weights
+            # these are normalized to each file's gen pT distribution, so can't be cached
+            # in the provider, the tables are computed per file
+            if "mS125" in sample:
+                if higgs_tables is None:
+                    higgs_tables = higgs_reweight.higgs_reweight(df["SUEP_genPt"])
+                (
+                    higgs_bins,
+                    higgs_weights,
+                    higgs_weights_up,
+                    higgs_weights_down,
+                ) = higgs_tables
+                higgs_weight = higgs_reweight.get_higgs_weight(
+                    df,
+                    syst,
+                    higgs_bins,
+                    higgs_weights,
+                    higgs_weights_up,
+                    higgs_weights_down,
+                )
+                event_weight = event_weight * higgs_weight
+
+        elif self.channel == "WH":
+            pass
+            # FILL IN
+            # should we keep these separate or try to, as much as possible, use the same code for systematics for both channels?
+            # which systematics are applied and which aren't should be defined outside IMO, as is now
+            # and in here we should just apply them as much as possible in the same way
+            # with flags for the differences
+
+        return event_weight
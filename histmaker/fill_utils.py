@@ -1,9 +1,15 @@
+import hashlib
 import json
 import logging
 import os
+import pickle
+import shutil
 import subprocess
 import sys
-from collections import defaultdict
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 
 import awkward as ak
@@ -12,50 +18,588 @@ import pandas as pd
 import vector
 
 
-def h5load(ifile: str, label: str):
+def h5load(ifile: str, label: str, columns: list = None):
     """
     Load a pandas DataFrame from a HDF5 file, including metadata.
+    If columns is given, only those (that exist) are returned. This only saves memory:
+    the whole rows are still read from disk, also for table-format files (e.g. the
+    merged ntuples), whose columns are stored together. Only Parquet files read the
+    requested columns alone (see parquet_load).
     Nota bene: metadata is unstable, we have found that using pandas==1.4.1 and pytables==3.7.0 works.
     """
     try:
         with pd.HDFStore(ifile, "r") as store:
             try:
-                data = store[label]
-                metadata = store.get_storer(label).attrs.metadata
+                storer = store.get_storer(label)
+                if columns is not None and storer.is_table:
+                    data = store.select(label, columns=list(columns) + ["empty"])
+                else:
+                    data = store[label]
+                if columns is not None:
+                    keep = set(columns) | {"empty"}
+                    data = data[[c for c in data.columns if c in keep]]
+                metadata = storer.attrs.metadata
                 return data, metadata
 
-            except KeyError:
-                logging.warning("No key", label, ifile)
+            except (KeyError, AttributeError):
+                logging.warning(f"No key {label} in {ifile}")
                 return 0, 0
     except BaseException:
-        logging.warning("Some error occurred", ifile)
+        logging.warning(f"Some error occurred reading {ifile}")
         return 0, 0
 
 
+def parquet_load(ifile: str, columns: list = None):
+    """
+    Load a pandas DataFrame from a Parquet file, with the metadata stored in its
+    footer (see workflows/utils/parquet_utils.py).
+    If columns is given, only those (that exist) are read from disk.
+    """
+    try:
+        import pyarrow.parquet as pq
+
+        schema = pq.read_schema(ifile)
+        if columns is not None:
+            keep = set(columns) | {"empty"}
+            columns = [c for c in schema.names if c in keep]
+        data = pq.read_table(ifile, columns=columns).to_pandas()
+        metadata = json.loads((schema.metadata or {}).get(b"metadata", b"{}"))
+        return data, metadata
+    except BaseException:
+        logging.warning(f"Some error occurred reading {ifile}")
+        return 0, 0
+
+
+def load_ntuple(ifile: str, columns: list = None):
+    """
+    Load a local ntuple, HDF5 or Parquet depending on the file extension.
+    """
+    if ifile.endswith(".parquet"):
+        return parquet_load(ifile, columns=columns)
+    return h5load(ifile, "vars", columns=columns)
+
+
+def load_ntuple_chunks(ifile: str, columns: list = None, chunksize: int = 0):
+    """
+    Load a local ntuple in chunks of at most chunksize rows, to bound the memory used.
+    Returns an iterator over the DataFrame chunks and the metadata, or 0, 0 if the
+    file can't be read. Table-format HDF5 files (e.g. the merged ntuples) are read
+    one chunk at a time, and Parquet files one batch of rows at a time, while
+    fixed-format HDF5 files can only be read in full, and are then split.
+    Errors reading the chunks of table-format HDF5 and Parquet files are raised
+    while iterating over them.
+    With chunksize <= 0, the whole file is a single chunk (as in load_ntuple).
+    """
+    if chunksize <= 0:
+        df, metadata = load_ntuple(ifile, columns=columns)
+        if type(df) == int:
+            return 0, 0
+        return iter([df]), metadata
+
+    if ifile.endswith(".parquet"):
+        try:
+            import pyarrow.parquet as pq
+
+            parquet_file = pq.ParquetFile(ifile)
+            schema = parquet_file.schema_arrow
+            metadata = json.loads((schema.metadata or {}).get(b"metadata", b"{}"))
+        except BaseException:
+            logging.warning(f"Some error occurred reading {ifile}")
+            return 0, 0
+        if columns is not None:
+            keep = set(columns) | {"empty"}
+            columns = [c for c in schema.names if c in keep]
+
+        def parquet_chunks():
+            for batch in parquet_file.iter_batches(
+                batch_size=chunksize, columns=columns
+            ):
+                yield batch.to_pandas()
+
+        return parquet_chunks(), metadata
+
+    try:
+        with pd.HDFStore(ifile, "r") as store:
+            storer = store.get_storer("vars")
+            metadata = storer.attrs.metadata
+            is_table = storer.is_table
+    except BaseException:
+        logging.warning(f"Some error occurred reading {ifile}")
+        return 0, 0
+
+    if not is_table:
+        # read in full now, so that a file that can't be read is reported as such
+        df, _ = h5load(ifile, "vars", columns=columns)
+        if type(df) == int:
+            return 0, 0
+        chunks = (
+            df.iloc[start : start + chunksize]
+            for start in range(0, df.shape[0], chunksize)
+        )
+        return chunks, metadata
+
+    def hdf5_chunks():
+        with pd.HDFStore(ifile, "r") as store:
+            select_columns = None if columns is None else list(columns) + ["empty"]
+            for df in store.select("vars", columns=select_columns, chunksize=chunksize):
+                if columns is not None:
+                    keep = set(columns) | {"empty"}
+                    df = df[[c for c in df.columns if c in keep]]
+                yield df
+
+    return hdf5_chunks(), metadata
+
+
+def peak_memory_mb() -> tuple:
+    """
+    Peak resident memory (RSS) of this process and of its (finished) child processes, in MB.
+    """
+    import resource
+
+    # ru_maxrss is in kB on Linux, in bytes on macOS
+    unit = 1024**2 if sys.platform == "darwin" else 1024
+    return (
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / unit,
+    )
+
+
+def ntuple_column_sizes(ifile: str, label: str = "vars") -> dict:
+    """
+    Size in bytes of each column of a Parquet ntuple as stored on disk (compressed),
+    i.e. what reading only some of the columns saves.
+    Empty for HDF5 ntuples, whose rows are always read in full from disk: the merged
+    table-format files store the columns together, without data columns.
+    """
+    sizes = defaultdict(int)
+    if not ifile.endswith(".parquet"):
+        return {}
+    try:
+        import pyarrow.parquet as pq
+
+        meta = pq.ParquetFile(ifile).metadata
+        for irg in range(meta.num_row_groups):
+            row_group = meta.row_group(irg)
+            for icol in range(row_group.num_columns):
+                column = row_group.column(icol)
+                sizes[column.path_in_schema] += column.total_compressed_size
+    except BaseException:
+        logging.warning(f"Could not read the column sizes of {ifile}")
+    return dict(sizes)
+
+
 def open_ntuple(
-    ifile: str, redirector: str = "root://submit50.mit.edu/", xrootd: bool = False
+    ifile: str,
+    redirector: str = "root://submit50.mit.edu/",
+    xrootd: bool = False,
+    columns: list = None,
 ):
     """
     Open a ntuple, either locally or on xrootd.
+    If columns is given, only those are loaded.
     """
     if not xrootd and "root://" not in ifile:
-        return h5load(ifile, "vars")
+        return load_ntuple(ifile, columns=columns)
     else:
         if "root://" in ifile:
             xrd_file = ifile
         else:
             xrd_file = redirector + ifile
-        just_file = ifile.split("/")[-1].split(".")[0]
-        os.system(f"xrdcp -s {xrd_file} {just_file}.hdf5")
-        return h5load(just_file + ".hdf5", "vars")
+        just_file = os.path.basename(ifile)
+        if not fetch_file(xrd_file, just_file):
+            return 0, 0
+        return load_ntuple(just_file, columns=columns)
 
 
 def close_ntuple(ifile: str) -> None:
     """
     Delete the ntuple after it has been copied over via xrootd (see open_ntuple).
     """
-    just_file = ifile.split("/")[-1].split(".")[0]
-    os.system(f"rm {just_file}.hdf5")
+    just_file = os.path.basename(ifile)
+    if os.path.exists(just_file):
+        os.remove(just_file)
+
+
+def fetch_file(
+    src: str,
+    dst: str,
+    timeout: float = 120,
+    max_attempts: int = 3,
+    retry_wait: float = 5,
+) -> bool:
+    """
+    Copy src to dst, via xrdcp for xrootd paths (root://...) and as a plain copy otherwise.
+    Each xrdcp attempt is killed after timeout seconds, and up to max_attempts are made.
+    Returns True if the copy succeeded.
+    """
+    for attempt in range(1, max_attempts + 1):
+        try:
+            if src.startswith("root://"):
+                result = subprocess.run(
+                    ["xrdcp", "-s", "-f", src, dst], timeout=timeout
+                )
+                if result.returncode == 0:
+                    return True
+                logging.warning(
+                    f"XRootD ERROR: {result.returncode} for file {src} "
+                    f"(attempt {attempt}/{max_attempts})"
+                )
+            else:
+                shutil.copyfile(src, dst)
+                return True
+        except subprocess.TimeoutExpired:
+            logging.warning(
+                f"TIME ERROR: {src} taking more than {timeout}s to be transferred "
+                f"(attempt {attempt}/{max_attempts})"
+            )
+        except OSError as e:
+            logging.warning(
+                f"Copy ERROR: {e} for file {src} (attempt {attempt}/{max_attempts})"
+            )
+        # don't leave partial copies around
+        if os.path.exists(dst):
+            os.remove(dst)
+        if attempt < max_attempts:
+            time.sleep(retry_wait)
+    return False
+
+
+class FilePrefetcher:
+    """
+    Iterate over a list of ntuples, copying the next nprefetch of them to a local
+    scratch directory in background threads while the current one is processed.
+    Files are yielded in order as (file, local_file), where local_file is None if the
+    copy failed. The local copy of a file is deleted once the next file is requested,
+    or when the iteration stops.
+    Paths are resolved as in open_ntuple: root://... or xrootd=True are copied over,
+    local paths are used in place, unless copy_local is set.
+
+        prefetcher = FilePrefetcher(files, redirector, xrootd=True, nprefetch=2)
+        for ifile, local_file in prefetcher:
+            df, metadata = h5load(local_file, "vars")
+        logging.info(prefetcher.report())
+    """
+
+    def __init__(
+        self,
+        files: list,
+        redirector: str = "root://submit50.mit.edu/",
+        xrootd: bool = False,
+        nprefetch: int = 2,
+        scratch_dir: str = ".",
+        timeout: float = 120,
+        max_attempts: int = 3,
+        retry_wait: float = 5,
+        copy_local: bool = False,
+    ):
+        self.files = list(files)
+        self.redirector = redirector
+        self.xrootd = xrootd
+        self.nprefetch = max(nprefetch, 0)
+        self.scratch_dir = scratch_dir
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.retry_wait = retry_wait
+        self.copy_local = copy_local
+        self._lock = threading.Lock()
+        self._copies = set()
+        self.stats = {
+            "ncopied": 0,
+            "nfailed": 0,
+            "bytes": 0,
+            "transfer_time": 0.0,
+            "wait_time": 0.0,
+            "wall_time": 0.0,
+        }
+
+    def __len__(self):
+        return len(self.files)
+
+    def source(self, ifile: str) -> str:
+        if "root://" in ifile:
+            return ifile
+        if self.xrootd:
+            return self.redirector + ifile
+        return ifile
+
+    def _fetch(self, i: int, ifile: str):
+        src = self.source(ifile)
+        if not src.startswith("root://") and not self.copy_local:
+            return src
+        # prefix with the position in the list, in case two files share a name
+        dst = os.path.join(self.scratch_dir, f"prefetch{i}_{os.path.basename(ifile)}")
+        start = time.time()
+        success = fetch_file(
+            src,
+            dst,
+            timeout=self.timeout,
+            max_attempts=self.max_attempts,
+            retry_wait=self.retry_wait,
+        )
+        with self._lock:
+            if not success:
+                self.stats["nfailed"] += 1
+                return None
+            self._copies.add(dst)
+            self.stats["ncopied"] += 1
+            self.stats["bytes"] += os.path.getsize(dst)
+            self.stats["transfer_time"] += time.time() - start
+        return dst
+
+    def release(self, local_file) -> None:
+        """
+        Delete the local copy of a file, if it was copied over.
+        """
+        with self._lock:
+            if local_file not in self._copies:
+                return
+            self._copies.discard(local_file)
+        if os.path.exists(local_file):
+            os.remove(local_file)
+
+    def __iter__(self):
+        start = time.time()
+        pending = deque()
+        todo = iter(enumerate(self.files))
+        pool = ThreadPoolExecutor(max_workers=max(self.nprefetch, 1))
+        local_file = None
+
+        def submit():
+            for i, ifile in todo:
+                pending.append((ifile, pool.submit(self._fetch, i, ifile)))
+                return
+
+        try:
+            # the current file, plus the next nprefetch
+            for _ in range(self.nprefetch + 1):
+                submit()
+            while pending:
+                ifile, future = pending.popleft()
+                wait_start = time.time()
+                local_file = future.result()
+                self.stats["wait_time"] += time.time() - wait_start
+                yield ifile, local_file
+                self.release(local_file)
+                submit()
+        finally:
+            # stopped early: drop what was not started, and clean up what was copied
+            self.release(local_file)
+            for _, future in pending:
+                future.cancel()
+            pool.shutdown(wait=True)
+            for _, future in pending:
+                if not future.cancelled():
+                    self.release(future.result())
+            self.stats["wall_time"] += time.time() - start
+
+    def report(self) -> str:
+        """
+        Summary of the transfers: volume, throughput, and time spent waiting on them.
+        """
+        mb = self.stats["bytes"] / 1024**2
+        transfer_time = self.stats["transfer_time"]
+        wall_time = self.stats["wall_time"]
+        return (
+            f"Prefetched {self.stats['ncopied']} files ({mb:.1f} MB), "
+            f"{self.stats['nfailed']} failed. "
+            f"Transfer rate {mb / transfer_time if transfer_time > 0 else 0:.1f} MB/s "
+            f"per file, {mb / wall_time if wall_time > 0 else 0:.1f} MB/s overall; "
+            f"waited {self.stats['wait_time']:.1f}s out of {wall_time:.1f}s for transfers."
+        )
+
+
+def file_signature(ifile: str, redirector: str = None, xrootd: bool = False):
+    """
+    (size, modification time) of a file, local or on xrootd (via xrdfs stat).
+    Returns None if the file can't be stat'ed.
+    """
+    if "root://" not in ifile and not xrootd:
+        try:
+            stat = os.stat(ifile)
+        except OSError:
+            return None
+        return (stat.st_size, stat.st_mtime_ns)
+
+    if "root://" in ifile:
+        # root://host//path
+        _, host, path = ifile.split("//", 2)
+        redirector, path = "root://" + host + "/", "/" + path
+    else:
+        path = ifile
+    try:
+        result = subprocess.check_output(
+            ["xrdfs", redirector, "stat", path], timeout=60
+        ).decode("utf-8")
+    except (subprocess.SubprocessError, OSError):
+        return None
+    fields = {}
+    for line in result.split("\n"):
+        if ":" in line:
+            k, v = line.split(":", 1)
+            fields[k.strip()] = v.strip()
+    if "Size" not in fields or "MTime" not in fields:
+        return None
+    return (int(fields["Size"]), fields["MTime"])
+
+
+def _hashable(obj):
+    # functions (e.g. the new_variables lambdas) are identified by their code
+    if hasattr(obj, "__code__"):
+        return _hashable(obj.__code__)
+    if hasattr(obj, "co_code"):
+        return [
+            obj.co_name,
+            obj.co_code.hex(),
+            [_hashable(c) for c in obj.co_consts],
+            list(obj.co_names),
+        ]
+    if isinstance(obj, (list, tuple)):
+        return [_hashable(o) for o in obj]
+    if isinstance(obj, dict):
+        return {str(k): _hashable(v) for k, v in obj.items()}
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        return obj
+    return repr(obj)
+
+
+def file_hash(ifile: str):
+    """
+    sha1 of the content of a local file, e.g. an input of the histmaker configuration
+    that can be regenerated in place. Returns None if the file can't be read.
+    """
+    try:
+        with open(ifile, "rb") as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def config_hash(*objects) -> str:
+    """
+    Stable hash of configuration objects (dicts, lists, strings, functions, ...),
+    which is the same from one run to the next as long as their content is.
+    """
+    return hashlib.sha1(
+        json.dumps(_hashable(objects), sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+class PartialHistCache:
+    """
+    On-disk store of the partial outputs (histograms, cutflows, gensumweight) of each
+    ntuple, for make_hists' incremental mode. Entries are keyed by the path, size and
+    modification time of the ntuple and by a hash of the histmaker configuration, so
+    only new or changed files (or all of them, after a configuration change) need to
+    be processed again. Files that can't be stat'ed are only kept in memory, for this run.
+
+        cache = PartialHistCache(cache_dir, config_hash(config, ...))
+        if not cache.has(ifile):
+            cache.save(ifile, {"hists": ..., "cutflow": ..., "gensumweight": ...})
+        partial = cache.load(ifile)
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        config_hash: str,
+        redirector: str = None,
+        xrootd: bool = False,
+    ):
+        self.cache_dir = cache_dir
+        self.config_hash = config_hash
+        self.redirector = redirector
+        self.xrootd = xrootd
+        self._paths = {}
+        self._memory = {}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, ifile: str):
+        """
+        Path of the cache entry of ifile, or None if ifile can't be cached.
+        """
+        if ifile not in self._paths:
+            signature = file_signature(ifile, self.redirector, self.xrootd)
+            if signature is None:
+                self._paths[ifile] = None
+            else:
+                key = config_hash(ifile, signature, self.config_hash)
+                name = os.path.basename(ifile).rsplit(".", 1)[0]
+                self._paths[ifile] = os.path.join(
+                    self.cache_dir, f"{name}_{key[:16]}.pkl"
+                )
+        return self._paths[ifile]
+
+    def has(self, ifile: str) -> bool:
+        if ifile in self._memory:
+            return True
+        path = self.path(ifile)
+        return path is not None and os.path.isfile(path)
+
+    def load(self, ifile: str):
+        """
+        The partial output of ifile, or None if it isn't in the cache.
+        """
+        if ifile in self._memory:
+            return self._memory[ifile]
+        if not self.has(ifile):
+            return None
+        try:
+            with open(self.path(ifile), "rb") as f:
+                return pickle.load(f)
+        except Exception as e:
+            logging.warning(f"Could not read the cache entry of {ifile}: {e}")
+            return None
+
+    def save(self, ifile: str, partial: dict) -> None:
+        path = self.path(ifile)
+        if path is None:
+            self._memory[ifile] = partial
+            return
+        # write to a temporary file first, so that interrupted runs don't leave partial entries
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(partial, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+
+class HistTreeReducer:
+    """
+    Sums dictionaries of histograms pairwise, as a binary tree, as they are added:
+    at most log2(n) partial sums are kept in memory, and the result only depends
+    on the order in which the dictionaries are added.
+
+        reducer = HistTreeReducer()
+        for hists in per_file_hists:
+            reducer.add(hists)
+        output = reducer.result()
+    """
+
+    def __init__(self):
+        self._stack = []
+
+    @staticmethod
+    def _sum(hists, other):
+        for k, h in other.items():
+            if k in hists:
+                hists[k] += h
+            else:
+                hists[k] = h
+        return hists
+
+    def add(self, hists: dict) -> None:
+        level = 0
+        while self._stack and self._stack[-1][0] == level:
+            _, previous = self._stack.pop()
+            hists = self._sum(previous, hists)
+            level += 1
+        self._stack.append((level, hists))
+
+    def result(self) -> dict:
+        hists = {}
+        while self._stack:
+            _, previous = self._stack.pop()
+            hists = self._sum(previous, hists)
+        return hists
 
 
 def get_git_info(path="."):
@@ -134,6 +678,36 @@ def format_selection(selection: str, df: pd.DataFrame) -> list:
     return selection
 
 
+def compile_selections(selections: list, df: pd.DataFrame) -> list:
+    """
+    Parse the selections of a config once, into a list of [attribute, operator, value].
+    """
+    return [format_selection(sel, df) for sel in selections]
+
+
+def evaluate_selections(df: pd.DataFrame, selections: list) -> np.ndarray:
+    """
+    Evaluate each compiled selection exactly once on df, and return the results as a
+    bit-packed mask matrix of shape (n_events, ceil(n_selections / 8)), where bit i of
+    an event is set if it passes selection i.
+    """
+    passed = np.zeros((df.shape[0], len(selections)), dtype=bool)
+    for i, sel in enumerate(selections):
+        passed[:, i] = make_selection(df, sel[0], sel[1], sel[2], apply=False)
+    return np.packbits(passed, axis=1, bitorder="little")
+
+
+def passes_selections(packed_masks: np.ndarray, required) -> np.ndarray:
+    """
+    Boolean mask of the events that pass all the selections with index in required,
+    from the bit-packed mask matrix of evaluate_selections.
+    """
+    bits = np.zeros(packed_masks.shape[1] * 8, dtype=bool)
+    bits[list(required)] = True
+    required_packed = np.packbits(bits, bitorder="little")
+    return np.all((packed_masks & required_packed) == required_packed, axis=1)
+
+
 def make_selection(
     df: pd.DataFrame, variable: str, operator: str, value, apply: bool = True
 ) -> pd.DataFrame:
@@ -199,38 +773,63 @@ def apply_scaling_weights(
 
     x_var_regions = abcd["x_var_regions"]
     y_var_regions = abcd["y_var_regions"]
-    iRegion = 0
-
-    # S1 regions
-    for i in range(len(x_var_regions) - 1):
-        x_val_lo = x_var_regions[i]
-        x_val_hi = x_var_regions[i + 1]
+    z_edges, ratios = compile_scaling_weights(
+        scaling_weights, x_var_regions, y_var_regions, regions
+    )
 
-        # nconst regions
-        for j in range(len(y_var_regions) - 1):
-            y_val_lo = y_var_regions[j]
-            y_val_hi = y_var_regions[j + 1]
+    # one bin index per axis, then a single gather, ratio is 1 outside of the bins
+    ix = np.digitize(df[x_var].to_numpy(), x_var_regions) - 1
+    iy = np.digitize(df[y_var].to_numpy(), y_var_regions) - 1
+    iz = np.digitize(df[z_var].to_numpy(), z_edges) - 1
+    inside = (
+        (ix >= 0)
+        & (ix < ratios.shape[0])
+        & (iy >= 0)
+        & (iy < ratios.shape[1])
+        & (iz >= 0)
+        & (iz < ratios.shape[2])
+    )
+    ratio = np.ones(df.shape[0])
+    ratio[inside] = ratios[ix[inside], iy[inside], iz[inside]]
 
-            r = regions[iRegion]
+    df["event_weight"] = df["event_weight"].to_numpy() * ratio
+    return df
 
-            # from the weights
-            bins = scaling_weights[r]["bins"]
-            ratios = scaling_weights[r]["ratios"]
 
-            # ht bins
-            for k in range(len(bins) - 1):
-                z_val_lo = bins[k]
-                z_val_hi = bins[k + 1]
-                ratio = ratios[k]
+def compile_scaling_weights(
+    scaling_weights,
+    x_var_regions: list,
+    y_var_regions: list,
+    regions: str = "ABCDEFGHIJKLMNOPQRSTUVWXYZ",
+):
+    """
+    Compile the per-region scaling weights into a dense array of ratios of shape
+    (n x regions, n y regions, n z bins), over the union of the z bins of all regions,
+    which is 1 where a region has no ratio defined.
+    Returns the z bin edges and the array of ratios.
+    """
+    nx = len(x_var_regions) - 1
+    ny = len(y_var_regions) - 1
+    region_bins = [
+        np.asarray(scaling_weights[regions[iRegion]]["bins"])
+        for iRegion in range(nx * ny)
+    ]
+    z_edges = np.unique(np.concatenate(region_bins))
 
-                zslice = (df[z_var] >= z_val_lo) & (df[z_var] < z_val_hi)
-                yslice = (df[y_var] >= y_val_lo) & (df[y_var] < y_val_hi)
-                xslice = (df[x_var] >= x_val_lo) & (df[x_var] < x_val_hi)
+    ratios = np.ones((nx, ny, len(z_edges) - 1))
+    iRegion = 0
+    for i in range(nx):
+        for j in range(ny):
+            bins = region_bins[iRegion]
+            region_ratios = np.asarray(scaling_weights[regions[iRegion]]["ratios"])
 
-                df.loc[xslice & yslice & zslice, "event_weight"] *= ratio
+            # each bin of z_edges is inside a single bin of this region, or outside all of them
+            k = np.searchsorted(bins, z_edges[:-1], side="right") - 1
+            valid = (k >= 0) & (k < len(bins) - 1)
+            ratios[i, j, valid] = region_ratios[k[valid]]
 
             iRegion += 1
-    return df
+    return z_edges, ratios
 
 
 def prepare_DataFrame(
@@ -241,6 +840,7 @@ def prepare_DataFrame(
     isMC: bool = False,
     cutflow: dict = {},
     output: dict = {},
+    weight_vars: dict = None,
 ) -> pd.DataFrame:
     """
     Applies blinding, selections, and makes new variables. See README.md for more details.
@@ -251,10 +851,16 @@ def prepare_DataFrame(
         label_out: label associated with the output (e.g. "ISRRemoval"), as keys in
                    the config dictionary.
         sys: str of systematic being applied.
+        weight_vars: dictionary of output label: weight column, to fill the cutflows and
+                   N-1 histograms of several systematics that share the same selections.
+                   Defaults to {label_out: "event_weight"}.
 
     OUTPUT: df: input DataFrame prepared for plotting
     """
 
+    if weight_vars is None:
+        weight_vars = {label_out: "event_weight"}
+
     # 1. keep only events that passed this method, if any defined
     if config.get("method_var"):
         if config["method_var"] not in df.columns:
@@ -283,61 +889,123 @@ def prepare_DataFrame(
 
         # store number of events passing using the event weights into the cutflow dict (this is redundant since the last cutflow value from ntuplemaker already exists)
         cutflow_label = "cutflow_histmaker_total"
-        if cutflow_label in cutflow.keys():
-            cutflow[cutflow_label] += np.sum(df["event_weight"])
-        else:
-            cutflow[cutflow_label] = np.sum(df["event_weight"])
+        for wvar in weight_vars.values():
+            if cutflow_label in cutflow.keys():
+                cutflow[cutflow_label] += np.sum(df[wvar])
+            else:
+                cutflow[cutflow_label] = np.sum(df[wvar])
+
+        # evaluate each selection once, the N-1 and cutflow masks are derived from these
+        selections = compile_selections(config["selections"], df)
+        packed_masks = evaluate_selections(df, selections)
+        weights = {label: df[wvar].to_numpy() for label, wvar in weight_vars.items()}
 
         # make n-1 plots
-        for i, isel in enumerate(config["selections"]):
-            isel = format_selection(isel, df)
+        for i, isel in enumerate(selections):
 
             # if the histogram is already initialized for this variable, make the N-1 histogram
-            histName = isel[0] + "_" + label_out
-            if histName not in output.keys():
+            labels = [
+                label for label in weight_vars if isel[0] + "_" + label in output.keys()
+            ]
+            if len(labels) == 0:
                 continue
 
-            n1HistName = (
-                isel[0]
-                + "_noCut_"
-                + isel[0]
-                + "_"
-                + isel[1]
-                + "_"
-                + str(isel[2])
-                + "_"
-                + label_out
+            # apply all but the ith selection
+            mask = passes_selections(
+                packed_masks, [j for j in range(len(selections)) if j != i]
             )
-            if n1HistName not in output.keys():
-                output[n1HistName] = output[histName].copy()
+            mask &= ~df[config["method_var"]].isnull().to_numpy()
+            values = df[isel[0]].to_numpy()[mask]
+
+            for label in labels:
+                histName = isel[0] + "_" + label
+                n1HistName = (
+                    isel[0]
+                    + "_noCut_"
+                    + isel[0]
+                    + "_"
+                    + isel[1]
+                    + "_"
+                    + str(isel[2])
+                    + "_"
+                    + label
+                )
+                if n1HistName not in output.keys():
+                    output[n1HistName] = output[histName].copy()
+
+                output[n1HistName].fill(values, weight=weights[label][mask])
+
+        # store number of events passing each successive selection using the event weights into the cutflow dict
+        mask = np.ones(df.shape[0], dtype=bool)
+        for isel, sel in enumerate(selections):
+            mask = passes_selections(packed_masks, range(isel + 1))
+            for label in weight_vars.keys():
+                cutflow_label = (
+                    "cutflow_" + sel[0] + "_" + sel[1] + "_" + str(sel[2]) + "_" + label
+                )
+                if cutflow_label in cutflow.keys():
+                    cutflow[cutflow_label] += np.sum(weights[label][mask])
+                else:
+                    cutflow[cutflow_label] = np.sum(weights[label][mask])
 
-            # apply all but the ith selection
-            mask = ~df[config["method_var"]].isnull()
-            for j, jsel in enumerate(config["selections"]):
-                if j == i:
-                    continue
-                jsel = format_selection(jsel, df)
-                jmask = make_selection(df, jsel[0], jsel[1], jsel[2], apply=False)
-                mask = mask & jmask
+        # now, apply selections, gathering the rows only once
+        df = df[mask]
 
-            assert len(mask) == df.shape[0]
-            output[n1HistName].fill(df[mask][isel[0]], weight=df[mask]["event_weight"])
+    return df
 
-        # now, apply selections
-        for isel, sel in enumerate(config["selections"]):
-            sel = format_selection(sel, df)
-            df = make_selection(df, sel[0], sel[1], sel[2], apply=True)
 
-            # store number of events passing using the event weights into the cutflow dict
-            cutflow_label = (
-                "cutflow_" + sel[0] + "_" + sel[1] + "_" + str(sel[2]) + "_" + label_out
-            )
-            if cutflow_label in cutflow.keys():
-                cutflow[cutflow_label] += np.sum(df["event_weight"])
-            else:
-                cutflow[cutflow_label] = np.sum(df["event_weight"])
+def config_columns(config: dict) -> set:
+    """
+    Columns used by an output config: method, ABCD and SR variables, selections,
+    and the inputs of the new variables (see prepare_DataFrame and auto_fill).
+    """
+    columns = set()
+    for key in ["method_var", "xvar", "yvar"]:
+        if key in config.keys():
+            columns.add(config[key])
+    for key in ["SR", "SR2"]:
+        for sel in config.get(key, []):
+            columns.add(sel[0])
+    for sel in config.get("selections", []):
+        columns.add(sel.split(" ")[0] if type(sel) is str else sel[0])
+    for var in config.get("new_variables", []):
+        columns.update(var[2])
+    return columns
+
+
+def histogram_columns(hist_names: list, label_out: str, input_method: str) -> set:
+    """
+    Columns that auto_fill can fill in the histograms of label_out: event wide
+    variables (var_label_out), method variables (label_out replaced by input_method),
+    and the variables of the ND histograms (ND_var1_vs_var2_label_out).
+    Some of these are not actual columns, which is harmless.
+    """
+    columns = set()
+    for name in hist_names:
+        if label_out not in name:
+            continue
+        columns.add(name.replace(label_out, input_method))
+        if name.endswith("_" + label_out):
+            var = name[: -(len(label_out) + 1)]
+            columns.add(var)
+            if "_vs_" in var:
+                for v in var[3:].split("_vs_"):
+                    columns.update([v, v + "_" + input_method])
+    return columns
 
-    return df
+
+def plan_columns(configs: list, hist_names: list, extra_columns: list = []) -> list:
+    """
+    Minimal list of ntuple columns needed to fill the histograms hist_names for the
+    output configs, passed as a list of (label_out, config) pairs that should include
+    the systematic variations of the configs, since these cut on different columns.
+    Columns that are not in a ntuple are skipped when reading it (see load_ntuple).
+    """
+    columns = set(extra_columns)
+    for label_out, config in configs:
+        columns |= config_columns(config)
+        columns |= histogram_columns(hist_names, label_out, config["input_method"])
+    return sorted(columns)
 
 
 def is_number(s: str) -> bool:
@@ -360,7 +1028,9 @@ def make_new_variable(
     return df
 
 
-def fill_ND_distributions(df, output, label_out, input_method):
+def fill_ND_distributions(
+    df, output, label_out, input_method, weight_var="event_weight"
+):
     """
     Fill all N>1 dimensional histograms.
     To do, we expect that they are named as follows:
@@ -390,7 +1060,21 @@ def fill_ND_distributions(df, output, label_out, input_method):
         if skip:
             continue
 
-        output[key].fill(*[df[var] for var in variables], weight=df["event_weight"])
+        output[key].fill(*[df[var] for var in variables], weight=df[weight_var])
+
+
+def abcd_region_index(x, y, xvar_regions: list, yvar_regions: list) -> np.ndarray:
+    """
+    Index of the ABCD region of each event, where region iRegion = i * ny + j covers
+    xvar_regions[i] <= x < xvar_regions[i + 1] and yvar_regions[j] <= y < yvar_regions[j + 1],
+    as in auto_fill. -1 for events outside of all the regions.
+    """
+    nx = len(xvar_regions) - 1
+    ny = len(yvar_regions) - 1
+    ix = np.digitize(x, xvar_regions) - 1
+    iy = np.digitize(y, yvar_regions) - 1
+    inside = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+    return np.where(inside, ix * ny + iy, -1)
 
 
 def auto_fill(
@@ -400,6 +1084,7 @@ def auto_fill(
     label_out: str,
     isMC: bool = False,
     do_abcd: bool = False,
+    weight_var: str = "event_weight",
 ) -> None:
     input_method = config["input_method"]
 
@@ -411,25 +1096,25 @@ def auto_fill(
     # 1. fill the distributions as they are saved in the dataframes
     # 1a. fill event wide variables
     event_plot_labels = [
-        key for key in df.keys() if key + "_" + label_out in list(output.keys())
+        key for key in df.keys() if key + "_" + label_out in output.keys()
     ]
     for plot in event_plot_labels:
-        output[plot + "_" + label_out].fill(df[plot], weight=df["event_weight"])
+        output[plot + "_" + label_out].fill(df[plot], weight=df[weight_var])
 
     # 1b. fill method variables
     method_plot_labels = [
         key
         for key in df.keys()
-        if key.replace(input_method, label_out) in list(output.keys())
+        if key.replace(input_method, label_out) in output.keys()
         and key.endswith(input_method)
     ]
     for plot in method_plot_labels:
         output[plot.replace(input_method, label_out)].fill(
-            df[plot], weight=df["event_weight"]
+            df[plot], weight=df[weight_var]
         )
 
     # 2. fill some ND distributions
-    fill_ND_distributions(df, output, label_out, input_method)
+    fill_ND_distributions(df, output, label_out, input_method, weight_var)
 
     # 3. divide the dfs by region
     if do_abcd:
@@ -438,65 +1123,37 @@ def auto_fill(
         yvar = config["yvar"]
         xvar_regions = config["xvar_regions"]
         yvar_regions = config["yvar_regions"]
-        iRegion = 0
-        for i in range(len(xvar_regions) - 1):
-            x_val_lo = xvar_regions[i]
-            x_val_hi = xvar_regions[i + 1]
-
-            for j in range(len(yvar_regions) - 1):
-                r = regions[iRegion] + "_"
-
-                y_val_lo = yvar_regions[j]
-                y_val_hi = yvar_regions[j + 1]
-
-                x_cut = make_selection(
-                    df, xvar, ">=", x_val_lo, False
-                ) & make_selection(df, xvar, "<", x_val_hi, False)
-                y_cut = make_selection(
-                    df, yvar, ">=", y_val_lo, False
-                ) & make_selection(df, yvar, "<", y_val_hi, False)
-                df_r = df.loc[(x_cut & y_cut)]
-
-                # double check the region is defined correctly
-                assert (
-                    df_r[
-                        (df_r[xvar] > float(x_val_hi)) | (df_r[xvar] < float(x_val_lo))
-                    ].shape[0]
-                    == 0
-                )
+        n_regions = (len(xvar_regions) - 1) * (len(yvar_regions) - 1)
 
-                # double check blinding
-                if (
-                    iRegion == (len(xvar_regions) - 1) * (len(yvar_regions) - 1)
-                    and not isMC
-                ):
-                    if df_r.shape[0] > 0:
-                        sys.exit(
-                            label_out + ": You are not blinding correctly! Exiting."
-                        )
-
-                # by default, we only plot the ABCD variables in each region, to reduce the size of the output
-                # the option do_abcd created a histogram of each variable for each region
-
-                # 3a. fill event wide variables
-                for plot in event_plot_labels:
-                    if r + plot + "_" + label_out not in list(output.keys()):
-                        continue
-                    output[r + plot + "_" + label_out].fill(
-                        df_r[plot], weight=df_r["event_weight"]
-                    )
-
-                # 3b. fill method variables
-                for plot in method_plot_labels:
-                    if r + plot.replace(input_method, label_out) not in list(
-                        output.keys()
-                    ):
-                        continue
-                    output[r + plot.replace(input_method, label_out)].fill(
-                        df_r[plot], weight=df_r["event_weight"]
-                    )
-
-                iRegion += 1
+        # assign each event to a region once, and group the events by region
+        region = abcd_region_index(
+            df[xvar].to_numpy(), df[yvar].to_numpy(), xvar_regions, yvar_regions
+        )
+        order = np.argsort(region, kind="stable")
+        bounds = np.searchsorted(region[order], np.arange(n_regions + 1))
+
+        # by default, we only plot the ABCD variables in each region, to reduce the size of the output
+        # the option do_abcd created a histogram of each variable for each region
+        # look up which histograms exist for each variable, as (region, histogram)
+        region_hists = defaultdict(list)
+        for plot in event_plot_labels:
+            for iRegion in range(n_regions):
+                name = regions[iRegion] + "_" + plot + "_" + label_out
+                if name in output.keys():
+                    region_hists[plot].append((iRegion, output[name]))
+        for plot in method_plot_labels:
+            for iRegion in range(n_regions):
+                name = regions[iRegion] + "_" + plot.replace(input_method, label_out)
+                if name in output.keys():
+                    region_hists[plot].append((iRegion, output[name]))
+
+        # 3a., 3b. fill event wide and method variables, sorted by region
+        weights = df[weight_var].to_numpy()[order]
+        for plot, hists in region_hists.items():
+            values = df[plot].to_numpy()[order]
+            for iRegion, hist in hists:
+                start, stop = bounds[iRegion], bounds[iRegion + 1]
+                hist.fill(values[start:stop], weight=weights[start:stop])
 
 
 def apply_normalization(plots: dict, norm: float) -> dict:
@@ -576,8 +1233,7 @@ def blind_DataFrame(df: pd.DataFrame, label_out: str, SR: list) -> pd.DataFrame:
     """
     if len(SR) != 2:
         sys.exit(
-            label_out
-            + """: Make sure you have correctly defined your signal region.
+            label_out + """: Make sure you have correctly defined your signal region.
             For now we only support a two-variable SR, because of the way
             this function was written. Exiting."""
         )
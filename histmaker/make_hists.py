@@ -12,11 +12,14 @@ python make_hists.py --sample <sample> --output <output_tag> --tag <tag> --era <
 
 import argparse
 import getpass
+import inspect
 import logging
+import multiprocessing
 import os
 import pickle
 import subprocess
 import sys
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
 import uproot
@@ -25,13 +28,8 @@ from tqdm import tqdm
 sys.path.append("..")
 import fill_utils
 import hist_defs
-from CMS_corrections import (
-    GNN_syst,
-    higgs_reweight,
-    pileup_weight,
-    track_killing,
-    triggerSF,
-)
+from CMS_corrections import GNN_syst, higgs_reweight, track_killing
+from CMS_corrections.weight_provider import WeightProvider
 
 import plotting.plot_utils as plot_utils
 
@@ -138,6 +136,41 @@ def makeParser(parser=None):
         help="xrootd redirector (default: root://submit50.mit.edu/)",
         required=False,
     )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=2,
+        help="Number of files to copy over ahead of time when using xrootd (default=2)",
+        required=False,
+    )
+    parser.add_argument(
+        "--projectColumns",
+        type=int,
+        default=1,
+        help="Only load the columns of the ntuples needed to fill the histograms, only Parquet ntuples also skip reading the others from disk (default=True)",
+        required=False,
+    )
+    parser.add_argument(
+        "--chunkSize",
+        type=int,
+        default=0,
+        help="Fill the ntuples in chunks of this many rows, to bound the memory used (default=0, whole files)",
+        required=False,
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes to fill the files with (default=1)",
+        required=False,
+    )
+    parser.add_argument(
+        "--cacheDir",
+        type=str,
+        default="",
+        help="Directory where the histograms of each ntuple are cached, so that a rerun only processes the new or changed ntuples (default: no caching)",
+        required=False,
+    )
     parser.add_argument(
         "--maxFiles",
         type=int,
@@ -162,159 +195,471 @@ def makeParser(parser=None):
 
 ### Main plotting function  ######################################################################################
 
+# columns used for the event weights in WeightProvider, on top of those of the systematics
+WEIGHT_COLUMNS = ["genweight", "Pileup_nTrueInt", "prefire_nom", "ht", "SUEP_genPt"]
 
-def plot_systematic(df, metadata, config, syst, options, output, cutflow={}):
-    # we might modify this for systematics, so make a copy
-    config = config.copy()
+# options that change the histograms of a file, and so invalidate the --cacheDir entries
+CACHE_OPTIONS = [
+    "era",
+    "isMC",
+    "channel",
+    "scouting",
+    "doInf",
+    "doABCD",
+    "doSyst",
+    "blind",
+    "weights",
+]
 
-    # prepare new event weight
-    if options.isMC:
-        df["event_weight"] = df["genweight"].to_numpy()
+
+def get_syst_config(config, syst, options):
+    """
+    Return the config to use for a systematic: a modified copy for the systematics
+    that change the selections, or config itself for those that only change the weights.
+    """
+    if options.isMC and options.channel == "ggF":
+        # 6) track killing
+        if "track_down" in syst:
+            # update configuration to cut on track_down variables
+            return fill_utils.get_track_killing_config(config)
+
+        # 7) jet energy corrections
+        if any([j in syst for j in ["JER", "JES"]]):
+            # update configuration to cut on jet energy correction variables
+            return fill_utils.get_jet_correction_config(config, syst)
+
+    return config
+
+
+def weight_var(syst):
+    return "event_weight_" + syst if len(syst) > 0 else "event_weight"
+
+
+def plot_systematics(
+    df,
+    metadata,
+    config,
+    systs,
+    options,
+    output,
+    weight_provider,
+    cutflow={},
+    higgs_tables=None,
+):
+    """
+    Fill the histograms for the nominal ("") and all the systematics in systs at once.
+    The event weights are computed once per systematic, and the systematics that only
+    change the weights share the selections and new variables of the nominal, so that
+    each output label is prepared once for all of them and then filled once per weight.
+    The systematics that change the selections (track_down, JER/JES) are prepared
+    separately, with their weights.
+    df can be a chunk of a file, as long as higgs_tables (see WeightProvider.weights)
+    is computed from the whole file.
+    """
+    # the sample is only used for MC, merged data ntuples have no metadata (0)
+    sample = metadata["sample"] if options.isMC and metadata != 0 else ""
+    weights = {
+        syst: weight_provider.weights(df, syst, sample, higgs_tables) for syst in systs
+    }
+
+    # scaling weights
+    # N.B.: these are just an optional, arbitrary scaling of weights you're passing in
+    # the scaling is the same for all the systematics, so compute it once
+    if options.weights is not None and options.weights != "None":
+        scaling_weights = fill_utils.read_in_weights(options.weights)
+        df_scaling = df.copy()
+        df_scaling["event_weight"] = np.ones(df.shape[0])
+        scaling = fill_utils.apply_scaling_weights(
+            df_scaling,
+            scaling_weights,
+            config["Cluster"],
+            regions="ABCDEFGHI",
+            x_var="SUEP_S1_CL",
+            y_var="SUEP_nconst_CL",
+            z_var="ht",
+        )["event_weight"].to_numpy()
+        weights = {syst: w * scaling for syst, w in weights.items()}
+
+    for syst, w in weights.items():
+        df[weight_var(syst)] = w
+
+    # group the systematics by the config they are run with
+    groups = []
+    for syst in systs:
+        syst_config = get_syst_config(config, syst, options)
+        for group_config, group_systs in groups:
+            if group_config is syst_config:
+                group_systs.append(syst)
+                break
+        else:
+            groups.append((syst_config, [syst]))
+
+    for group_config, group_systs in groups:
+        logging.debug(f"Running systematics {group_systs}")
+        for label_out, config_out in group_config.items():
+            # rename output method if we have applied a systematic
+            weight_vars = {}
+            for syst in group_systs:
+                label_syst = label_out + "_" + syst if len(syst) > 0 else label_out
+                weight_vars[label_syst] = weight_var(syst)
+
+                # initialize new hists for this output tag, if we haven't already
+                hist_defs.initialize_histograms(output, label_syst, options, config_out)
+
+            # prepare the DataFrame for plotting: blind, selections, new variables
+            df_plot = fill_utils.prepare_DataFrame(
+                df.copy(),
+                config_out,
+                label_out,
+                isMC=options.isMC,
+                blind=options.blind,
+                cutflow=cutflow,
+                output=output,
+                weight_vars=weight_vars,
+            )
+
+            # if there are no events left after selections, no need to fill histograms
+            if df_plot is None:
+                continue
+
+            for label_syst, wvar in weight_vars.items():
+                # print out events that pass the selections, if requested
+                if options.printEvents:
+                    print("Events passing selections for", label_syst)
+                    for index, row in df_plot.iterrows():
+                        print(
+                            f"{int(row['event'])}, {int(row['run'])}, {int(row['luminosityBlock'])}"
+                        )
+
+                # auto fill all histograms
+                fill_utils.auto_fill(
+                    df_plot,
+                    output,
+                    config_out,
+                    label_syst,
+                    isMC=options.isMC,
+                    do_abcd=options.doABCD,
+                    weight_var=wvar,
+                )
+
+
+def check_sample(sample, file_sample):
+    """
+    Check that the sample of a file (from its metadata) is consistent with the one
+    we are running on, and return the sample to use from now on.
+    """
+    if sample is None:  # we did not pass in any sample, and this is the first file
+        return file_sample
+    if file_sample == "X":
+        # default option for ntuplemaker, when not run properly specifying which sample. Ignore this.
+        return sample
+    # if we already have a sample, check it matches the metadata of the first file or what we passed in
+    assert (
+        sample == file_sample
+    ), "This script should only run on one sample at a time. Found {} in metadata, and passed sample {}".format(
+        file_sample, sample
+    )
+    return sample
+
+
+def merge_cutflows(cutflow, other):
+    """
+    Add the cutflows of one file to the totals.
+    """
+    for k, v in other.items():
+        cutflow[k] = cutflow[k] + v if k in cutflow else v
+
+
+def merge_hists(hists, other):
+    """
+    Add the histograms of one file to the totals.
+    """
+    for k, h in other.items():
+        if k in hists:
+            hists[k] += h
+        else:
+            hists[k] = h
+
+
+def fill_file(
+    ifile,
+    local_file,
+    config,
+    options,
+    columns,
+    weight_provider,
+    output=None,
+    cutflow=None,
+):
+    """
+    Read one ntuple and fill its histograms and cutflows into output and cutflow,
+    or, if these are None, into a new output for the file alone.
+    Files read in chunks are only added to output and cutflow once they are read
+    completely.
+    Returns the outputs of the file: "hists", "cutflow", "gensumweight", "sample",
+    and the bytes read with the column projection (for Parquet files), or None if
+    the file couldn't be read.
+    """
+    # get the file, in chunks of options.chunkSize rows
+    if local_file is None:
+        chunks, metadata = 0, 0
     else:
-        df["event_weight"] = np.ones(df.shape[0])
+        chunks, metadata = fill_utils.load_ntuple_chunks(
+            local_file, columns=columns, chunksize=options.chunkSize
+        )
+    logging.debug(f"Opened file {ifile}")
+    if options.printEvents:
+        print(f"Opened file {ifile}")
+
+    # check if file is corrupted
+    if type(chunks) == int:
+        return None
+
+    # the Higgs pT weights depend on the whole file, compute their tables once per file,
+    # before going through the chunks, and use them for all the systematics
+    uses_higgs_weights = (
+        options.isMC
+        and metadata != 0
+        and weight_provider.uses_higgs_weights(metadata["sample"])
+    )
+    higgs_tables = None
+    if options.chunkSize > 0 and uses_higgs_weights:
+        gen_pt, _ = fill_utils.load_ntuple(local_file, columns=["SUEP_genPt"])
+        # check if file is corrupted
+        if type(gen_pt) == int:
+            return None
+        # files where no events passed the selections only have the "empty" column
+        if "SUEP_genPt" in gen_pt.columns:
+            higgs_tables = higgs_reweight.higgs_reweight(gen_pt["SUEP_genPt"])
+
+    result = {
+        "sample": metadata.get("sample") if metadata != 0 else None,
+        "gensumweight": 0,
+        "bytes_read": 0,
+        "bytes_total": 0,
+    }
 
-    # apply systematics and weights
-    if options.isMC:
+    # a file read in chunks can fail after some of them are filled: fill it into its
+    # own output, and only add it to output and cutflow once all of it was read
+    partial = output is None
+    staged = not partial and options.chunkSize > 0
+    if partial or staged:
+        file_output, file_cutflow = {"labels": []}, {}
+    else:
+        file_output, file_cutflow = output, cutflow
+
+    # update the gensumweight
+    if options.isMC and metadata != 0:
+        logging.debug("Updating gensumweight.")
+        result["gensumweight"] += metadata["gensumweight"]
+
+    # update the cutflows
+    if metadata != 0 and any(["cutflow" in k for k in metadata.keys()]):
+        logging.debug("Updating cutflows.")
+        for k, v in metadata.items():
+            if "cutflow" in k:
+                if k not in file_cutflow.keys():
+                    file_cutflow[k] = v
+                else:
+                    file_cutflow[k] += v
+
+    chunks = enumerate(chunks)
+    while True:
+        # read errors of the table-format HDF5 and Parquet files come with the chunks
+        try:
+            ichunk, df = next(chunks)
+        except StopIteration:
+            break
+        except Exception:
+            logging.warning(f"Some error occurred reading {ifile}")
+            return None
+
+        # log how much the column projection saved: bytes read from disk for Parquet,
+        # only memory for HDF5, whose rows are read in full
+        if ichunk == 0 and columns is not None:
+            sizes = fill_utils.ntuple_column_sizes(local_file)
+            if len(sizes) > 0:
+                result["bytes_read"] = sum(
+                    [v for k, v in sizes.items() if k in df.columns]
+                )
+                result["bytes_total"] = sum(sizes.values())
+                logging.debug(
+                    f"Read {len(df.columns)}/{len(sizes)} columns of {ifile}, "
+                    f"saved {(result['bytes_total'] - result['bytes_read']) / 1024**2:.1f} "
+                    f"of {result['bytes_total'] / 1024**2:.1f} MB read from disk"
+                )
+            else:
+                logging.debug(
+                    f"Kept {len(df.columns)} columns of {ifile} in memory, "
+                    "the HDF5 rows are read in full from disk"
+                )
 
-        # 1) pileup weights
-        puweights, puweights_up, puweights_down = pileup_weight.pileup_weight(
-            options.era
+        # check if any events passed the selections
+        if "empty" in list(df.keys()):
+            logging.debug("No events passed the selections, skipping.")
+            break
+        if df.shape[0] == 0:
+            logging.debug("No events in file, skipping.")
+            continue
+
+        # without chunks, the only chunk is the whole file
+        if uses_higgs_weights and higgs_tables is None:
+            higgs_tables = higgs_reweight.higgs_reweight(df["SUEP_genPt"])
+
+        # define which systematics to loop over
+        # merged data ntuples have no metadata (0)
+        sys_loop = get_systematics(
+            options, metadata["sample"] if options.isMC and metadata != 0 else ""
         )
-        pu = pileup_weight.get_pileup_weights(
-            df, syst, puweights, puweights_up, puweights_down
+
+        logging.debug("Running nominal and systematic histograms.")
+        plot_systematics(
+            df,
+            metadata,
+            config,
+            [""] + sys_loop,
+            options,
+            file_output,
+            weight_provider,
+            file_cutflow,
+            higgs_tables,
         )
-        df["event_weight"] *= pu
+        del df
 
-        # 2) PS weights
-        if "PSWeight" in syst and syst in df.keys():
-            df["event_weight"] *= df[syst]
+    if partial or staged:
+        file_output.pop("labels")
+    if staged:
+        merge_hists(output, file_output)
+        merge_cutflows(cutflow, file_cutflow)
+    elif partial:
+        result["hists"] = file_output
+        result["cutflow"] = file_cutflow
+    return result
 
-        # 3) prefire weights
-        if options.era == "2016" or options.era == "2017":
-            if "prefire" in syst and syst in df.keys():
-                df["event_weight"] *= df[syst]
-            else:
-                df["event_weight"] *= df["prefire_nom"]
 
-        if options.channel == "ggF":
-            if options.scouting != 1:
-                # 2) TriggerSF weights
-                (
-                    trig_bins,
-                    trig_weights,
-                    trig_weights_up,
-                    trig_weights_down,
-                ) = triggerSF.triggerSF(options.era)
-                trigSF = triggerSF.get_trigSF_weight(
-                    df,
-                    syst,
-                    trig_bins,
-                    trig_weights,
-                    trig_weights_up,
-                    trig_weights_down,
-                )
-                df["event_weight"] *= trigSF
+# set in each worker process by fill_files_parallel
+_worker_setup = None
 
-            else:
-                # 2) TriggerSF weights
-                trigSF = triggerSF.get_scout_trigSF_weight(
-                    np.array(df["ht"]).astype(int), syst, options.era
-                )
-                df["event_weight"] *= trigSF
 
-                # 4) prefire weights
-                # no prefire weights for scouting
+def _init_worker(*setup):
+    global _worker_setup
+    _worker_setup = setup
 
-            # 5) Higgs_pt weights
-            if "mS125" in metadata["sample"]:
-                (
-                    higgs_bins,
-                    higgs_weights,
-                    higgs_weights_up,
-                    higgs_weights_down,
-                ) = higgs_reweight.higgs_reweight(df["SUEP_genPt"])
-                higgs_weight = higgs_reweight.get_higgs_weight(
-                    df,
-                    syst,
-                    higgs_bins,
-                    higgs_weights,
-                    higgs_weights_up,
-                    higgs_weights_down,
-                )
-                df["event_weight"] *= higgs_weight
 
-            # 6) track killing
-            if "track_down" in syst:
-                # update configuration to cut on track_down variables
-                config = fill_utils.get_track_killing_config(config)
+def _fill_file_worker(ifile):
+    config, options, columns, weight_provider = _worker_setup
+    prefetcher = fill_utils.FilePrefetcher(
+        [ifile],
+        redirector=options.redirector,
+        xrootd=options.xrootd,
+        nprefetch=0,
+    )
+    result = None
+    for _, local_file in prefetcher:
+        result = fill_file(ifile, local_file, config, options, columns, weight_provider)
+    return ifile, result
 
-            # 7) jet energy corrections
-            if any([j in syst for j in ["JER", "JES"]]):
-                # update configuration to cut on jet energy correction variables
-                config = fill_utils.get_jet_correction_config(config, syst)
 
-        elif options.channel == "WH":
-            pass
-            # FILL IN
-            # should we keep these separate or try to, as much as possible, use the same code for systematics for both channels?
-            # which systematics are applied and which aren't should be defined outside IMO, as is now
-            # and in here we should just apply them as much as possible in the same way
-            # with flags for the differences
+def fill_files_parallel(files, config, options, columns, weight_provider):
+    """
+    Fill each file into its own output with fill_file, in a pool of options.workers
+    processes. Yields (file, outputs) in the order of files.
+    The processes are forked, so that the configuration (with its lambdas) and the
+    weight tables don't need to be pickled and sent over.
+    """
+    with ProcessPoolExecutor(
+        max_workers=options.workers,
+        mp_context=multiprocessing.get_context("fork"),
+        initializer=_init_worker,
+        initargs=(config, options, columns, weight_provider),
+    ) as pool:
+        yield from pool.map(_fill_file_worker, files)
 
-    # scaling weights
-    # N.B.: these are just an optional, arbitrary scaling of weights you're passing in
-    if options.weights is not None and options.weights != "None":
-        scaling_weights = fill_utils.read_in_weights(options.weights)
-        df = fill_utils.apply_scaling_weights(
-            df.copy(),
-            scaling_weights,
-            config["Cluster"],
-            regions="ABCDEFGHI",
-            x_var="SUEP_S1_CL",
-            y_var="SUEP_nconst_CL",
-            z_var="ht",
-        )
 
-    for label_out, config_out in config.items():
-        # rename output method if we have applied a systematic
-        if len(syst) > 0:
-            label_out = label_out + "_" + syst
-
-        # initialize new hists for this output tag, if we haven't already
-        hist_defs.initialize_histograms(output, label_out, options, config_out)
-
-        # prepare the DataFrame for plotting: blind, selections, new variables
-        df_plot = fill_utils.prepare_DataFrame(
-            df.copy(),
-            config_out,
-            label_out,
-            isMC=options.isMC,
-            blind=options.blind,
-            cutflow=cutflow,
-            output=output,
-        )
+def get_systematics(options, sample):
+    """
+    Systematic variations to run for a sample, on top of the nominal.
+    """
+    sys_loop = []
+    if options.isMC and options.doSyst:
+        if options.channel == "ggF":
+            sys_loop = [
+                "puweights_up",
+                "puweights_down",
+                "trigSF_up",
+                "trigSF_down",
+                "PSWeight_ISR_up",
+                "PSWeight_ISR_down",
+                "PSWeight_FSR_up",
+                "PSWeight_FSR_down",
+                "track_down",
+                "JER_up",
+                "JER_down",
+                "JES_up",
+                "JES_down",
+            ]
+            if "mS125" in sample:
+                sys_loop += [
+                    "higgs_weights_up",
+                    "higgs_weights_down",
+                ]
+            if options.scouting == 0:
+                sys_loop += [
+                    "prefire_up",
+                    "prefire_down",
+                ]
+        elif options.channel == "WH":
+            sys_loop = [
+                "puweights_up",
+                "puweights_down",
+                "PSWeight_ISR_up",
+                "PSWeight_ISR_down",
+                "PSWeight_FSR_up",
+                "PSWeight_FSR_down",
+                "prefire_up",
+                "prefire_down",
+                "track_down",
+                "JER_up",
+                "JER_down",
+                "JES_up",
+                "JES_down",
+            ]
+            if "mS125" in sample:
+                sys_loop += [
+                    "higgs_weights_up",
+                    "higgs_weights_down",
+                ]
+    return sys_loop
 
-        # if there are no events left after selections, no need to fill histograms
-        if df_plot is None:
-            continue
 
-        # print out events that pass the selections, if requested
-        if options.printEvents:
-            print("Events passing selections for", label_out)
-            for index, row in df_plot.iterrows():
-                print(
-                    f"{int(row['event'])}, {int(row['run'])}, {int(row['luminosityBlock'])}"
+def get_needed_columns(config, options, sys_loop):
+    """
+    Plan which columns to read from the ntuples: those used by each output config
+    and its systematic variations, those filled in its histograms, and the ones
+    needed for the event weights.
+    """
+    configs = list(config.items())
+    if options.isMC and options.doSyst and options.channel == "ggF":
+        if "track_down" in sys_loop:
+            configs += list(fill_utils.get_track_killing_config(config).items())
+        for syst in sys_loop:
+            if any([j in syst for j in ["JER", "JES"]]):
+                configs += list(
+                    fill_utils.get_jet_correction_config(config, syst).items()
                 )
 
-        # auto fill all histograms
-        fill_utils.auto_fill(
-            df_plot,
-            output,
-            config_out,
-            label_out,
-            isMC=options.isMC,
-            do_abcd=options.doABCD,
-        )
+    # initialize the histograms once, to know their names
+    hists = {"labels": []}
+    for label_out, config_out in config.items():
+        hist_defs.initialize_histograms(hists, label_out, options, config_out)
+
+    extra_columns = WEIGHT_COLUMNS + sys_loop
+    if options.printEvents:
+        extra_columns += ["event", "run", "luminosityBlock"]
+    if options.weights is not None and options.weights != "None":
+        extra_columns += ["SUEP_S1_CL", "SUEP_nconst_CL", "ht"]
+
+    return fill_utils.plan_columns(configs, list(hists.keys()), extra_columns)
 
 
 def main():
@@ -776,7 +1121,7 @@ def main():
         files = [dataDir + f for f in os.listdir(dataDir)]
     if options.maxFiles > 0:
         files = files[: options.maxFiles]
-    files = [f for f in files if ".hdf5" in f]
+    files = [f for f in files if (".hdf5" in f) or (".parquet" in f)]
     ntotal = len(files)
 
     if ntotal == 0:
@@ -788,124 +1133,139 @@ def main():
     logging.info("Setup ready, filling histograms now.")
 
     sample = options.sample
-    for ifile in tqdm(files):
-        # get the file
-        df, metadata = fill_utils.open_ntuple(
-            ifile, redirector=options.redirector, xrootd=options.xrootd
-        )
-        logging.debug(f"Opened file {ifile}")
-        if options.printEvents:
-            print(f"Opened file {ifile}")
-
-        # check if file is corrupted
-        if type(df) == int:
-            nfailed += 1
-            logging.debug(f"File {ifile} is corrupted, skipping.")
-            continue
-
-        # check sample consistency
-        if metadata != 0 and "sample" in metadata.keys():
-            if (
-                sample is None
-            ):  # we did not pass in any sample, and this is the first file
-                sample = metadata["sample"]
-            elif (
-                metadata["sample"] == "X"
-            ):  # default option for ntuplemaker, when not run properly specifying which sample. Ignore this.
-                pass
-            else:  # if we already have a sample, check it matches the metadata of the first file or what we passed in
-                assert (
-                    sample == metadata["sample"]
-                ), "This script should only run on one sample at a time. Found {} in metadata, and passed sample {}".format(
-                    metadata["sample"], sample
-                )
-
-        # update the gensumweight
-        if options.isMC and metadata != 0:
-            logging.debug("Updating gensumweight.")
-            total_gensumweight += metadata["gensumweight"]
-
-        # update the cutflows
-        if metadata != 0 and any(["cutflow" in k for k in metadata.keys()]):
-            logging.debug("Updating cutflows.")
-            for k, v in metadata.items():
-                if "cutflow" in k:
-                    if k not in cutflow.keys():
-                        cutflow[k] = v
-                    else:
-                        cutflow[k] += v
-
-        # check if any events passed the selections
-        if "empty" in list(df.keys()):
-            logging.debug("No events passed the selections, skipping.")
-            continue
-        if df.shape[0] == 0:
-            logging.debug("No events in file, skipping.")
-            continue
-
-        # define which systematics to loop over
-        sys_loop = []
-        if options.isMC and options.doSyst:
-            if options.channel == "ggF":
-                sys_loop = [
-                    "puweights_up",
-                    "puweights_down",
-                    "trigSF_up",
-                    "trigSF_down",
-                    "PSWeight_ISR_up",
-                    "PSWeight_ISR_down",
-                    "PSWeight_FSR_up",
-                    "PSWeight_FSR_down",
-                    "track_down",
-                    "JER_up",
-                    "JER_down",
-                    "JES_up",
-                    "JES_down",
-                ]
-                if "mS125" in metadata["sample"]:
-                    sys_loop += [
-                        "higgs_weights_up",
-                        "higgs_weights_down",
-                    ]
-                if options.scouting == 0:
-                    sys_loop += [
-                        "prefire_up",
-                        "prefire_down",
-                    ]
-            elif options.channel == "WH":
-                sys_loop = [
-                    "puweights_up",
-                    "puweights_down",
-                    "PSWeight_ISR_up",
-                    "PSWeight_ISR_down",
-                    "PSWeight_FSR_up",
-                    "PSWeight_FSR_down",
-                    "prefire_up",
-                    "prefire_down",
-                    "track_down",
-                    "JER_up",
-                    "JER_down",
-                    "JES_up",
-                    "JES_down",
-                ]
-                if "mS125" in metadata["sample"]:
-                    sys_loop += [
-                        "higgs_weights_up",
-                        "higgs_weights_down",
-                    ]
 
-        logging.debug("Running nominal histograms.")
-        plot_systematic(df, metadata, config, "", options, output, cutflow)
+    # load the weight tables once for all the files
+    weight_provider = WeightProvider(
+        options.era, options.channel, options.scouting, options.isMC
+    )
 
-        for syst in sys_loop:
-            logging.debug(f"Running systematic {syst}")
-            plot_systematic(df, metadata, config, syst, options, output, cutflow)
+    # only read the columns needed to fill the histograms
+    columns = None
+    bytes_read, bytes_total = 0, 0
+    if options.projectColumns:
+        columns = get_needed_columns(
+            config, options, get_systematics(options, sample or "")
+        )
+        logging.debug(f"Reading only columns: {columns}")
+
+    # in incremental mode, only process the files that are not in the cache yet
+    partial_cache = None
+    files_to_process = files
+    if options.cacheDir:
+        partial_cache = fill_utils.PartialHistCache(
+            options.cacheDir,
+            fill_utils.config_hash(
+                config,
+                inspect.getsource(hist_defs),
+                {k: getattr(options, k) for k in CACHE_OPTIONS},
+                # the scaling weights file can be regenerated with the same name
+                (
+                    fill_utils.file_hash(options.weights)
+                    if options.weights is not None and options.weights != "None"
+                    else None
+                ),
+            ),
+            redirector=options.redirector,
+            xrootd=options.xrootd,
+        )
+        files_to_process = [f for f in files if not partial_cache.has(f)]
+        logging.info(
+            f"Found {ntotal - len(files_to_process)}/{ntotal} files in the cache, "
+            f"processing the other {len(files_to_process)}."
+        )
 
-        # remove file at the end of loop
-        if options.xrootd:
-            logging.debug(f"Removing file {ifile}")
-            fill_utils.close_ntuple(ifile)
+    # per-file outputs are needed to cache them, or to fill the files in parallel
+    partial_mode = partial_cache is not None or options.workers > 1
+    if not partial_mode:
+        file_output, file_cutflow = output, cutflow
+    else:
+        file_output, file_cutflow = None, None
+    hist_reducer = fill_utils.HistTreeReducer()
+
+    prefetcher = None
+    if options.workers > 1:
+        # each worker copies over and fills one file at a time
+        logging.info(f"Filling the files with {options.workers} workers.")
+        results = fill_files_parallel(
+            files_to_process, config, options, columns, weight_provider
+        )
+    else:
+        # files are copied over via xrootd in the background, while the previous ones are processed
+        prefetcher = fill_utils.FilePrefetcher(
+            files_to_process,
+            redirector=options.redirector,
+            xrootd=options.xrootd,
+            nprefetch=options.prefetch,
+        )
+        results = (
+            (
+                ifile,
+                fill_file(
+                    ifile,
+                    local_file,
+                    config,
+                    options,
+                    columns,
+                    weight_provider,
+                    file_output,
+                    file_cutflow,
+                ),
+            )
+            for ifile, local_file in prefetcher
+        )
+    progress = tqdm(total=len(files_to_process))
+
+    # go through the files in order, taking the outputs of the cached ones from the cache
+    to_process = set(files_to_process)
+    for ifile in files:
+        if ifile in to_process:
+            _, result = next(results)
+            progress.update()
+            if result is None:
+                nfailed += 1
+                logging.debug(f"File {ifile} is corrupted, skipping.")
+                continue
+            if partial_cache is not None:
+                partial_cache.save(ifile, result)
+
+            # log how much the column projection saved, for Parquet ntuples
+            bytes_read += result["bytes_read"]
+            bytes_total += result["bytes_total"]
+        else:
+            result = partial_cache.load(ifile)
+            if result is None:
+                nfailed += 1
+                logging.warning(f"Could not load the cached outputs of {ifile}.")
+                continue
 
+        # check sample consistency
+        if result["sample"] is not None:
+            sample = check_sample(sample, result["sample"])
+
+        # the gensumweight and cutflows are summed in the order of the files,
+        # the histograms of each file are summed pairwise
+        total_gensumweight += result["gensumweight"]
+        if partial_mode:
+            merge_cutflows(cutflow, result["cutflow"])
+            hist_reducer.add(result["hists"])
+    progress.close()
+    # run the iterators to their end, so that the prefetcher and the pool clean up
+    for _ in results:
+        pass
+
+    if partial_mode:
+        logging.info("Summing the outputs of each file.")
+        output.update(hist_reducer.result())
+
+    if bytes_total > 0:
+        logging.info(
+            f"Column projection saved {(bytes_total - bytes_read) / 1024**2:.1f} "
+            f"of {bytes_total / 1024**2:.1f} MB read from the Parquet ntuples"
+        )
+    if prefetcher is not None and (
+        prefetcher.stats["ncopied"] + prefetcher.stats["nfailed"] > 0
+    ):
+        logging.info(prefetcher.report())
     if nfailed > 0:
         logging.warning("Number of files that failed to be read: " + str(nfailed))
 
@@ -996,6 +1356,16 @@ def main():
             for h, hist in output.items():
                 froot[h] = hist
 
+    peak_memory, peak_memory_workers = fill_utils.peak_memory_mb()
+    logging.info(
+        f"Peak memory usage (RSS): {peak_memory:.0f} MB"
+        + (
+            f", {peak_memory_workers:.0f} MB in the workers"
+            if options.workers > 1
+            else ""
+        )
+    )
+
 
 if __name__ == "__main__":
     main()
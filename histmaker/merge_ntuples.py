@@ -1,14 +1,15 @@
 import argparse
 import getpass
 import multiprocessing
-import os
 import subprocess
 import sys
 
 import fill_utils
-import pandas as pd
 from tqdm import tqdm
 
+sys.path.append("..")
+from workflows.utils.merger import StreamingMerger
+
 
 def makeParser(parser=None):
     if parser is None:
@@ -38,19 +39,27 @@ def makeParser(parser=None):
         default=f"/store/user/{getpass.getuser()}/SUEP/",
         help="Input directory path where all the various production tags are stored, this will be joined as inputDir/tag/sample/.",
     )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=2,
+        help="Number of files to copy over ahead of time.",
+    )
+    parser.add_argument(
+        "--maxRows",
+        type=int,
+        default=5000000,
+        help="Start a new merged file once it holds more than this many events.",
+    )
+    parser.add_argument(
+        "--maxSizeMB",
+        type=float,
+        default=None,
+        help="Start a new merged file once it holds more than this many MB (uncompressed).",
+    )
     return parser
 
 
-def save_dfs(df_tot, output, metadata_tot):
-    if type(df_tot) == int:
-        print("No events in df_tot.")
-        df_tot = pd.DataFrame(["empty"], columns=["empty"])
-    store = pd.HDFStore(output)
-    store.put("vars", df_tot)
-    store.get_storer("vars").attrs.metadata = metadata_tot
-    store.close()
-
-
 def move(q, infile, outfile):
     returncode = q.get()
     result = subprocess.run(["xrdcp", "-s", infile, outfile, "-f"])
@@ -108,85 +117,54 @@ def main():
     files = result.split("\n")
     files = [f for f in files if (".hdf5" in f) and ("merged" not in f)]
 
-    # loop over files and merge them
-    df_tot = 0
-    metadata_tot = 0
-    i_out = 0
-    for ifile, file in enumerate(tqdm(files)):
-        if os.path.exists(options.sample + ".hdf5"):
-            subprocess.run(["rm", options.sample + ".hdf5"])
-        xrd_file = options.redirector + file
-
-        # If this script is running for a while, some xrdcp start to hang for too long,
-        # so we re-attempt it a couple times before quitting
+    # move each merged file to the output directory as soon as it is closed
+    def moveMergedFile(output_file):
+        print(f"xrdcp {output_file} {options.redirector + outDir}")
+        # Allow a couple resubmissions in case of xrootd failures
         result = time_limited_move(
-            xrd_file, options.sample + ".hdf5", time_limit=120, max_attempts=3
+            output_file, options.redirector + outDir, time_limit=600, max_attempts=3
         )
         if result == 0:
-            sys.exit("Result of xrootd transfer was 0: " + xrd_file)
+            print("Result of xrootd transfer was 0: " + output_file)
+        else:
+            subprocess.run(["rm", output_file])
+
+    # loop over files and append them to the merged files one at a time
+    merger = StreamingMerger(
+        options.sample + "_merged_{}.hdf5",
+        max_rows=options.maxRows,
+        max_size_mb=options.maxSizeMB,
+        isMC=options.isMC,
+        on_close=moveMergedFile,
+    )
+    # the next files are copied over in the background while the current one is merged.
+    # If this script is running for a while, some xrdcp start to hang for too long,
+    # so each transfer is re-attempted a couple times before quitting
+    prefetcher = fill_utils.FilePrefetcher(
+        files,
+        redirector=options.redirector,
+        xrootd=True,
+        nprefetch=options.prefetch,
+        timeout=120,
+        max_attempts=3,
+    )
+    for file, local_file in tqdm(prefetcher, total=len(prefetcher)):
+        if local_file is None:
+            sys.exit("Result of xrootd transfer was 0: " + options.redirector + file)
 
-        df, metadata = fill_utils.h5load(options.sample + ".hdf5", "vars")
+        df, metadata = fill_utils.h5load(local_file, "vars")
 
         # corrupted
         if type(df) == int:
             continue
 
-        ### MERGE METADATA
-        if options.isMC:
-            if type(metadata_tot) == int:  # fill metadata for the first time
-                metadata_tot = metadata
-            else:  # for successive files, increase the counts
-                metadata_tot["gensumweight"] += metadata["gensumweight"]
-                for key in metadata.keys():
-                    if key.startswith("cutflow"):
-                        metadata_tot[key] += metadata[key]
-
-        # don't need to add empty ones
-        if "empty" in list(df.keys()):
-            subprocess.run(["rm", options.sample + ".hdf5"])
-            continue
-
-        if df.shape[0] == 0:
-            subprocess.run(["rm", options.sample + ".hdf5"])
-            continue
-
-        ### MERGE DF VARS
-        if type(df_tot) == int:
-            df_tot = df
-        else:
-            df_tot = pd.concat((df_tot, df))
-
-        subprocess.run(["rm", options.sample + ".hdf5"])
-
-        # save every N events
-        if df_tot.shape[0] > 5000000:
-            output_file = options.sample + "_merged_" + str(i_out) + ".hdf5"
-            save_dfs(df_tot, output_file, metadata_tot)
-
-            # Allow a couple resubmissions in case of xrootd failures
-            result = time_limited_move(
-                output_file, options.redirector + outDir, time_limit=600, max_attempts=3
-            )
-            if result == 0:
-                print("Something messed up with file " + xrd_file)
-            else:
-                subprocess.run(["rm", output_file])
-            i_out += 1
-            df_tot = 0
-            metadata_tot = 0
+        ### MERGE DF VARS AND METADATA, empty ones only add their metadata
+        merger.append(df, metadata if options.isMC else None)
+        del df
 
     # save last file as well
-    output_file = options.sample + "_merged_" + str(i_out) + ".hdf5"
-    save_dfs(df_tot, output_file, metadata_tot)
-    print(f"xrdcp {output_file} {options.redirector + outDir}")
-    # Allow a couple resubmissions in case of xrootd failures
-    result = time_limited_move(
-        output_file, options.redirector + outDir, time_limit=600, max_attempts=3
-    )
-    if result == 0:
-        print("Result of xrootd transfer was 0: " + xrd_file)
-    else:
-        subprocess.run(["rm", output_file])
+    merger.close()
+    print(prefetcher.report())
 
 
 if __name__ == "__main__":
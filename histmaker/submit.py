@@ -199,7 +199,7 @@ for i, sample in enumerate(samples):
         )
 
     elif options.code == "plot":
-        cmd = "python make_hists.py --sample={sample} --tag={tag} --redirector={redirector} --dataDirLocal={dataDirLocal} --dataDirXRootD={dataDirXRootD} --output={output_tag} --xrootd={xrootd} --weights={weights} --isMC={isMC} --era={era} --scouting={scouting} --merged={merged} --doInf={doInf} --doABCD={doABCD} --doSyst={doSyst} --blind={blind} --saveDir={saveDir} --channel={channel} --maxFiles={maxFiles} --pkl={pkl}".format(
+        cmd = "python make_hists.py --sample={sample} --tag={tag} --redirector={redirector} --dataDirLocal={dataDirLocal} --dataDirXRootD={dataDirXRootD} --output={output_tag} --xrootd={xrootd} --weights={weights} --isMC={isMC} --era={era} --scouting={scouting} --merged={merged} --doInf={doInf} --doABCD={doABCD} --doSyst={doSyst} --blind={blind} --saveDir={saveDir} --channel={channel} --maxFiles={maxFiles} --pkl={pkl} --chunkSize={chunkSize}".format(
             sample=sample,
             tag=options.tag,
             output_tag=options.output,
@@ -220,6 +220,7 @@ for i, sample in enumerate(samples):
             dataDirXRootD=options.dataDirXRootD,
             redirector=options.redirector,
             pkl=options.pkl,
+            chunkSize=options.chunkSize,
         )
 
     # execute the command with singularity
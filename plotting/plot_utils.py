@@ -1,3 +1,4 @@
+import hashlib
 import logging
 import math
 import os
@@ -6,6 +7,8 @@ import shutil
 import subprocess
 import sys
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
 import boost_histogram as bh
 import hist
@@ -14,9 +17,7 @@ import matplotlib.colors as colors
 import matplotlib.pyplot as plt
 import mplhep as hep
 import numpy as np
-import sympy
 import uproot
-from sympy import diff, sqrt, symbols
 
 sys.path.append("..")
 from histmaker import fill_utils
@@ -508,6 +509,9 @@ def loader(
     by_year=False,
     load_cutflows=False,
     only_cutflows=False,
+    hist_filters=None,
+    workers=1,
+    cache_dir=None,
     verbose=False,
 ):
     """
@@ -522,23 +526,36 @@ def loader(
     - by_year (bool, optional): Flag to group histograms by year. Default is True.
     - load_cutflows (bool, optional): Flag to load cutflows along side histograms. Default is False.
     - only_cutflows (bool, optional): Flag to load cutflows instead of histograms. Default is False.
+    - hist_filters (list, optional): Only load the histograms whose name contains any of these strings. Default is None (all histograms).
+    - workers (int, optional): Number of processes used to open and convert the files. Default is 1.
+    - cache_dir (str, optional): Directory where the converted histograms of each file are cached, see openHistFile. Default is None (no caching).
 
     Returns:
     - output (dict): Dictionary containing the loaded histograms (or cutflows) grouped by sample, bin, and year.
     """
     output = {}
     hists, cutflows = {}, {}
-    for infile_name in infile_names:
-        if verbose:
-            print("Loading", infile_name)
 
+    valid_infile_names = []
+    for infile_name in infile_names:
         if not os.path.isfile(infile_name):
             print("WARNING:", infile_name, "doesn't exist")
             continue
         elif ".root" not in infile_name and ".pkl" not in infile_name:
             continue
+        valid_infile_names.append(infile_name)
+
+    # no need to convert any histogram if we only want the cutflows
+    if only_cutflows:
+        hist_filters = []
+
+    for infile_name, (file_hists, file_metadata) in zip(
+        valid_infile_names,
+        openHistFiles(valid_infile_names, hist_filters, cache_dir, workers),
+    ):
+        if verbose:
+            print("Loading", infile_name)
 
-        file_hists, file_metadata = openHistFile(infile_name)
         norm = 1
 
         # finds era
@@ -608,14 +625,76 @@ def loader(
     return output
 
 
-def openHistFile(infile_name):
+def openHistFile(infile_name, hist_filters=None, cache_dir=None):
+    """
+    Open a histogram file, keeping only the histograms selected by hist_filters.
+    If cache_dir is given, the converted histograms and the metadata are cached there,
+    keyed by the path and modification time of the file and by hist_filters,
+    so the next call for the same (unchanged) file just unpickles them.
+    """
+    if cache_dir is not None:
+        cache_file = histCacheFile(infile_name, cache_dir, hist_filters)
+        if os.path.isfile(cache_file):
+            try:
+                with open(cache_file, "rb") as f:
+                    return pickle.load(f)
+            except Exception:
+                print("WARNING: could not read the cache", cache_file)
+
     if infile_name.endswith(".root"):
-        hists, metadata = openroot(infile_name)
+        hists, metadata = openroot(infile_name, hist_filters)
     elif infile_name.endswith(".pkl"):
-        hists, metadata = openpickle(infile_name)
+        hists, metadata = openpickle(infile_name, hist_filters)
+
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        # write to a temporary file first, so that concurrent readers never see partial files
+        tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+        with open(tmp_file, "wb") as f:
+            pickle.dump((hists, metadata), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, cache_file)
+
     return hists, metadata
 
 
+def openHistFiles(infile_names, hist_filters=None, cache_dir=None, workers=1):
+    """
+    Yields the (hists, metadata) of each file with openHistFile, in order,
+    opening the files with a pool of workers processes if workers > 1.
+    """
+    if workers > 1 and len(infile_names) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            yield from pool.map(
+                openHistFile,
+                infile_names,
+                repeat(hist_filters),
+                repeat(cache_dir),
+            )
+    else:
+        for infile_name in infile_names:
+            yield openHistFile(infile_name, hist_filters, cache_dir)
+
+
+def histCacheFile(infile_name, cache_dir, hist_filters=None):
+    stat = os.stat(infile_name)
+    key = repr(
+        (
+            os.path.abspath(infile_name),
+            stat.st_mtime_ns,
+            stat.st_size,
+            None if hist_filters is None else sorted(hist_filters),
+        )
+    )
+    name = os.path.basename(infile_name).rsplit(".", 1)[0]
+    return os.path.join(
+        cache_dir, f"{name}_{hashlib.sha1(key.encode()).hexdigest()[:16]}.pkl"
+    )
+
+
+def keepHist(name, hist_filters=None):
+    return hist_filters is None or any(filt in name for filt in hist_filters)
+
+
 def combineSamples(plots: dict, samples: list, new_tag: str) -> dict:
     plots[new_tag] = {}
     for key in plots[samples[0]].keys():
@@ -717,21 +796,27 @@ def apply_binwise_scaling(h_in, bins, scales, dim="x"):
 
 
 # function to load files from pickle
-def openpickle(infile_name):
+def openpickle(infile_name, hist_filters=None):
     _plots = {}
     _metadata = {}
     with open(infile_name, "rb") as openfile:
         while True:
             try:
                 input = pickle.load(openfile)
-                _plots.update(input["hists"])
+                _plots.update(
+                    {
+                        k: h
+                        for k, h in input["hists"].items()
+                        if keepHist(k, hist_filters)
+                    }
+                )
                 _metadata.update(input["metadata"])
             except EOFError:
                 break
     return _plots, _metadata
 
 
-def openroot(infile_name):
+def openroot(infile_name, hist_filters=None):
     _plots = {}
     _metadata = {}
     _infile = uproot.open(infile_name)
@@ -739,7 +824,7 @@ def openroot(infile_name):
         if "metadata" == k.split(";")[0]:
             for kk in _infile[k].keys():
                 _metadata[kk.split(";")[0]] = _infile[k][kk].title()
-        elif "metadata" not in k:
+        elif "metadata" not in k and keepHist(k.split(";")[0], hist_filters):
             _plots[k.split(";")[0]] = _infile[k].to_hist()
     return _plots, _metadata
 
@@ -1267,6 +1352,33 @@ def plot_sliced_hist2d(
     return fig, axs
 
 
+def errorProp_monomial(factors, clip=True):
+    """
+    Evaluates a product of powers, prod(x**p), and its first order propagated variance,
+    sum((d/dx prod(x**p))**2 * |var(x)|), for all the bins at once.
+    factors is a list of (values, variances, power), where values and variances are
+    either arrays over the bins or scalars (e.g. the sum of a region).
+    If clip, non-finite or non-positive values are set to 0, as in the ABCD methods.
+    Returns the arrays of values and variances.
+    """
+    values = [np.asarray(value, dtype=float) for value, _, _ in factors]
+    powers = [power for _, _, power in factors]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        terms = [value**power for value, power in zip(values, powers)]
+        result = np.prod(np.broadcast_arrays(*terms), axis=0)
+        variance = np.zeros_like(result)
+        for i, (_, var, power) in enumerate(factors):
+            der = power * values[i] ** (power - 1)
+            for j, term in enumerate(terms):
+                if j != i:
+                    der = der * term
+            variance = variance + der**2 * np.abs(var)
+
+    if clip:
+        result = np.where(np.isfinite(result) & (result > 0), result, 0)
+    return result, variance
+
+
 def make_ABCD_4regions(hist_abcd, xregions, yregions, sum_var=None):
     if sum_var is not None and sum_var not in ["x", "y"]:
         raise ValueError("sum_var must be 'x' or 'y'")
@@ -1335,44 +1447,14 @@ def ABCD_4regions_errorProp(hist_abcd, xregions, yregions, sum_var="x", new_bins
     SR_exp.view().variance = [0] * len(SR.values())
     SR_exp.view().value = [0] * len(SR.values())
 
-    preds, preds_err = [], []
-    for i in range(len(hNUM.values())):
-        hNUM_bin = hNUM[i]
-
-        # define the scaling factor function
-        a, hnum_bin, hden = symbols(
-            "A hnum_bin hden",
-        )
-        exp = hnum_bin * hden * a**-1
-
-        # defines lists of variables (sympy symbols) and accumulators (hist.sum())
-        variables = [a, hnum_bin, hden]
-        accs = [
-            A.sum(),
-            hNUM_bin,
-            hDEN.sum(),
+    # SR_exp = hNUM * hDEN / A, in each bin
+    preds, preds_err = errorProp_monomial(
+        [
+            (A.sum().value, A.sum().variance, -1),
+            (hNUM.values(), hNUM.variances(), 1),
+            (hDEN.sum().value, hDEN.sum().variance, 1),
         ]
-
-        # calculate scaling factor by substituting values of the histograms' sums for the sympy symbols
-        alpha = exp.copy()
-        for var, acc in zip(variables, accs):
-            alpha = alpha.subs(var, acc.value)
-
-        # calculate the error on the scaling factor
-        variance = 0
-        for var, acc in zip(variables, accs):
-            der = diff(exp, var)
-            var = abs(acc.variance)
-            variance += der**2 * var
-        for var, acc in zip(variables, accs):
-            variance = variance.subs(var, acc.value)
-        sigma_alpha = variance
-
-        if type(alpha) != sympy.core.numbers.Float or alpha <= 0:
-            alpha = 0
-
-        preds.append(alpha)
-        preds_err.append(sigma_alpha)
+    )
 
     SR_exp.view().variance = preds_err
     SR_exp.view().value = preds
@@ -1549,53 +1631,25 @@ def ABCD_6regions_errorProp(abcd, xregions, yregions, sum_var="x", new_bins=None
         SR = rebin_piecewise(SR, new_bins)
         SR_exp = rebin_piecewise(SR_exp, new_bins)
 
-    preds, preds_err = [], []
-    for i in range(len(hNUM.values())):
-        hNUM_bin = hNUM[i]
-        hDEN_bin = (
-            hDEN[i] if mode1 else hist.accumulators.WeightedSum()
-        )  # only needed for mode1, if mode 2, just initialize it to an empty accumulator
-
-        # define the scaling factor function
-        a, b, hnum_bin, hnum2, hden_bin, hden = symbols(
-            "A B hNUM_bin hNUM2 hDEN_bin hDEN"
-        )
-        if mode1:
-            exp = hnum_bin**2 * hnum2 * a * hden_bin**-1 * b**-2
-        elif mode2:
-            exp = hnum_bin * hnum2**2 * a * b**-2 * hden**-1
-
-        # defines lists of variables (sympy symbols) and accumulators (hist.sum())
-        variables = [a, b, hnum_bin, hnum2, hden_bin, hden]
-        accs = [
-            A.sum(),
-            B.sum(),
-            hNUM_bin,
-            hNUM2.sum(),
-            hDEN_bin,
-            hDEN.sum(),
+    if mode1:
+        # SR_exp = hNUM**2 * hNUM2 * A / (hDEN * B**2), in each bin
+        factors = [
+            (hNUM.values(), hNUM.variances(), 2),
+            (hDEN.values(), hDEN.variances(), -1),
         ]
-
-        # calculate scaling factor by substituting values of the histograms' sums for the sympy symbols
-        alpha = exp.copy()
-        for var, acc in zip(variables, accs):
-            alpha = alpha.subs(var, acc.value)
-
-        # calculate the error on the scaling factor
-        variance = 0
-        for var, acc in zip(variables, accs):
-            der = diff(exp, var)
-            var = abs(acc.variance)
-            variance += der**2 * var
-        for var, acc in zip(variables, accs):
-            variance = variance.subs(var, acc.value)
-        sigma_alpha = variance
-
-        if type(alpha) != sympy.core.numbers.Float or alpha <= 0:
-            alpha = 0
-
-        preds.append(alpha)
-        preds_err.append(sigma_alpha)
+    elif mode2:
+        # SR_exp = hNUM * hNUM2**2 * A / (hDEN * B**2), in each bin
+        factors = [
+            (hNUM.values(), hNUM.variances(), 1),
+            (hDEN.sum().value, hDEN.sum().variance, -1),
+        ]
+    hNUM2_power = 1 if mode1 else 2
+    factors += [
+        (A.sum().value, A.sum().variance, 1),
+        (B.sum().value, B.sum().variance, -2),
+        (hNUM2.sum().value, hNUM2.sum().variance, hNUM2_power),
+    ]
+    preds, preds_err = errorProp_monomial(factors)
 
     SR_exp.view().variance = preds_err
     SR_exp.view().value = preds
@@ -1690,70 +1744,41 @@ def ABCD_9regions_errorProp(
             SR = rebin_piecewise(SR, new_bins)
             SR_exp = rebin_piecewise(SR_exp, new_bins)
 
-    preds, preds_err = [], []
-    for i in range(len(F.values())):
-        # this is needed in order to do error propagation correctly
-        F_bin = F[i]
-        C_bin = C[i]
-        F_other = F.copy()
-        F_other[i] = hist.accumulators.WeightedSum()
-
-        # define the scaling factor function
-        a, b, c, c_bin, d, e, f_bin, f_other, g, h = symbols(
-            "A B C C_bin D E F_bin F_other G H"
+    # the region sums that don't depend on the bin
+    # R = H**2 * D**2 * B**2 / (G * A * E**4)
+    factors = [
+        (H.sum().value, H.sum().variance, 2),
+        (D.sum().value, D.sum().variance, 2),
+        (B.sum().value, B.sum().variance, 2),
+        (G.sum().value, G.sum().variance, -1),
+        (A.sum().value, A.sum().variance, -1),
+        (E.sum().value, E.sum().variance, -4),
+    ]
+    F_bin, F_bin_var = F.values(), F.variances()
+    if approx:
+        # SR_exp = F_bin * (F_other + F_bin) * R / C, in each bin
+        # F_other (F without this bin) is treated as independent of F_bin
+        F_other = F.sum().value - F_bin
+        F_other_var = F.sum().variance - F_bin_var
+        R, R_var = errorProp_monomial(
+            factors + [(C.sum().value, C.sum().variance, -1)], clip=False
+        )
+        preds = F_bin * (F_other + F_bin) * R
+        preds_err = (
+            (F_bin * (F_other + F_bin)) ** 2 * R_var
+            + ((F_other + 2 * F_bin) * R) ** 2 * np.abs(F_bin_var)
+            + (F_bin * R) ** 2 * np.abs(F_other_var)
+        )
+        preds = np.where(np.isfinite(preds) & (preds > 0), preds, 0)
+    else:
+        # SR_exp = F_bin**2 * R / C_bin, in each bin
+        preds, preds_err = errorProp_monomial(
+            factors
+            + [
+                (F_bin, F_bin_var, 2),
+                (C.values(), C.variances(), -1),
+            ]
         )
-        if sum_var == "x" and approx:
-            exp = (
-                f_bin
-                * (f_other + f_bin)
-                * h**2
-                * d**2
-                * b**2
-                * g**-1
-                * c**-1
-                * a**-1
-                * e**-4
-            )
-        elif sum_var == "x" and not approx:
-            exp = f_bin**2 * h**2 * d**2 * b**2 * g**-1 * c_bin**-1 * a**-1 * e**-4
-        elif sum_var == "y":
-            pass
-
-        # defines lists of variables (sympy symbols) and accumulators (hist.sum())
-        variables = [a, b, c, c_bin, d, e, f_bin, f_other, g, h]
-        accs = [
-            A.sum(),
-            B.sum(),
-            C.sum(),
-            C_bin,
-            D.sum(),
-            E.sum(),
-            F_bin,
-            F_other.sum(),
-            G.sum(),
-            H.sum(),
-        ]
-
-        # calculate scaling factor by substituting values of the histograms' sums for the sympy symbols
-        alpha = exp.copy()
-        for var, acc in zip(variables, accs):
-            alpha = alpha.subs(var, acc.value)
-
-        # calculate the error on the scaling factor
-        variance = 0
-        for var, acc in zip(variables, accs):
-            der = diff(exp, var)
-            var = abs(acc.variance)
-            variance += der**2 * var
-        for var, acc in zip(variables, accs):
-            variance = variance.subs(var, acc.value)
-        sigma_alpha = variance
-
-        if type(alpha) != sympy.core.numbers.Float or alpha <= 0:
-            alpha = 0
-
-        preds.append(alpha)
-        preds_err.append(sigma_alpha)
 
     SR_exp.view().variance = preds_err
     SR_exp.view().value = preds
@@ -0,0 +1,132 @@
+"""
+Central registry of the correction files used by CMS_corrections.
+Each file is loaded lazily, the first time it is needed for a given era, and then kept
+for the lifetime of the worker process, so that chunks don't re-read the same JSONs.
+The era follows the int convention of the processors (2015 is 2016APV).
+"""
+
+import functools
+import pickle
+
+import correctionlib
+import numpy as np
+from coffea import lookup_tools
+
+# Assuming we always run from root dir
+BTAG_FILES = {
+    2015: ("data/BTagUL16APV/btagging.json.gz", "data/BTagUL16/btagging.json.gz"),
+    2016: ("data/BTagUL16/btagging.json.gz", "data/BTagUL16/btagging.json.gz"),
+    2017: ("data/BTagUL17/btagging.json.gz", "data/BTagUL17/btagging.json.gz"),
+    2018: ("data/BTagUL18/btagging.json.gz", "data/BTagUL18/btagging.json.gz"),
+}
+BTAG_EFF_FILES = {
+    2015: "data/BTagUL16APV/eff.pickle",
+    2016: "data/BTagUL16/eff.pickle",
+    2017: "data/BTagUL17/eff.pickle",
+    2018: "data/BTagUL18/eff.pickle",
+}
+LEPTON_SF_TAGS = {
+    2015: ("16APV", "2016preVFP"),
+    2016: ("16", "2016postVFP"),
+    2017: ("17", "2017"),
+    2018: ("18", "2018"),
+}
+TRIGGER_SF_FILE = "data/LeptonTriggerSF/masterJSON.json"
+ROCHESTER_FILE = "data/MuScale/roccor.Run2.v3/RoccoR%i.txt"
+
+
+def checkEra(era, files):
+    if era not in files:
+        raise ValueError(
+            "No corrections defined for era "
+            + str(era)
+            + ", options are "
+            + str(list(files.keys()))
+        )
+
+
+@functools.lru_cache(maxsize=None)
+def getCorrectionSet(path):
+    """
+    Load a correctionlib JSON (possibly gzipped), once per process.
+    """
+    return correctionlib.CorrectionSet.from_file(path)
+
+
+@functools.lru_cache(maxsize=None)
+def getBTagCorrections(era):
+    """
+    Return the deepJet_comb (b/c jets) and deepJet_incl (light jets) corrections.
+    """
+    checkEra(era, BTAG_FILES)
+    btagfile, btagfileL = BTAG_FILES[era]
+    return (
+        getCorrectionSet(btagfile)["deepJet_comb"],
+        getCorrectionSet(btagfileL)["deepJet_incl"],
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def getBTagEfficiencies(era):
+    """
+    Return the b-tagging efficiency lookups, keyed by "L", "C", "B".
+    """
+    checkEra(era, BTAG_EFF_FILES)
+    with open(BTAG_EFF_FILES[era], "rb") as bfile:
+        return pickle.load(bfile)
+
+
+@functools.lru_cache(maxsize=None)
+def getTriggerSFCorrection():
+    return getCorrectionSet(TRIGGER_SF_FILE)["UL-PtPt-Trigger-SFs"]
+
+
+@functools.lru_cache(maxsize=None)
+def getLeptonSFCorrections(era):
+    """
+    Return the electron ID/reco, muon ID, and muon isolation corrections, and the
+    era tag used as input to them.
+    """
+    checkEra(era, LEPTON_SF_TAGS)
+    tag, etag = LEPTON_SF_TAGS[era]
+    elall = getCorrectionSet("data/EGammaUL%s/electron.json" % tag)["UL-Electron-ID-SF"]
+    muonSet = getCorrectionSet("data/MuUL%s/muon_Z.json" % tag)
+    return (
+        elall,
+        muonSet["NUM_LooseID_DEN_TrackerMuons"],
+        muonSet["NUM_LooseRelIso_DEN_LooseID"],
+        etag,
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def getRochesterCorrection(era):
+    rochester_data = lookup_tools.txt_converters.convert_rochester_file(
+        ROCHESTER_FILE % (era if era != 2015 else 2016),
+        loaduncs=True,
+    )
+    return lookup_tools.rochester_lookup.rochester_lookup(rochester_data)
+
+
+def evaluateVariations(correction, variations, makeInputs, mask=None, default=None):
+    """
+    Evaluate a correction for several systematic variations.
+    makeInputs(variation) returns the inputs to the correction for that variation.
+    If a mask is given, each variation is evaluated in a single call on the selected
+    entries only, and the other entries are set to default (an array, or a scalar).
+    Returns a dict of variation: flat numpy array.
+    """
+    results = {}
+    for variation in variations:
+        inputs = makeInputs(variation)
+        if mask is None:
+            results[variation] = np.asarray(correction.evaluate(*inputs))
+            continue
+        out = np.array(
+            np.broadcast_to(default, mask.shape), dtype=np.float64, copy=True
+        )
+        if np.any(mask):
+            inputs = [np.asarray(x)[mask] if np.ndim(x) > 0 else x for x in inputs]
+            out[mask] = correction.evaluate(*inputs)
+        results[variation] = out
+    return results
@@ -5,6 +5,12 @@ Follow the latest recommendations: https://cms-jerc.web.cern.ch/Recommendations/
 Authors: Chad Freer, Luca Lavezzo
 """
 
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+
 import awkward as ak
 import cachetools
 import numpy as np
@@ -12,12 +18,26 @@ import vector
 from coffea.jetmet_tools import CorrectedJetsFactory, CorrectedMETFactory, JECStack
 from coffea.lookup_tools import extractor
 
+from workflows import deltaR_utils
+
 vector.register_awkward()
 
+# The JEC stacks and jet factories are memoized per worker process, keyed by the
+# JEC/JER versions (which already encode era and data run period), isMC, jer and prefix.
+# The caches are bounded, and guarded by a lock as the futures executor runs chunks in threads.
+JEC_CACHE_SIZE = 8
+_jec_stack_cache = cachetools.LRUCache(maxsize=JEC_CACHE_SIZE)
+_jet_factory_cache = cachetools.LRUCache(maxsize=JEC_CACHE_SIZE)
+_jec_cache_lock = threading.Lock()
 
-def makeJECStack(Sample: str, isMC: int, era: str, jer: bool = False, prefix: str = ""):
+# Set this environment variable to a directory to store the parsed JEC/JER evaluators
+# as pickles, so that new workers don't need to parse the text files again.
+JEC_DISK_CACHE_ENV = "SUEP_JEC_CACHE_DIR"
+
+
+def getJECDirectories(Sample: str, isMC: int, era: str):
     """
-    Define the set of weights to use for JECs and JERs based on sample, isMC, and era.
+    Find the JEC and JER versions to use based on sample, isMC, and era.
     """
 
     # Find the Collection we want to look at
@@ -86,37 +106,76 @@ def makeJECStack(Sample: str, isMC: int, era: str, jer: bool = False, prefix: st
             + str(isMC)
         )
 
+    return jecdir, jerdir
+
+
+def loadJECEvaluators(weight_files, names):
+    """
+    Parse the JEC/JER text files with the coffea extractor and return the evaluators
+    for the requested names.
+    If the JEC_DISK_CACHE_ENV directory is set, the evaluators are read from/written to
+    a pickle there, keyed by the file names, sizes and modification times.
+    """
+
+    cache_file = None
+    cache_dir = os.environ.get(JEC_DISK_CACHE_ENV)
+    if cache_dir:
+        key = hashlib.sha1()
+        for f in weight_files:
+            stat = os.stat(f)
+            key.update(f"{os.path.abspath(f)}:{stat.st_size}:{stat.st_mtime}".encode())
+        key.update(",".join(names).encode())
+        cache_file = os.path.join(cache_dir, "jec_" + key.hexdigest() + ".pkl")
+        if os.path.exists(cache_file):
+            try:
+                with open(cache_file, "rb") as f:
+                    return pickle.load(f)
+            except Exception as e:
+                print("Could not read JEC cache file", cache_file, ":", e)
+
+    ext_ak4 = extractor()
+    ext_ak4.add_weight_sets(["* * " + f for f in weight_files])
+    ext_ak4.finalize()
+    evaluator_ak4 = ext_ak4.make_evaluator()
+    jec_inputs_ak4 = {name: evaluator_ak4[name] for name in names}
+
+    if cache_file is not None:
+        # write to a temporary file first, so that workers never read a partial pickle
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_file = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(jec_inputs_ak4, f)
+        os.replace(tmp_file, cache_file)
+
+    return jec_inputs_ak4
+
+
+@cachetools.cached(_jec_stack_cache, lock=_jec_cache_lock)
+def _loadJECStack(jecdir: str, jerdir: str, isMC: int, jer: bool, prefix: str):
+
     jec_path = prefix + "data/jetmet/JEC/" + jecdir + "/" + jecdir
     jer_path = prefix + "data/jetmet/JER/" + jerdir + "/" + jerdir
 
-    ext_ak4 = extractor()
     if isMC:
-        ext_ak4.add_weight_sets(
-            [
-                "* * " + jec_path + "_L1FastJet_AK4PFchs.jec.txt",
-                "* * " + jec_path + "_L2Relative_AK4PFchs.jec.txt",
-                "* * " + jec_path + "_L3Absolute_AK4PFchs.jec.txt",
-                "* * " + jec_path + "_UncertaintySources_AK4PFchs.junc.txt",
-                "* * " + jec_path + "_Uncertainty_AK4PFchs.junc.txt",
-                "* * " + jer_path + "_PtResolution_AK4PFchs.jr.txt",
-                "* * " + jer_path + "_SF_AK4PFchs.jersf.txt",
-            ]
-        )
+        weight_files = [
+            jec_path + "_L1FastJet_AK4PFchs.jec.txt",
+            jec_path + "_L2Relative_AK4PFchs.jec.txt",
+            jec_path + "_L3Absolute_AK4PFchs.jec.txt",
+            jec_path + "_UncertaintySources_AK4PFchs.junc.txt",
+            jec_path + "_Uncertainty_AK4PFchs.junc.txt",
+            jer_path + "_PtResolution_AK4PFchs.jr.txt",
+            jer_path + "_SF_AK4PFchs.jersf.txt",
+        ]
     else:
-        ext_ak4.add_weight_sets(
-            [
-                "* * " + jec_path + "_L1FastJet_AK4PFchs.jec.txt",
-                "* * " + jec_path + "_L3Absolute_AK4PFchs.jec.txt",
-                "* * " + jec_path + "_L2Relative_AK4PFchs.jec.txt",
-                "* * " + jec_path + "_L2L3Residual_AK4PFchs.jec.txt",
-            ]
-        )
-
-    ext_ak4.finalize()
-    evaluator_ak4 = ext_ak4.make_evaluator()
+        weight_files = [
+            jec_path + "_L1FastJet_AK4PFchs.jec.txt",
+            jec_path + "_L3Absolute_AK4PFchs.jec.txt",
+            jec_path + "_L2Relative_AK4PFchs.jec.txt",
+            jec_path + "_L2L3Residual_AK4PFchs.jec.txt",
+        ]
 
     # these are the weights that will be used
-    if int(isMC):
+    if isMC:
         jec_stack_names_ak4 = [
             jecdir + "_L1FastJet_AK4PFchs",
             jecdir + "_L2Relative_AK4PFchs",
@@ -136,13 +195,41 @@ def makeJECStack(Sample: str, isMC: int, era: str, jer: bool = False, prefix: st
             jecdir + "_L2L3Residual_AK4PFchs",
         ]
 
-    jec_inputs_ak4 = {name: evaluator_ak4[name] for name in jec_stack_names_ak4}
-    return JECStack(jec_inputs_ak4)
+    return JECStack(loadJECEvaluators(weight_files, jec_stack_names_ak4))
+
+
+def makeJECStack(Sample: str, isMC: int, era: str, jer: bool = False, prefix: str = ""):
+    """
+    Define the set of weights to use for JECs and JERs based on sample, isMC, and era.
+    The stacks are memoized, so the text files are only parsed once per worker.
+    """
+    jecdir, jerdir = getJECDirectories(Sample, isMC, era)
+    return _loadJECStack(jecdir, jerdir, int(isMC), bool(jer), prefix)
 
 
 def getCorrectedJetsFactory(Sample, isMC, era, jer=False, prefix=""):
+    """
+    Return the CorrectedJetsFactory for this sample, memoized per worker.
+    """
+    jecdir, jerdir = getJECDirectories(Sample, isMC, era)
+    return _buildCorrectedJetsFactory(jecdir, jerdir, int(isMC), bool(jer), prefix)
 
-    jec_stack_ak4 = makeJECStack(Sample, isMC, era, jer=jer, prefix=prefix)
+
+def clearJECCache():
+    """
+    Drop all the memoized JEC stacks and jet factories of this worker.
+    """
+    with _jec_cache_lock:
+        _jec_stack_cache.clear()
+        _jet_factory_cache.clear()
+
+
+@cachetools.cached(_jet_factory_cache, lock=_jec_cache_lock)
+def _buildCorrectedJetsFactory(
+    jecdir: str, jerdir: str, isMC: int, jer: bool, prefix: str
+):
+
+    jec_stack_ak4 = _loadJECStack(jecdir, jerdir, isMC, jer, prefix)
 
     name_map = jec_stack_ak4.blank_name_map
     name_map["JetPt"] = "pt"
@@ -187,9 +274,10 @@ def prepareJetsForFactory(isMC, events, jets):
     jets["pt_raw"] = (1 - jets["rawFactor"]) * jets["pt"]
     jets["mass_raw"] = (1 - jets["rawFactor"]) * jets["mass"]
     if int(isMC):
-        jets["matched_gen_0p2"] = jets.nearest(events.GenJet, threshold=0.2)
+        matched_gen_0p2, _ = deltaR_utils.nearest(jets, events.GenJet, threshold=0.2)
         jets["pt_gen"] = ak.values_astype(
-            ak.fill_none(jets.matched_gen_0p2.pt, 0), np.float32
+            deltaR_utils.takeNearest(events.GenJet.pt, matched_gen_0p2, fill=0),
+            np.float32,
         )
     jets["event_rho"] = ak.broadcast_arrays(events.fixedGridRhoFastjetAll, jets.pt)[0]
 
@@ -231,26 +319,7 @@ def getJetsForMET(events):
     ]
 
     # veto any jets that are in deltaR < 0.4 with any PF muon
-    jets_p4 = ak.zip(
-        {
-            "pt": jets.pt,
-            "eta": jets.eta,
-            "phi": jets.phi,
-            "mass": jets.mass,
-        },
-        with_name="Momentum4D",
-    )
-    muons_4p = ak.zip(
-        {
-            "pt": events.Muon.pt,
-            "eta": events.Muon.eta,
-            "phi": events.Muon.phi,
-            "mass": events.Muon.mass,
-        },
-        with_name="Momentum4D",
-    )
-    product = ak.cartesian({"jet": jets_p4, "muon": muons_4p}, nested=True)
-    jets = jets[ak.all(product.jet.deltaR(product.muon) >= 0.4, axis=-1)]
+    jets = jets[~deltaR_utils.anyWithinCone(jets, events.Muon, 0.4)]
 
     return jets
 
@@ -273,49 +342,21 @@ def getCorrT1METJetForMET(events, isMC):
         (CorrT1METJet.pt * (1 - CorrT1METJet["muonSubtrFactor"]) > 15)
     ]
 
-    CorrT1METJet_p4 = ak.zip(
-        {
-            "pt": CorrT1METJet.pt,
-            "eta": CorrT1METJet.eta,
-            "phi": CorrT1METJet.phi,
-            "mass": CorrT1METJet.mass,
-        },
-        with_name="Momentum4D",
-    )
-
     if int(isMC):
 
-        # veto any jets that are in deltaR < 0.4 with any PF muon
-        genJet_4p = ak.zip(
-            {
-                "pt": events.GenJet.pt,
-                "eta": events.GenJet.eta,
-                "phi": events.GenJet.phi,
-                "mass": events.GenJet.mass,
-            },
-            with_name="Momentum4D",
-        )
-        product = ak.cartesian(
-            {"jet": CorrT1METJet_p4, "genJet": genJet_4p}, nested=True
+        # pT of the nearest GenJet within deltaR < 0.2
+        nearestGenJet, minDeltaRJetGenJet = deltaR_utils.nearest(
+            CorrT1METJet, events.GenJet
         )
-        minDeltaRJetGenJet = ak.argmin(product.genJet.deltaR(product.jet), axis=-1)
         CorrT1METJet["pt_gen"] = ak.where(
-            minDeltaRJetGenJet < 0.2, genJet_4p[minDeltaRJetGenJet].pt, 0
+            minDeltaRJetGenJet < 0.2,
+            deltaR_utils.takeNearest(events.GenJet.pt, nearestGenJet, fill=0),
+            0,
         )
 
     # veto any CorrT1METJet that are in deltaR < 0.4 with any PF muon
-    muons_4p = ak.zip(
-        {
-            "pt": events.Muon.pt,
-            "eta": events.Muon.eta,
-            "phi": events.Muon.phi,
-            "mass": events.Muon.mass,
-        },
-        with_name="Momentum4D",
-    )
-    product = ak.cartesian({"jet": CorrT1METJet_p4, "muon": muons_4p}, nested=True)
     CorrT1METJet = CorrT1METJet[
-        ak.all(product.jet.deltaR(product.muon) >= 0.4, axis=-1)
+        ~deltaR_utils.anyWithinCone(CorrT1METJet, events.Muon, 0.4)
     ]
 
     return CorrT1METJet
@@ -1,17 +1,14 @@
 import awkward as ak
 import numpy as np
-from coffea import lookup_tools
+
+from workflows.CMS_corrections.correction_registry import getRochesterCorrection
 
 
 def doLeptonScaleVariations(events, leptons, era):
     ## First the muons
     muonIndexes = abs(leptons.pdgId) == 13
     muons = leptons[muonIndexes]
-    rochester_data = lookup_tools.txt_converters.convert_rochester_file(
-        "data/MuScale/roccor.Run2.v3/RoccoR%i.txt" % (era if era != 2015 else 2016),
-        loaduncs=True,
-    )
-    rochester = lookup_tools.rochester_lookup.rochester_lookup(rochester_data)
+    rochester = getRochesterCorrection(era)
     murand = ak.unflatten(np.random.random(ak.sum(ak.num(muons))), ak.num(muons))
 
     # muSF is the correction
@@ -1,12 +1,15 @@
 import awkward as ak
-import correctionlib
 import numpy as np
 
+from workflows.CMS_corrections.correction_registry import (
+    evaluateVariations,
+    getLeptonSFCorrections,
+    getTriggerSFCorrection,
+)
+
 
 def doTriggerSFs(electrons, muons, era, do_syst=False):
-    ceval = correctionlib.CorrectionSet.from_file(
-        "data/LeptonTriggerSF/masterJSON.json"
-    )  ## Assuming we always run from root dir
+    ceval = getTriggerSFCorrection()
     year = str(era)
     SF = {}
 
@@ -23,157 +26,74 @@ def doTriggerSFs(electrons, muons, era, do_syst=False):
         [np.abs(leps1temp) > 199, np.abs(leps1temp) <= 199],
         [np.sign(leps1temp) * 199.0, leps1temp],
     )
+
     if do_syst:
-        SF["TrigSF"] = np.where(
-            leps0 > 0,
-            ceval["UL-PtPt-Trigger-SFs"].evaluate(
-                year, "sf", "Electron", np.abs(leps1), np.abs(leps0)
-            ),  # Check if Electron
-            np.where(
-                leps0 < 0,
-                ceval["UL-PtPt-Trigger-SFs"].evaluate(
-                    year, "sf", "Muon", np.abs(leps1), np.abs(leps0)
-                ),
-                -999,  # Check if Muon, if not insert invalid value
-            ),
-        )
-        SF["TrigSFDn"] = np.where(
-            leps0 > 0,
-            ceval["UL-PtPt-Trigger-SFs"].evaluate(
-                year, "sf-down", "Electron", np.abs(leps1), np.abs(leps0)
-            ),  # Check if Electron
-            np.where(
-                leps0 < 0,
-                ceval["UL-PtPt-Trigger-SFs"].evaluate(
-                    year, "sf-down", "Muon", np.abs(leps1), np.abs(leps0)
-                ),
-                -999,  # Check if Muon, if not insert invalid value
-            ),
-        )
-        SF["TrigSFUp"] = np.where(
-            leps0 > 0,
-            ceval["UL-PtPt-Trigger-SFs"].evaluate(
-                year, "sf-up", "Electron", np.abs(leps1), np.abs(leps0)
-            ),  # Check if Electron
-            np.where(
-                leps0 < 0,
-                ceval["UL-PtPt-Trigger-SFs"].evaluate(
-                    year, "sf-up", "Muon", np.abs(leps1), np.abs(leps0)
-                ),
-                -999,  # Check if Muon, if not insert invalid value
-            ),
-        )
+        variations = {"TrigSF": "sf", "TrigSFDn": "sf-down", "TrigSFUp": "sf-up"}
     else:
-        SF["TrigSF"] = np.where(
-            leps0 > 0,
-            ceval["UL-PtPt-Trigger-SFs"].evaluate(
-                year, "sf", "Electron", np.abs(leps1), np.abs(leps0)
-            ),  # Check if Electron
-            np.where(
-                leps0 < 0,
-                ceval["UL-PtPt-Trigger-SFs"].evaluate(
-                    year, "sf", "Muon", np.abs(leps1), np.abs(leps0)
-                ),
-                -999,  # Check if Muon, if not insert invalid value
-            ),
+        variations = {"TrigSF": "sf"}
+    SFs = {}
+    for flavor, isFlavor in [("Electron", leps0 > 0), ("Muon", leps0 < 0)]:
+        SFs[flavor] = evaluateVariations(
+            ceval,
+            variations.values(),
+            lambda syst: (year, syst, flavor, np.abs(leps1), np.abs(leps0)),
+            mask=isFlavor,
+            default=-999,  # if neither Electron nor Muon, insert invalid value
         )
+    for name, syst in variations.items():
+        SF[name] = np.where(leps0 > 0, SFs["Electron"][syst], SFs["Muon"][syst])
     return SF
 
 
 def doLeptonSFs(electrons, muons, era):
-    if era == 2015:
-        tag = "16APV"
-        etag = "2016preVFP"
-    elif era == 2016:
-        tag = "16"
-        etag = "2016postVFP"
-    elif era == 2017:
-        tag = "17"
-        etag = "2017"
-    elif era == 2018:
-        tag = "18"
-        etag = "2018"
+    elall, muid, muiso, etag = getLeptonSFCorrections(era)
 
     elecs, nelecs = ak.flatten(electrons), np.array(ak.num(electrons))
     mus, nmus = ak.flatten(muons), np.array(ak.num(muons))
 
-    elall = correctionlib.CorrectionSet.from_file(
-        "data/EGammaUL%s/electron.json" % tag
-    )["UL-Electron-ID-SF"]
-    muid = correctionlib.CorrectionSet.from_file("data/MuUL%s/muon_Z.json" % tag)[
-        "NUM_LooseID_DEN_TrackerMuons"
-    ]
-    muiso = correctionlib.CorrectionSet.from_file("data/MuUL%s/muon_Z.json" % tag)[
-        "NUM_LooseRelIso_DEN_LooseID"
-    ]
-
-    elSF = np.where(
-        elecs.pt > 20,
-        elall.evaluate(
-            etag,
-            "sf",
-            "RecoAbove20",
-            elecs.eta,
-            np.where(elecs.pt <= 20, 20.001, elecs.pt),
-        ),
-        elall.evaluate(
-            etag,
-            "sf",
-            "RecoBelow20",
-            elecs.eta,
-            np.where(abs(elecs.pt - 15) >= 4.999, 15, elecs.pt),
-        ),
-    ) * elall.evaluate(etag, "sf", "wp90iso", elecs.eta, elecs.pt)
-    elSFUp = np.where(
-        elecs.pt > 20,
-        elall.evaluate(
-            etag,
-            "sfup",
-            "RecoAbove20",
-            elecs.eta,
-            np.where(elecs.pt <= 20, 20.001, elecs.pt),
-        ),
-        elall.evaluate(
-            etag,
-            "sfup",
-            "RecoBelow20",
-            elecs.eta,
-            np.where(abs(elecs.pt - 15) >= 4.999, 15, elecs.pt),
-        ),
-    ) * elall.evaluate(etag, "sfup", "wp90iso", elecs.eta, elecs.pt)
-    elSFDown = np.where(
-        elecs.pt > 20,
-        elall.evaluate(
-            etag,
-            "sfdown",
-            "RecoAbove20",
-            elecs.eta,
-            np.where(elecs.pt <= 20, 20.001, elecs.pt),
-        ),
-        elall.evaluate(
+    # electrons: reconstruction SF (split at 20 GeV) times ID SF
+    elpt, eleta = np.array(elecs.pt), np.array(elecs.eta)
+    isAbove20 = elpt > 20
+    elVariations = ["sf", "sfup", "sfdown"]
+    recoAbove20 = evaluateVariations(
+        elall,
+        elVariations,
+        lambda syst: (etag, syst, "RecoAbove20", eleta, elpt),
+        mask=isAbove20,
+        default=0,
+    )
+    recoBelow20 = evaluateVariations(
+        elall,
+        elVariations,
+        lambda syst: (
             etag,
-            "sfdown",
+            syst,
             "RecoBelow20",
-            elecs.eta,
-            np.where(abs(elecs.pt - 15) >= 4.999, 15, elecs.pt),
+            eleta,
+            np.where(abs(elpt - 15) >= 4.999, 15, elpt),
         ),
-    ) * elall.evaluate(etag, "sfdown", "wp90iso", elecs.eta, elecs.pt)
-
-    muSF = muid.evaluate(
-        etag + "_UL", abs(mus.eta), np.where(mus.pt <= 15, 15.001, mus.pt), "sf"
-    ) * muiso.evaluate(
-        etag + "_UL", abs(mus.eta), np.where(mus.pt <= 15, 15.001, mus.pt), "sf"
+        mask=~isAbove20,
+        default=0,
+    )
+    elID = evaluateVariations(
+        elall, elVariations, lambda syst: (etag, syst, "wp90iso", eleta, elpt)
     )
-    muSFUp = muid.evaluate(
-        etag + "_UL", abs(mus.eta), np.where(mus.pt <= 15, 15.001, mus.pt), "systup"
-    ) * muiso.evaluate(
-        etag + "_UL", abs(mus.eta), np.where(mus.pt <= 15, 15.001, mus.pt), "systup"
+    elSF, elSFUp, elSFDown = (
+        np.where(isAbove20, recoAbove20[syst], recoBelow20[syst]) * elID[syst]
+        for syst in elVariations
+    )
+
+    # muons: ID SF times isolation SF
+    mupt = np.where(np.array(mus.pt) <= 15, 15.001, np.array(mus.pt))
+    mueta = np.abs(np.array(mus.eta))
+    muVariations = ["sf", "systup", "systdown"]
+    muIDSF = evaluateVariations(
+        muid, muVariations, lambda syst: (etag + "_UL", mueta, mupt, syst)
     )
-    muSFDown = muid.evaluate(
-        etag + "_UL", abs(mus.eta), np.where(mus.pt <= 15, 15.001, mus.pt), "systdown"
-    ) * muiso.evaluate(
-        etag + "_UL", abs(mus.eta), np.where(mus.pt <= 15, 15.001, mus.pt), "systdown"
+    muIsoSF = evaluateVariations(
+        muiso, muVariations, lambda syst: (etag + "_UL", mueta, mupt, syst)
     )
+    muSF, muSFUp, muSFDown = (muIDSF[syst] * muIsoSF[syst] for syst in muVariations)
 
     elSF = ak.unflatten(elSF, nelecs)
     elSFUp = ak.unflatten(elSFUp, nelecs)
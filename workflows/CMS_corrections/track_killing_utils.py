@@ -2,7 +2,76 @@ import awkward as ak
 import numpy as np
 
 
-def track_killing(self, tracks):
+def track_killing_rng(events):
+    """
+    Build the random number generator used for track killing in this chunk.
+    The seed is derived from the (run, lumi, event) of the first event and the
+    number of events, so that re-running (or retrying) the same chunk gives the
+    same killed tracks, while different chunks get independent random numbers.
+    """
+    if len(events) == 0:
+        return np.random.default_rng(0)
+    if "lumSec" in ak.fields(events):
+        lumi = events.lumSec
+    else:
+        lumi = events.luminosityBlock
+    entropy = [
+        int(events.run[0]),
+        int(lumi[0]),
+        int(events.event[0]),
+        len(events),
+    ]
+    return np.random.default_rng(np.random.SeedSequence(entropy))
+
+
+def drop_tracks_by_probability(tracks, probs, rng):
+    """
+    Drop each track independently with probability probs.
+    probs is a flat array aligned with ak.flatten(tracks): the whole chunk is
+    done with a single draw from rng, and the mask is rebuilt from the offsets.
+    """
+    counts = ak.to_numpy(ak.num(tracks, axis=1))
+    rands = rng.random(int(counts.sum()))
+    keep = rands >= np.asarray(probs)
+    return tracks[ak.unflatten(keep, counts)]
+
+
+def drop_tracks_by_fraction(tracks, blocks, fractions, rng):
+    """
+    In each event, drop int(fraction * n) randomly chosen tracks out of the n
+    tracks of each block.
+    blocks is a flat integer array aligned with ak.flatten(tracks) giving the
+    block of each track, and fractions[block] the fraction to drop in that block.
+    Tracks are ranked within their (event, block) group by a single random draw
+    for the whole chunk, and the lowest ranked ones are dropped.
+    """
+    counts = ak.to_numpy(ak.num(tracks, axis=1))
+    ntracks = int(counts.sum())
+    blocks = np.asarray(blocks, dtype=np.int64)
+    fractions = np.asarray(fractions, dtype=np.float64)
+    keep = np.ones(ntracks, dtype=bool)
+    if ntracks == 0:
+        return tracks[ak.unflatten(keep, counts)]
+
+    # sort the tracks by (event, block), and randomly within each group
+    event_index = np.repeat(np.arange(len(counts), dtype=np.int64), counts)
+    groups = event_index * len(fractions) + blocks
+    order = np.lexsort((rng.random(ntracks), groups))
+    sorted_groups = groups[order]
+
+    # rank of each track within its group
+    group_starts = np.flatnonzero(np.diff(sorted_groups, prepend=-1))
+    group_sizes = np.diff(np.append(group_starts, ntracks))
+    rank = np.arange(ntracks) - np.repeat(group_starts, group_sizes)
+
+    # number of tracks to drop in each group
+    ndrop = np.floor(fractions[blocks[order][group_starts]] * group_sizes)
+    keep[order[rank < np.repeat(ndrop, group_sizes)]] = False
+
+    return tracks[ak.unflatten(keep, counts)]
+
+
+def track_killing(self, tracks, rng):
     """
     Drop 2.7%, 2.2%, and 2.1% of the tracks randomly at reco-level
     for charged-particles with 1 < pT < 20 GeV in simulation for 2016, 2017, and
@@ -18,36 +87,16 @@ def track_killing(self, tracks):
         block1_percent = year_percent[str(self.era)]
         block2_percent = 0.01
 
-    block0_indices = tracks.pt <= 1
-    block1_indices = (tracks.pt > 1) & (tracks.pt < 20)
-    block2_indices = tracks.pt >= 20
-
-    new_indices = []
-
-    for i in range(len(tracks)):
-        event_indices = np.arange(len(tracks[i]))
-        event_bool = np.array([True] * len(tracks[i]))
+    # block 0: pT <= 1, block 1: 1 < pT < 20, block 2: pT >= 20
+    pt = ak.to_numpy(ak.flatten(tracks.pt))
+    blocks = (pt > 1).astype(np.int64) + (pt >= 20)
 
-        block1_event_indices = event_indices[block1_indices[i]]
-        block1_event_indices_drop = np.random.choice(
-            block1_event_indices, int((block1_percent) * len(block1_event_indices))
-        )
-        event_bool[block1_event_indices_drop] = False
-
-        block2_event_indices = event_indices[block2_indices[i]]
-        block2_event_indices_drop = np.random.choice(
-            block2_event_indices, int((block2_percent) * len(block2_event_indices))
-        )
-        event_bool[block2_event_indices_drop] = False
-
-        new_indices.append(list(event_bool))
-
-    new_indices = ak.Array(new_indices)
-    tracks = tracks[new_indices]
-    return tracks
+    return drop_tracks_by_fraction(
+        tracks, blocks, [0.0, block1_percent, block2_percent], rng
+    )
 
 
-def scout_track_killing(self, tracks):
+def scout_track_killing(self, tracks, rng):
     """
     Drop 2.5% of the tracks randomly at reco-level
     for charged-particles with 1 < pT < 20 GeV in simulation when reclustering the constituents.
@@ -61,7 +110,6 @@ def scout_track_killing(self, tracks):
     """
 
     # Read in the scaling files
-    np.random.seed(2022)  # random seed to get repeatable results
     pt_bins = np.array(
         [0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.75, 1, 1.25, 1.5, 2.0, 3, 10, 20, 50]
     )
@@ -71,24 +119,18 @@ def scout_track_killing(self, tracks):
     # Create the scaling and apply it to the random killing
     scaling = np.divide(qcdscale, datascale)
     scaling = np.append(scaling, scaling[-1])
-    trackbin = np.digitize(ak.flatten(tracks.pt), pt_bins) - 1
+    trackbin = np.digitize(ak.to_numpy(ak.flatten(tracks.pt)), pt_bins) - 1
     scale = np.take(scaling, trackbin)
-    probs = ak.where(
-        ak.flatten(tracks["pt"]) < 20, 0.025 * scale, 0.01 * scale
+    probs = np.where(
+        ak.to_numpy(ak.flatten(tracks["pt"])) < 20, 0.025 * scale, 0.01 * scale
     )  # 5% if pt < 1, otherwise 2%.
-    rands = np.random.rand(len(probs)) > probs
-    trk_killer = ak.Array(
-        ak.layout.ListOffsetArray64(tracks.layout.offsets, ak.layout.NumpyArray(rands))
-    )
 
     # Create the new track collection with killed tracks
-    tracks = tracks[trk_killer]
-    return tracks
+    return drop_tracks_by_probability(tracks, probs, rng)
 
 
-def scout_track_killingOffline(self, tracks):
+def scout_track_killingOffline(self, tracks, rng):
     # Read in the scaling files
-    np.random.seed(2022)  # random seed to get repeatable results
     pt_bins = np.array(
         [0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.75, 1, 1.25, 1.5, 2.0, 3, 10, 20, 50]
     )
@@ -98,18 +140,13 @@ def scout_track_killingOffline(self, tracks):
     trackwgts = trackwgts.flatten()
 
     # Create the scaling and apply it to the random killing
-    ptbin = np.digitize(ak.flatten(tracks["pt"]), pt_bins) - 1
-    etabin = np.digitize(ak.flatten(tracks["eta"]), eta_bins) - 1
+    ptbin = np.digitize(ak.to_numpy(ak.flatten(tracks["pt"])), pt_bins) - 1
+    etabin = np.digitize(ak.to_numpy(ak.flatten(tracks["eta"])), eta_bins) - 1
     bins = np.add((ptbin) * (len(eta_bins) - 1), etabin)
-    probs = np.take(trackwgts, bins)
-    rands = np.random.rand(len(probs)) < probs  # keep track is less than probability
-    trk_killer = ak.Array(
-        ak.layout.ListOffsetArray64(tracks.layout.offsets, ak.layout.NumpyArray(rands))
-    )
+    probs = np.take(trackwgts, bins)  # probability to keep the track
 
     # Create the new track collection with killed tracks
-    tracks = tracks[trk_killer]
-    return tracks
+    return drop_tracks_by_probability(tracks, 1 - probs, rng)
 
 
 def scaleTracksOffline(self, spherex):
@@ -9,12 +9,12 @@ from typing import Optional
 
 import awkward as ak
 import numpy as np
-import pandas as pd
 import vector
 from coffea import processor
 
 # Importing SUEP specific functions
 import workflows.SUEP_utils as SUEP_utils
+import workflows.track_utils as track_utils
 import workflows.ZH_utils as ZH_utils
 
 # Importing CMS corrections
@@ -26,10 +26,13 @@ from workflows.CMS_corrections.Prefire_utils import GetPrefireWeights
 from workflows.CMS_corrections.track_killing_utils import (
     scout_track_killing,
     track_killing,
+    track_killing_rng,
 )
 
 # IO utils
 from workflows.utils import pandas_utils
+from workflows.utils.output_table import OutputTable
+from workflows.utils.stage_cache import StageCache
 
 # Set vector behavior
 vector.register_awkward()
@@ -50,6 +53,9 @@ class SUEP_cluster(processor.ProcessorABC):
         output_location: Optional[str],
         accum: Optional[bool] = None,
         trigger: Optional[str] = None,
+        cluster_workers: int = 1,
+        cluster_batch_size: int = 0,
+        report_timings: bool = False,
     ) -> None:
         self._flag = flag
         self.output_location = output_location
@@ -68,7 +74,12 @@ class SUEP_cluster(processor.ProcessorABC):
         self.doOF = False
         self.accum = accum
         self.trigger = trigger
-        self.out_vars = pd.DataFrame()
+        self.cluster_workers = cluster_workers
+        self.cluster_batch_size = cluster_batch_size
+        self.report_timings = report_timings
+        self.out_vars = OutputTable()
+        self.stages = StageCache()
+        self.track_report = track_utils.TrackReport()
 
         if self.do_inf:
             # ML settings
@@ -194,87 +205,49 @@ class SUEP_cluster(processor.ProcessorABC):
         )
         return genParts
 
-    def getTracks(self, events):
-        Cands = ak.zip(
-            {
-                "pt": events.PFCands.trkPt,
-                "eta": events.PFCands.trkEta,
-                "phi": events.PFCands.trkPhi,
-                "mass": events.PFCands.mass,
-            },
-            with_name="Momentum4D",
-        )
-        cut = (
-            (events.PFCands.fromPV > 1)
-            & (events.PFCands.trkPt >= 0.75)
-            & (abs(events.PFCands.trkEta) <= 2.5)
-            & (abs(events.PFCands.dz) < 10)
-            & (events.PFCands.dzErr < 0.05)
-        )
-        Cleaned_cands = Cands[cut]
-        Cleaned_cands = ak.packed(Cleaned_cands)
+    def getGenSUEP(self, events):
+        """
+        Mass, pT, eta and phi of the gen SUEP (the last scalar in the decay chain),
+        zeros for data and for samples without one.
+        """
+        SUEP_genMass = len(events) * [0]
+        SUEP_genPt = len(events) * [0]
+        SUEP_genEta = len(events) * [0]
+        SUEP_genPhi = len(events) * [0]
 
-        # Prepare the Lost Track collection
-        LostTracks = ak.zip(
-            {
-                "pt": events.lostTracks.pt,
-                "eta": events.lostTracks.eta,
-                "phi": events.lostTracks.phi,
-                "mass": 0.0,
-            },
-            with_name="Momentum4D",
-        )
-        cut = (
-            (events.lostTracks.fromPV > 1)
-            & (events.lostTracks.pt >= 0.75)
-            & (abs(events.lostTracks.eta) <= 1.0)
-            & (abs(events.lostTracks.dz) < 10)
-            & (events.lostTracks.dzErr < 0.05)
-        )
-        Lost_Tracks_cands = LostTracks[cut]
-        Lost_Tracks_cands = ak.packed(Lost_Tracks_cands)
+        if self.isMC and not self.scouting:
+            genParts = self.getGenTracks(events)
+            genSUEP = genParts[(abs(genParts.pdgID) == 25)]
+
+            # we need to grab the last SUEP in the chain for each event
+            genSUEP = SUEP_utils.getChainParticle(genSUEP)
+            SUEP_genMass = ak.to_numpy(ak.fill_none(genSUEP.mass, 0))
+            SUEP_genPt = ak.to_numpy(ak.fill_none(genSUEP.pt, 0))
+            SUEP_genPhi = ak.to_numpy(ak.fill_none(genSUEP.phi, 0))
+            SUEP_genEta = ak.to_numpy(ak.fill_none(genSUEP.eta, 0))
 
-        # select which tracks to use in the script
-        # dimensions of tracks = events x tracks in event x 4 momenta
-        tracks = ak.concatenate([Cleaned_cands, Lost_Tracks_cands], axis=1)
+        if self.isMC and self.scouting and "SUEP" in self.sample:
+            SUEP_genMass = events.scalar.mass
+            SUEP_genPt = events.scalar.pt
+            SUEP_genPhi = events.scalar.phi
+            SUEP_genEta = events.scalar.eta
 
-        return tracks, Cleaned_cands
+        return SUEP_genMass, SUEP_genPt, SUEP_genEta, SUEP_genPhi
+
+    def getTracks(self, events):
+        return track_utils.getTracks(
+            track_utils.nanoEventsGetter(events),
+            "ggF",
+            report=getattr(self, "track_report", None),
+        )
 
     def getScoutingTracks(self, events):
-        if "2016" in self.era:
-            Cands = ak.zip(
-                {
-                    "pt": events.offlineTrack.pt,
-                    "eta": events.offlineTrack.eta,
-                    "phi": events.offlineTrack.phi,
-                    "mass": events.offlineTrack.mass,
-                },
-                with_name="Momentum4D",
-            )
-            cut = (
-                (events.offlineTrack.pt >= 0.75)
-                & (abs(events.offlineTrack.eta) <= 2.4)
-                & (events.offlineTrack.quality == 1)
-            )
-        else:
-            Cands = ak.zip(
-                {
-                    "pt": events.PFcand.pt,
-                    "eta": events.PFcand.eta,
-                    "phi": events.PFcand.phi,
-                    "mass": events.PFcand.mass,
-                },
-                with_name="Momentum4D",
-            )
-            cut = (
-                (events.PFcand.pt >= 0.75)
-                & (abs(events.PFcand.eta) <= 2.4)
-                & (events.PFcand.vertex == 0)
-                & (events.PFcand.q != 0)
-            )
-        Cleaned_cands = Cands[cut]
-        tracks = ak.packed(Cleaned_cands)
-        return tracks, Cleaned_cands
+        selection = "scouting_2016" if "2016" in self.era else "scouting"
+        return track_utils.getTracks(
+            track_utils.nanoEventsGetter(events),
+            selection,
+            report=getattr(self, "track_report", None),
+        )
 
     def getLooseLeptons(self, events):
         if self.scouting == 1:
@@ -365,43 +338,9 @@ class SUEP_cluster(processor.ProcessorABC):
         ak_inclusive_cluster,
         electrons,
         muons,
+        genSUEP=None,
         out_label="",
     ):
-        # select out ak4jets
-        if self.scouting and "2016" in self.era:
-            ak4jets = self.jet_awkward(events.OffJet)
-        else:
-            ak4jets = self.jet_awkward(events.Jet)
-
-        # work on JECs and systematics
-        prefix = ""
-        if self.accum:
-            if "dask" in self.accum:
-                prefix = "dask-worker-space/"
-        jets_c = getJECCorrectedAK4Jets(
-            self.sample,
-            self.isMC,
-            self.era,
-            events,
-            jer=self.isMC,
-            scouting=self.scouting,
-            prefix=prefix,
-        )
-        jet_HEM_Cut, _ = jetHEMFilter(self, jets_c, events.run)
-        jets_c = jets_c[jet_HEM_Cut]
-        jets_jec = self.jet_awkward(jets_c)
-        if self.isMC:
-            jets_jec_JERUp = self.jet_awkward(jets_c["JER"].up)
-            jets_jec_JERDown = self.jet_awkward(jets_c["JER"].down)
-            jets_jec_JESUp = self.jet_awkward(jets_c["JES_jes"].up)
-            jets_jec_JESDown = self.jet_awkward(jets_c["JES_jes"].down)
-        # For data set these all to nominal so we can plot without switching all of the names
-        else:
-            jets_jec_JERUp = jets_jec
-            jets_jec_JERDown = jets_jec
-            jets_jec_JESUp = jets_jec
-            jets_jec_JESDown = jets_jec
-
         # save per event variables to a dataframe
         self.out_vars["event" + out_label] = events.event.to_list()
         self.out_vars["run" + out_label] = events.run
@@ -415,7 +354,43 @@ class SUEP_cluster(processor.ProcessorABC):
             ak_inclusive_jets
         ).to_list()
 
+        # the jets are the same for all the track variations, only store them once
         if out_label == "":
+            # select out ak4jets
+            if self.scouting and "2016" in self.era:
+                ak4jets = self.jet_awkward(events.OffJet)
+            else:
+                ak4jets = self.jet_awkward(events.Jet)
+
+            # work on JECs and systematics
+            prefix = ""
+            if self.accum:
+                if "dask" in self.accum:
+                    prefix = "dask-worker-space/"
+            jets_c = getJECCorrectedAK4Jets(
+                self.sample,
+                self.isMC,
+                self.era,
+                events,
+                jer=self.isMC,
+                scouting=self.scouting,
+                prefix=prefix,
+            )
+            jet_HEM_Cut, _ = jetHEMFilter(self, jets_c, events.run)
+            jets_c = jets_c[jet_HEM_Cut]
+            jets_jec = self.jet_awkward(jets_c)
+            if self.isMC:
+                jets_jec_JERUp = self.jet_awkward(jets_c["JER"].up)
+                jets_jec_JERDown = self.jet_awkward(jets_c["JER"].down)
+                jets_jec_JESUp = self.jet_awkward(jets_c["JES_jes"].up)
+                jets_jec_JESDown = self.jet_awkward(jets_c["JES_jes"].down)
+            # For data set these all to nominal so we can plot without switching all of the names
+            else:
+                jets_jec_JERUp = jets_jec
+                jets_jec_JERDown = jets_jec
+                jets_jec_JESUp = jets_jec
+                jets_jec_JESDown = jets_jec
+
             self.out_vars["ht" + out_label] = ak.sum(ak4jets.pt, axis=-1).to_list()
             self.out_vars["ht_JEC" + out_label] = ak.sum(jets_jec.pt, axis=-1).to_list()
             self.out_vars["ht_JEC" + out_label + "_JER_up"] = ak.sum(
@@ -477,27 +452,9 @@ class SUEP_cluster(processor.ProcessorABC):
                 self.out_vars["prefire_down"] = prefireweights[2]
 
         # get gen SUEP kinematics
-        SUEP_genMass = len(events) * [0]
-        SUEP_genPt = len(events) * [0]
-        SUEP_genEta = len(events) * [0]
-        SUEP_genPhi = len(events) * [0]
-
-        if self.isMC and not self.scouting:
-            genParts = self.getGenTracks(events)
-            genSUEP = genParts[(abs(genParts.pdgID) == 25)]
-
-            # we need to grab the last SUEP in the chain for each event
-            SUEP_genMass = [g[-1].mass if len(g) > 0 else 0 for g in genSUEP]
-            SUEP_genPt = [g[-1].pt if len(g) > 0 else 0 for g in genSUEP]
-            SUEP_genPhi = [g[-1].phi if len(g) > 0 else 0 for g in genSUEP]
-            SUEP_genEta = [g[-1].eta if len(g) > 0 else 0 for g in genSUEP]
-
-        if self.isMC and self.scouting and "SUEP" in self.sample:
-            SUEP_genMass = events.scalar.mass
-            SUEP_genPt = events.scalar.pt
-            SUEP_genPhi = events.scalar.phi
-            SUEP_genEta = events.scalar.eta
-
+        if genSUEP is None:
+            genSUEP = self.getGenSUEP(events)
+        SUEP_genMass, SUEP_genPt, SUEP_genEta, SUEP_genPhi = genSUEP
         self.out_vars["SUEP_genMass" + out_label] = SUEP_genMass
         self.out_vars["SUEP_genPt" + out_label] = SUEP_genPt
         self.out_vars["SUEP_genEta" + out_label] = SUEP_genEta
@@ -542,12 +499,11 @@ class SUEP_cluster(processor.ProcessorABC):
         for iCol in range(len(self.columns)):
             self.columns[iCol] = self.columns[iCol] + label
 
-    def analysis(self, events, do_syst=False, col_label=""):
-        #####################################################################################
-        # ---- Trigger event selection
-        # Cut based on ak4 jets to replicate the trigger
-        #####################################################################################
-
+    def preselection(self, events):
+        """
+        Event selection shared by all the variations: golden JSON, lepton veto,
+        trigger and MET filters.
+        """
         # golden jsons for offline data
         if self.isMC == 0:
             events = applyGoldenJSON(self, events)
@@ -555,13 +511,37 @@ class SUEP_cluster(processor.ProcessorABC):
         events = self.eventSelection(events)
         if self.scouting != 1:
             events = self.selectByFilters(events)
+        return events
+
+    def buildObjects(self, events):
+        """
+        Tracks and loose leptons of the preselected events, before any track killing.
+        """
+        if self.scouting == 1:
+            tracks, _ = self.getScoutingTracks(events)
+        else:
+            tracks, _ = self.getTracks(events)
+        looseElectrons, looseMuons = self.getLooseLeptons(events)
+        return tracks, looseElectrons, looseMuons
+
+    def analysis(self, events, do_syst=False, col_label=""):
+        #####################################################################################
+        # ---- Trigger event selection
+        # Cut based on ak4 jets to replicate the trigger.
+        # This and the object building are shared by all the variations, and are only
+        # computed once per chunk.
+        #####################################################################################
+
+        events = self.stages.get("preselection", self.preselection, events)
+
+        # one row per selected event in the output table
+        self.out_vars.setNRows(len(events))
 
         # output empty dataframe if no events pass trigger
+        # (the pandas_merger placeholder is made in process, once all variations ran)
         if len(events) == 0:
             print("No events passed trigger. Saving empty outputs.")
-            if self.accum == "pandas_merger":
-                self.out_vars = pd.DataFrame(["empty"], columns=["empty"])
-            elif self.accum:
+            if self.accum and self.accum != "pandas_merger":
                 self.initializeColumns(col_label)
                 for c in self.columns:
                     self.out_vars[c] = np.nan
@@ -571,18 +551,16 @@ class SUEP_cluster(processor.ProcessorABC):
         # ---- Track selection
         # Prepare the clean PFCand matched to tracks collection
         #####################################################################################
-        if self.scouting == 1:
-            tracks, Cleaned_cands = self.getScoutingTracks(events)
-        else:
-            tracks, Cleaned_cands = self.getTracks(events)
-        looseElectrons, looseMuons = self.getLooseLeptons(events)
-        if self.isMC and do_syst and self.scouting == 1:
-            tracks = scout_track_killing(self, tracks)
-            Cleaned_cands = scout_track_killing(self, Cleaned_cands)
-
-        if self.isMC and do_syst and self.scouting == 0:
-            tracks = track_killing(self, tracks)
-            Cleaned_cands = track_killing(self, Cleaned_cands)
+        tracks, looseElectrons, looseMuons = self.stages.get(
+            "objects", self.buildObjects, events
+        )
+        if self.isMC and do_syst:
+            with self.stages.time("trackKilling" + col_label):
+                rng = track_killing_rng(events)
+                if self.scouting == 1:
+                    tracks = scout_track_killing(self, tracks, rng)
+                else:
+                    tracks = track_killing(self, tracks, rng)
 
         #####################################################################################
         # ---- FastJet reclustering
@@ -594,23 +572,32 @@ class SUEP_cluster(processor.ProcessorABC):
         else:
             min_FastJet = 150
 
-        ak_inclusive_jets, ak_inclusive_cluster = SUEP_utils.FastJetReclustering(
-            tracks, r=1.5, minPt=min_FastJet
-        )
+        with self.stages.time("clustering" + col_label):
+            ak_inclusive_jets, ak_inclusive_cluster = SUEP_utils.FastJetReclustering(
+                tracks,
+                r=1.5,
+                minPt=min_FastJet,
+                workers=self.cluster_workers,
+                batch_size=self.cluster_batch_size,
+            )
 
         #####################################################################################
         # ---- Event level information
         #####################################################################################
 
-        self.storeEventVars(
-            events,
-            tracks,
-            ak_inclusive_jets,
-            ak_inclusive_cluster,
-            looseElectrons,
-            looseMuons,
-            out_label=col_label,
-        )
+        # the gen SUEP kinematics are shared by all the track variations
+        genSUEP = self.stages.get("genSUEP", self.getGenSUEP, events)
+        with self.stages.time("eventVars" + col_label):
+            self.storeEventVars(
+                events,
+                tracks,
+                ak_inclusive_jets,
+                ak_inclusive_cluster,
+                looseElectrons,
+                looseMuons,
+                genSUEP=genSUEP,
+                out_label=col_label,
+            )
 
         # indices of events in tracks, used to keep track which events pass selections
         indices = np.arange(0, len(tracks))
@@ -641,17 +628,18 @@ class SUEP_cluster(processor.ProcessorABC):
         )
         SUEP_cand, ISR_cand, SUEP_cluster_tracks, ISR_cluster_tracks = topTwoJets
 
-        SUEP_utils.ClusterMethod(
-            self,
-            indices,
-            tracks,
-            SUEP_cand,
-            ISR_cand,
-            SUEP_cluster_tracks,
-            ISR_cluster_tracks,
-            do_inverted=True,
-            out_label=col_label,
-        )
+        with self.stages.time("clusterMethod" + col_label):
+            SUEP_utils.ClusterMethod(
+                self,
+                indices,
+                tracks,
+                SUEP_cand,
+                ISR_cand,
+                SUEP_cluster_tracks,
+                ISR_cluster_tracks,
+                do_inverted=True,
+                out_label=col_label,
+            )
 
         if self.do_inf:
             import workflows.ML_utils as ML_utils
@@ -677,31 +665,48 @@ class SUEP_cluster(processor.ProcessorABC):
         elif self.isMC:
             self.gensumweight = ak.sum(events.genWeight)
 
+        # fresh output table, stages and track selection report for this chunk
+        self.out_vars = OutputTable()
+        self.stages = StageCache()
+        self.track_report = track_utils.TrackReport()
+
         # run the analysis with the track systematics applied
         if self.isMC and self.do_syst:
             self.analysis(events, do_syst=True, col_label="_track_down")
 
-        # run the analysis
+        # run the analysis, reusing the selection and objects of the first pass
         self.analysis(events)
 
+        # the merger needs a placeholder row when no events pass the trigger
+        if len(self.out_vars) == 0 and self.accum == "pandas_merger":
+            self.out_vars = OutputTable()
+            self.out_vars["empty"] = ["empty"]
+
+        if self.report_timings:
+            print(self.stages.report())
+            print(self.track_report)
+
+        # convert the output table to a DataFrame, once all the columns are filled
+        out_vars = self.out_vars.to_pandas()
+
         # output result to dask dataframe accumulator
         if self.accum:
             if "dask" in self.accum:
-                return self.out_vars
+                return out_vars
 
             # output result to iterative/futures accumulator
             if "iterative" in self.accum or "futures" in self.accum:
                 # Convert output to the desired format when the accumulator is used
-                for c in self.out_vars.columns:
-                    output[c] = self.out_vars[c].to_list()
-                output = {dataset: self.out_vars}
+                for c in out_vars.columns:
+                    output[c] = out_vars[c].to_list()
+                output = {dataset: out_vars}
                 return output
 
             if "pandas_merger" == self.accum:
                 # save the out_vars object as a Pandas DataFrame
                 pandas_utils.save_dfs(
                     self,
-                    [self.out_vars],
+                    [out_vars],
                     ["vars"],
                     "ntuple_"
                     + events.behavior["__events_factory__"]._partition_key.replace(
@@ -5,7 +5,7 @@ https://github.com/scikit-hep/fastjet
 Pietro Lugato, Chad Freer, Luca Lavezzo, Joey Reichert 2023
 """
 
-import warnings
+from collections import defaultdict
 
 import awkward as ak
 import numpy as np
@@ -13,10 +13,9 @@ import pandas as pd
 import vector
 from coffea import processor
 
-warnings.simplefilter(action="ignore", category=pd.errors.PerformanceWarning)
-
 # Importing SUEP specific functions
 import workflows.SUEP_utils as SUEP_utils
+import workflows.track_utils as track_utils
 import workflows.WH_utils as WH_utils
 
 # Importing CMS corrections
@@ -26,10 +25,14 @@ from workflows.CMS_corrections.HEM_utils import jetHEMFilter
 from workflows.CMS_corrections.jetmet_utils import apply_jecs
 from workflows.CMS_corrections.PartonShower_utils import GetPSWeights
 from workflows.CMS_corrections.Prefire_utils import GetPrefireWeights
-from workflows.CMS_corrections.track_killing_utils import track_killing
+from workflows.CMS_corrections.track_killing_utils import (
+    track_killing,
+    track_killing_rng,
+)
 
 # IO utils
 from workflows.utils.pandas_accumulator import pandas_accumulator
+from workflows.utils.stage_cache import StageCache
 
 # Set vector behavior
 vector.register_awkward()
@@ -44,6 +47,9 @@ class SUEP_cluster_WH(processor.ProcessorABC):
         do_syst: bool,
         flag: bool,
         output_location=None,
+        cluster_workers: int = 1,
+        cluster_batch_size: int = 0,
+        report_timings: bool = False,
     ) -> None:
         self._flag = flag
         self.do_syst = do_syst
@@ -52,6 +58,11 @@ class SUEP_cluster_WH(processor.ProcessorABC):
         self.sample = sample
         self.output_location = output_location
         self.scouting = 0
+        self.cluster_workers = cluster_workers
+        self.cluster_batch_size = cluster_batch_size
+        self.report_timings = report_timings
+        self.stages = StageCache()
+        self.track_report = track_utils.TrackReport()
 
     def HighestPTMethod(
         self,
@@ -67,9 +78,17 @@ class SUEP_cluster_WH(processor.ProcessorABC):
         # cut on tracks from the selected lepton.
         #####################################################################################
 
-        tracks, _ = WH_utils.getTracks(events, lepton=self.lepton, leptonIsolation=0.4)
+        tracks, _ = self.stages.get(
+            "tracks",
+            WH_utils.getTracks,
+            events,
+            lepton=self.lepton,
+            leptonIsolation=0.4,
+            report=self.track_report,
+        )
         if self.isMC and "track_down" in out_label:
-            tracks = track_killing(self, tracks)
+            with self.stages.time("trackKilling" + out_label):
+                tracks = track_killing(self, tracks, track_killing_rng(events))
 
         # save tracks variables
         output["vars"].loc(indices, "ntracks" + out_label, ak.num(tracks).to_list())
@@ -102,7 +121,14 @@ class SUEP_cluster_WH(processor.ProcessorABC):
         #####################################################################################
 
         # make the ak15 clusters
-        ak15jets, clusters = SUEP_utils.FastJetReclustering(tracks, r=1.5, minPt=60)
+        with self.stages.time("clustering" + out_label):
+            ak15jets, clusters = SUEP_utils.FastJetReclustering(
+                tracks,
+                r=1.5,
+                minPt=60,
+                workers=self.cluster_workers,
+                batch_size=self.cluster_batch_size,
+            )
 
         # same some variables before making any selections on the ak15 clusters
         output["vars"].loc(
@@ -613,10 +639,11 @@ class SUEP_cluster_WH(processor.ProcessorABC):
             genSUEP = genParts[(abs(genParts.pdgID) == 25)]
 
             # we need to grab the last SUEP in the chain for each event
-            SUEP_genMass = [g[-1].mass if len(g) > 0 else 0 for g in genSUEP]
-            SUEP_genPt = [g[-1].pt if len(g) > 0 else 0 for g in genSUEP]
-            SUEP_genPhi = [g[-1].phi if len(g) > 0 else 0 for g in genSUEP]
-            SUEP_genEta = [g[-1].eta if len(g) > 0 else 0 for g in genSUEP]
+            genSUEP = SUEP_utils.getChainParticle(genSUEP)
+            SUEP_genMass = ak.fill_none(genSUEP.mass, 0)
+            SUEP_genPt = ak.fill_none(genSUEP.pt, 0)
+            SUEP_genPhi = ak.fill_none(genSUEP.phi, 0)
+            SUEP_genEta = ak.fill_none(genSUEP.eta, 0)
 
             # grab the daughters of the scalar
             darkphis = WH_utils.getGenDarkPseudoscalars(events)
@@ -685,19 +712,11 @@ class SUEP_cluster_WH(processor.ProcessorABC):
 
         # save genW for MC
         if self.isMC:
-            genW = WH_utils.getGenW(events)
-            output["vars"]["genW_pt"] = ak.fill_none(
-                ak.pad_none(genW.pt, 1, axis=1, clip=True), -999
-            )[:, 0]
-            output["vars"]["genW_phi"] = ak.fill_none(
-                ak.pad_none(genW.phi, 1, axis=1, clip=True), -999
-            )[:, 0]
-            output["vars"]["genW_eta"] = ak.fill_none(
-                ak.pad_none(genW.eta, 1, axis=1, clip=True), -999
-            )[:, 0]
-            output["vars"]["genW_mass"] = ak.fill_none(
-                ak.pad_none(genW.mass, 1, axis=1, clip=True), -999
-            )[:, 0]
+            genW = SUEP_utils.getChainParticle(WH_utils.getGenW(events), 0)
+            output["vars"]["genW_pt"] = ak.fill_none(genW.pt, -999)
+            output["vars"]["genW_phi"] = ak.fill_none(genW.phi, -999)
+            output["vars"]["genW_eta"] = ak.fill_none(genW.eta, -999)
+            output["vars"]["genW_mass"] = ak.fill_none(genW.mass, -999)
 
         # photon information
         photons = WH_utils.getPhotons(events, self.isMC)
@@ -764,7 +783,13 @@ class SUEP_cluster_WH(processor.ProcessorABC):
             ak.min(jet_W_deltaPhi, axis=-1), -999
         )
 
-    def analysis(self, events, output, out_label=""):
+    def preselection(self, events):
+        """
+        Event and lepton selection shared by all the variations.
+        Returns the selected events, their tight lepton, and the cutflow (without
+        any variation label).
+        """
+        cutflow = defaultdict(float)
 
         #####################################################################################
         # ---- Basic event selection
@@ -772,35 +797,35 @@ class SUEP_cluster_WH(processor.ProcessorABC):
         # Apply triggers, golden JSON, quality filters, and orthogonality selections.
         #####################################################################################
 
-        output["cutflow_total" + out_label] += ak.sum(events.genWeight)
+        cutflow["cutflow_total"] += ak.sum(events.genWeight)
 
         if self.isMC == 0:
             events = applyGoldenJSON(self, events)
             events.genWeight = np.ones(len(events))  # dummy value for data
 
-        output["cutflow_goldenJSON" + out_label] += ak.sum(events.genWeight)
+        cutflow["cutflow_goldenJSON"] += ak.sum(events.genWeight)
 
         events = WH_utils.genSelection(events, self.sample)
-        output["cutflow_genCuts" + out_label] += ak.sum(events.genWeight)
+        cutflow["cutflow_genCuts"] += ak.sum(events.genWeight)
 
         events = WH_utils.triggerSelection(
-            events, self.sample, self.era, self.isMC, output, out_label
+            events, self.sample, self.era, self.isMC, cutflow, ""
         )
-        output["cutflow_allTriggers" + out_label] += ak.sum(events.genWeight)
+        cutflow["cutflow_allTriggers"] += ak.sum(events.genWeight)
 
         events = WH_utils.qualityFiltersSelection(events, self.era)
-        output["cutflow_qualityFilters" + out_label] += ak.sum(events.genWeight)
+        cutflow["cutflow_qualityFilters"] += ak.sum(events.genWeight)
 
         events = WH_utils.orthogonalitySelection(events)
-        output["cutflow_orthogonality" + out_label] += ak.sum(events.genWeight)
+        cutflow["cutflow_orthogonality"] += ak.sum(events.genWeight)
 
         events = events[ak.num(WH_utils.getAK4Jets(events.Jet, isMC=self.isMC)) > 0]
-        output["cutflow_oneAK4jet" + out_label] += ak.sum(events.genWeight)
+        cutflow["cutflow_oneAK4jet"] += ak.sum(events.genWeight)
 
         # output file if no events pass selections, avoids errors later on
         if len(events) == 0:
             print("No events passed basic event selection. Saving empty outputs.")
-            return output
+            return events, None, cutflow
 
         #####################################################################################
         # ---- Lepton selection
@@ -813,12 +838,30 @@ class SUEP_cluster_WH(processor.ProcessorABC):
         leptonSelection = ak.num(tightLeptons) == 1
         events = events[leptonSelection]
         tightLeptons = tightLeptons[leptonSelection]
-        self.lepton = tightLeptons[:, 0]
-        output["cutflow_oneLepton" + out_label] += ak.sum(events.genWeight)
+        cutflow["cutflow_oneLepton"] += ak.sum(events.genWeight)
 
         # output file if no events pass selections, avoids errors later on
         if len(events) == 0:
             print("No events pass oneLepton.")
+            return events, None, cutflow
+
+        return events, tightLeptons[:, 0], cutflow
+
+    def analysis(self, events, output, out_label=""):
+
+        #####################################################################################
+        # ---- Event and lepton selection
+        # These don't change with the track variations, so are only computed once per
+        # chunk, and the cutflow is copied for each variation.
+        #####################################################################################
+
+        events, self.lepton, cutflow = self.stages.get(
+            "preselection", self.preselection, events
+        )
+        for key, value in cutflow.items():
+            output[key + out_label] += value
+
+        if self.lepton is None:
             return output
 
         #####################################################################################
@@ -881,6 +924,10 @@ class SUEP_cluster_WH(processor.ProcessorABC):
             genWeight = np.ones(len(events))
             events = ak.with_field(events, genWeight, "genWeight")
 
+        # fresh stages for this chunk, shared by the nominal and track variations
+        self.stages = StageCache()
+        self.track_report = track_utils.TrackReport()
+
         # run the analysis
         output = self.analysis(events, output)
 
@@ -927,6 +974,10 @@ class SUEP_cluster_WH(processor.ProcessorABC):
             )
             output = self.analysis(events, output, out_label="_track_down")
 
+        if self.report_timings:
+            print(self.stages.report())
+            print(self.track_report)
+
         return {dataset: output}
 
     def postprocess(self, accumulator):
@@ -20,10 +20,16 @@ import pickle5 as pickle
 import vector
 from coffea import lookup_tools, processor
 
+import workflows.SUEP_utils as SUEP_utils
+import workflows.track_utils as track_utils
 from workflows.CMS_corrections.btag_utils import btagcuts, doBTagWeights, getBTagEffs
 from workflows.CMS_corrections.jetmet_utils import apply_jecs
 from workflows.CMS_corrections.leptonscale_utils import doLeptonScaleVariations
 from workflows.CMS_corrections.leptonsf_utils import doLeptonSFs, doTriggerSFs
+from workflows.CMS_corrections.track_killing_utils import (
+    drop_tracks_by_probability,
+    track_killing_rng,
+)
 
 vector.register_awkward()
 
@@ -67,35 +73,16 @@ class SUEP_cluster_ZH(processor.ProcessorABC):
     def sphericity(self, events, particles, r):
         # In principle here we already have ak.num(particles) != 0
         # Some sanity replacements just in case the boosting broke
-        px = ak.nan_to_num(particles.px, 0)
-        py = ak.nan_to_num(particles.py, 0)
-        pz = ak.nan_to_num(particles.pz, 0)
-        p = ak.nan_to_num(particles.p, 0)
-
-        norm = np.squeeze(ak.sum(p**r, axis=1, keepdims=True))
-        s = np.array(
-            [
-                [
-                    ak.sum(px * px * p ** (r - 2.0), axis=1, keepdims=True) / norm,
-                    ak.sum(px * py * p ** (r - 2.0), axis=1, keepdims=True) / norm,
-                    ak.sum(px * pz * p ** (r - 2.0), axis=1, keepdims=True) / norm,
-                ],
-                [
-                    ak.sum(py * px * p ** (r - 2.0), axis=1, keepdims=True) / norm,
-                    ak.sum(py * py * p ** (r - 2.0), axis=1, keepdims=True) / norm,
-                    ak.sum(py * pz * p ** (r - 2.0), axis=1, keepdims=True) / norm,
-                ],
-                [
-                    ak.sum(pz * px * p ** (r - 2.0), axis=1, keepdims=True) / norm,
-                    ak.sum(pz * py * p ** (r - 2.0), axis=1, keepdims=True) / norm,
-                    ak.sum(pz * pz * p ** (r - 2.0), axis=1, keepdims=True) / norm,
-                ],
-            ]
-        )
-        s = np.squeeze(np.moveaxis(s, 2, 0), axis=3)
+        counts = ak.to_numpy(ak.num(particles, axis=1))
+        px = np.nan_to_num(ak.to_numpy(ak.flatten(particles.px)), nan=0)
+        py = np.nan_to_num(ak.to_numpy(ak.flatten(particles.py)), nan=0)
+        pz = np.nan_to_num(ak.to_numpy(ak.flatten(particles.pz)), nan=0)
+        p = np.nan_to_num(ak.to_numpy(ak.flatten(particles.p)), nan=0)
+
+        s = SUEP_utils.sphericity_tensor(px, py, pz, p, counts, r)
         s = np.nan_to_num(s, copy=False, nan=1.0, posinf=1.0, neginf=1.0)
 
-        evals = np.sort(np.linalg.eigvals(s))
+        evals = SUEP_utils.sym3x3_eigvals(s)
         # eval1 < eval2 < eval3
         return evals
 
@@ -448,60 +435,15 @@ class SUEP_cluster_ZH(processor.ProcessorABC):
         return events, jets, [coll for coll in extraColls]
 
     def selectByTracks(self, events, leptons, extraColls=[]):
-        ### PARTICLE FLOW CANDIDATES ###
-        # Every particle in particle flow (clean PFCand matched to tracks collection)
-        Cands = ak.zip(
-            {
-                "pt": events.PFCands.trkPt,
-                "eta": events.PFCands.trkEta,
-                "phi": events.PFCands.trkPhi,
-                "mass": events.PFCands.mass,
-                "pdgId": events.PFCands.pdgId,
-            },
-            with_name="Momentum4D",
-        )
-
-        cutPF = (
-            (events.PFCands.fromPV > 1)
-            & (events.PFCands.trkPt >= 1)
-            & (abs(events.PFCands.trkEta) <= 2.5)
-            & (abs(events.PFCands.dz) < 0.05)
-            & (abs(events.PFCands.d0) < 0.05)
-            & (events.PFCands.puppiWeight > 0.1)
-        )
-        Cleaned_cands = ak.packed(Cands[cutPF])
-
-        ### LOST TRACKS ###
-        # Unidentified tracks, usually SUEP Particles
-        LostTracks = ak.zip(
-            {
-                "pt": events.lostTracks.pt,
-                "eta": events.lostTracks.eta,
-                "phi": events.lostTracks.phi,
-                "mass": 0.0,
-                "pdgId": -99,
-            },
-            with_name="Momentum4D",
-        )
-
-        cutLost = (
-            (events.lostTracks.fromPV > 1)
-            & (events.lostTracks.pt >= 1)
-            & (abs(events.lostTracks.eta) <= 2.5)
-            & (abs(events.lostTracks.dz) < 0.05)
-            & (abs(events.lostTracks.d0) < 0.05)
-            & (events.lostTracks.puppiWeight > 0.1)
-        )
-        Lost_Tracks_cands = ak.packed(LostTracks[cutLost])
-
+        # PF candidates and lost tracks (unidentified tracks, usually SUEP particles),
+        # without the tracks that overlap with the leptons
         # dimensions of tracks = events x tracks in event x 4 momenta
-        totalTracks = ak.concatenate([Cleaned_cands, Lost_Tracks_cands], axis=1)
-
-        # Sorting out the tracks that overlap with leptons
-        totalTracks = totalTracks[
-            (totalTracks.deltaR(leptons[:, 0]) >= 0.4)
-            & (totalTracks.deltaR(leptons[:, 1]) >= 0.4)
-        ]
+        totalTracks, _ = track_utils.getTracks(
+            track_utils.nanoEventsGetter(events),
+            "ZH",
+            leptons=[leptons[:, 0], leptons[:, 1]],
+            isolation=0.4,
+        )
         nTracks = ak.num(totalTracks, axis=1)
         return events, totalTracks, nTracks, [coll for coll in extraColls]
 
@@ -542,12 +484,12 @@ class SUEP_cluster_ZH(processor.ProcessorABC):
                 & (abs(events.GenPart.status - 25) < 6)
             )  # Antileptons from the hard scattering
             cutgenZ = (events.GenPart.pdgId == 23) & (events.GenPart.status == 22)
-            genlepsPos = ak.pad_none(GenParts[cutgenLepsPos], 1, clip=True)
-            genlepsNeg = ak.pad_none(GenParts[cutgenLepsNeg], 1, clip=True)
+            genlepPos = SUEP_utils.getChainParticle(GenParts[cutgenLepsPos], 0)
+            genlepNeg = SUEP_utils.getChainParticle(GenParts[cutgenLepsNeg], 0)
             genZfromZ = GenParts[cutgenZ]
-            genZfromZpadded = ak.pad_none(genZfromZ, 1, clip=True)[:, 0]
-            genZfromleps = genlepsPos[:, 0] + genlepsNeg[:, 0]
-            Zpt = ak.where(ak.num(genZfromZ) >= 1, genZfromZpadded.pt, genZfromleps.pt)
+            genZfromZfirst = SUEP_utils.getChainParticle(genZfromZ, 0)
+            genZfromleps = genlepPos + genlepNeg
+            Zpt = ak.where(ak.num(genZfromZ) >= 1, genZfromZfirst.pt, genZfromleps.pt)
             return events, Zpt
         else:
             cutgenZ = (events.GenPart.pdgId == 23) & (
@@ -557,7 +499,10 @@ class SUEP_cluster_ZH(processor.ProcessorABC):
                 (events.GenPart.status == 62) | (events.GenPart.status == 22)
             )
             cutgenSUEP = (events.GenPart.pdgId == 999999) & (events.GenPart.status == 2)
-            return events, GenParts[cutgenZ], GenParts[cutgenH], GenParts[cutgenSUEP]
+            # Keep the first (hard process) copy of the Z and H
+            genZ = SUEP_utils.getChainParticle(GenParts[cutgenZ], 0)
+            genH = SUEP_utils.getChainParticle(GenParts[cutgenH], 0)
+            return events, genZ, genH, GenParts[cutgenSUEP]
 
     def shouldContinueAfterCut(self, events, out):
         # if debug: print("Conversion to pandas...")
@@ -2111,24 +2056,18 @@ class SUEP_cluster_ZH(processor.ProcessorABC):
     def doTracksDropping(self, events, tracks):
         probsLowPt = {2015: 0.027, 2016: 0.027, 2017: 0.022, 2018: 0.021}
         probsHighPt = {2015: 0.01, 2016: 0.01, 2017: 0.01, 2018: 0.01}
-        cutLowPtTracks = (tracks.pt < 20) & (tracks.pt >= 1)
-        lowPtTracks = tracks[cutLowPtTracks]
-        cutHighPtTracks = tracks.pt >= 20
-        highPtTracks = tracks[cutHighPtTracks]
-        # Generate random numbers
-        randomLow = ak.unflatten(
-            np.random.random(ak.sum(ak.num(lowPtTracks))), ak.num(lowPtTracks)
-        )
-        randomHigh = ak.unflatten(
-            np.random.random(ak.sum(ak.num(highPtTracks))), ak.num(highPtTracks)
+        # Tracks below 1 GeV are not kept in the varied collection
+        pt = ak.to_numpy(ak.flatten(tracks.pt))
+        probs = np.where(
+            pt >= 20,
+            probsHighPt[self.era],
+            np.where(pt >= 1, probsLowPt[self.era], 1.0),
         )
-        # Now get the tracks
-        passLowPtTracks = lowPtTracks[(randomLow > probsLowPt[self.era])]
-        passHighPtTracks = highPtTracks[(randomHigh > probsHighPt[self.era])]
-        # And then broadcast them together again
         return {
             "": tracks,
-            "_TRACKUP": ak.concatenate([passLowPtTracks, passHighPtTracks], axis=1),
+            "_TRACKUP": drop_tracks_by_probability(
+                tracks, probs, track_killing_rng(events)
+            ),
         }
 
     def doJECJERVariations(self, events, jets):
@@ -2339,12 +2278,12 @@ class SUEP_cluster_ZH(processor.ProcessorABC):
                 out["genZpt"] = self.Zpt
 
             else:
-                out["genZpt"] = self.genZ.pt[:, 0]
-                out["genZeta"] = self.genZ.eta[:, 0]
-                out["genZphi"] = self.genZ.phi[:, 0]
-                out["genHpt"] = self.genH.pt[:, 0]
-                out["genHeta"] = self.genH.eta[:, 0]
-                out["genHphi"] = self.genH.phi[:, 0]
+                out["genZpt"] = self.genZ.pt
+                out["genZeta"] = self.genZ.eta
+                out["genZphi"] = self.genZ.phi
+                out["genHpt"] = self.genH.pt
+                out["genHeta"] = self.genH.eta
+                out["genHphi"] = self.genH.phi
         # out["nPU"] = self.getNPU()[:]
         return out
 
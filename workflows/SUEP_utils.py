@@ -1,3 +1,6 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
+
 import awkward as ak
 import fastjet
 import numpy as np
@@ -346,75 +349,81 @@ def ConeMethod(self, indices, tracks, SUEP_cand, ISR_cand, do_inverted=False):
                 self.out_vars.loc[indices, "ISR_mass_CO"] = ISR_cand.mass
 
 
-def sphericity(particles, r):
-    norm = ak.sum(particles.p**r, axis=1, keepdims=True)
-    s = np.array(
-        [
-            [
-                ak.sum(
-                    particles.px * particles.px * particles.p ** (r - 2.0),
-                    axis=1,
-                    keepdims=True,
-                )
-                / norm,
-                ak.sum(
-                    particles.px * particles.py * particles.p ** (r - 2.0),
-                    axis=1,
-                    keepdims=True,
-                )
-                / norm,
-                ak.sum(
-                    particles.px * particles.pz * particles.p ** (r - 2.0),
-                    axis=1,
-                    keepdims=True,
-                )
-                / norm,
-            ],
+def sphericity_tensor(px, py, pz, p, counts, r):
+    """
+    Build the normalized sphericity tensor of each event from flat arrays of the
+    particle momenta and the number of particles per event.
+    Only the six unique components are computed, returned as an (nevents, 6) array
+    ordered as xx, yy, zz, xy, xz, yz.
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    event_index = np.repeat(np.arange(len(counts)), counts)
+    weight = p ** (r - 2.0)
+    wx, wy = weight * px, weight * py
+    components = [wx * px, wy * py, weight * pz * pz, wx * py, wx * pz, wy * pz]
+    norm = np.bincount(event_index, weights=p**r, minlength=len(counts))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.stack(
             [
-                ak.sum(
-                    particles.py * particles.px * particles.p ** (r - 2.0),
-                    axis=1,
-                    keepdims=True,
-                )
-                / norm,
-                ak.sum(
-                    particles.py * particles.py * particles.p ** (r - 2.0),
-                    axis=1,
-                    keepdims=True,
-                )
-                / norm,
-                ak.sum(
-                    particles.py * particles.pz * particles.p ** (r - 2.0),
-                    axis=1,
-                    keepdims=True,
-                )
-                / norm,
+                np.bincount(event_index, weights=c, minlength=len(counts)) / norm
+                for c in components
             ],
-            [
-                ak.sum(
-                    particles.pz * particles.px * particles.p ** (r - 2.0),
-                    axis=1,
-                    keepdims=True,
-                )
-                / norm,
-                ak.sum(
-                    particles.pz * particles.py * particles.p ** (r - 2.0),
-                    axis=1,
-                    keepdims=True,
-                )
-                / norm,
-                ak.sum(
-                    particles.pz * particles.pz * particles.p ** (r - 2.0),
-                    axis=1,
-                    keepdims=True,
-                )
-                / norm,
-            ],
-        ]
+            axis=1,
+        )
+
+
+def sym3x3_eigvals(s):
+    """
+    Eigenvalues of a batch of real symmetric 3x3 matrices, given as an (n, 6) array
+    of xx, yy, zz, xy, xz, yz components, using the closed-form trigonometric solution.
+    Returns an (n, 3) array sorted in ascending order.
+    """
+    a11, a22, a33, a12, a13, a23 = s.T
+    q = (a11 + a22 + a33) / 3.0
+    p1 = a12**2 + a13**2 + a23**2
+    p2 = (a11 - q) ** 2 + (a22 - q) ** 2 + (a33 - q) ** 2 + 2.0 * p1
+    p = np.sqrt(p2 / 6.0)
+
+    # the matrix is a multiple of the identity when p = 0, all eigenvalues are q
+    safe_p = np.where(p > 0, p, 1.0)
+    b11, b22, b33 = (a11 - q) / safe_p, (a22 - q) / safe_p, (a33 - q) / safe_p
+    b12, b13, b23 = a12 / safe_p, a13 / safe_p, a23 / safe_p
+    detB = (
+        b11 * (b22 * b33 - b23 * b23)
+        - b12 * (b12 * b33 - b23 * b13)
+        + b13 * (b12 * b23 - b22 * b13)
     )
-    s = np.squeeze(np.moveaxis(s, 2, 0), axis=3)
-    evals = np.sort(np.linalg.eigvalsh(s))
-    return evals
+    phi = np.arccos(np.clip(detB / 2.0, -1.0, 1.0)) / 3.0
+
+    eig_max = q + 2.0 * p * np.cos(phi)
+    eig_min = q + 2.0 * p * np.cos(phi + 2.0 * np.pi / 3.0)
+    eig_mid = 3.0 * q - eig_max - eig_min
+    return np.sort(np.stack([eig_min, eig_mid, eig_max], axis=1), axis=1)
+
+
+def sphericity(particles, r):
+    counts = ak.to_numpy(ak.num(particles, axis=1))
+    px = ak.to_numpy(ak.flatten(particles.px, axis=None))
+    py = ak.to_numpy(ak.flatten(particles.py, axis=None))
+    pz = ak.to_numpy(ak.flatten(particles.pz, axis=None))
+    p = ak.to_numpy(ak.flatten(particles.p, axis=None))
+    s = sphericity_tensor(px, py, pz, p, counts, r)
+    return sym3x3_eigvals(s)
+
+
+def getChainParticle(particles, position=-1):
+    """
+    Select one particle per event out of a collection, e.g. the last copy of a
+    particle in the decay chain (position=-1, the default) or the first one
+    (position=0), without looping over the events.
+    Returns an option-type array, with None for events where there is no such particle.
+    """
+    if position < 0:
+        target = ak.num(particles, axis=1) + position
+    else:
+        target = position
+    selected = ak.local_index(particles, axis=1) == target
+    return ak.firsts(particles[selected], axis=1)
 
 
 def rho(number, jet, tracks, deltaR, dr=0.05):
@@ -425,22 +434,94 @@ def rho(number, jet, tracks, deltaR, dr=0.05):
     return rho_values
 
 
-def FastJetReclustering(tracks, r, minPt):
+def _clusterBatch(tracks, r, minPt):
     jetdef = fastjet.JetDefinition(fastjet.antikt_algorithm, r)
     cluster = fastjet.ClusterSequence(tracks, jetdef)
 
-    # have to set min_pt = 0 and cut later to avoid some memory issues
-    # FIXME: should try to understand this failure
-    ak_inclusive_jets = cluster.inclusive_jets()
-    ak_inclusive_cluster = cluster.constituents()
+    # only extract the jets above threshold, and the indices of their constituents in
+    # tracks, instead of all the (mostly soft) jets and copies of their constituents
+    ak_inclusive_jets = cluster.inclusive_jets(minPt)
+    constituent_index = cluster.constituent_index(minPt)
 
-    # apply minimum pT cut
+    # FastJet keeps pT >= minPt, apply the strict cut on the remaining jets
     minPtCut = ak_inclusive_jets.pt > minPt
 
-    ak_inclusive_jets = ak_inclusive_jets[minPtCut]
-    ak_inclusive_cluster = ak_inclusive_cluster[minPtCut]
+    return ak_inclusive_jets[minPtCut], constituent_index[minPtCut]
+
+
+def getClusterTracks(tracks, constituent_index):
+    """
+    Gather the constituent tracks of the jets from the indices of the constituents
+    in each event, as returned by FastJetReclustering(..., return_indices=True).
+    Returns an array of dimensions events x jets x tracks.
+    """
+    ntracks = np.asarray(ak.num(tracks, axis=1), dtype=np.int64)
+    njets = np.asarray(ak.num(constituent_index, axis=1), dtype=np.int64)
+    nconst = np.asarray(ak.flatten(ak.num(constituent_index, axis=2)), dtype=np.int64)
+
+    # indices in the flattened tracks
+    nconst_per_event = np.asarray(ak.sum(ak.num(constituent_index, axis=2), axis=1))
+    flat_index = np.asarray(
+        ak.flatten(constituent_index, axis=None), dtype=np.int64
+    ) + np.repeat(np.cumsum(ntracks) - ntracks, nconst_per_event)
+
+    cluster_tracks = ak.flatten(tracks)[flat_index]
+    return ak.unflatten(ak.unflatten(cluster_tracks, nconst), njets)
+
+
+# pools used by FastJetReclustering, kept alive between chunks
+_clustering_pools = {}
+
+
+def _clusteringPool(executor, workers):
+    key = (executor, workers)
+    if key not in _clustering_pools:
+        if executor == "thread":
+            _clustering_pools[key] = ThreadPoolExecutor(max_workers=workers)
+        elif executor == "process":
+            _clustering_pools[key] = ProcessPoolExecutor(max_workers=workers)
+        else:
+            raise ValueError(
+                "Unknown clustering executor " + executor + ", use thread or process"
+            )
+    return _clustering_pools[key]
+
+
+def FastJetReclustering(
+    tracks, r, minPt, workers=1, batch_size=0, executor="thread", return_indices=False
+):
+    """
+    Anti-kT clustering of the tracks of each event, keeping the jets with pT > minPt.
+    Returns the jets and their constituents, each of dimensions events x jets (x tracks).
+    With return_indices, the constituents are returned as indices into tracks instead,
+    see getClusterTracks.
+    The events can be split in batches of batch_size events (by default, one batch per
+    worker), clustered concurrently by workers threads (FastJet releases the GIL) or
+    processes, and concatenated back in the original order.
+    """
+    if batch_size <= 0:
+        batch_size = -(-len(tracks) // max(workers, 1))
+    if len(tracks) == 0 or (workers <= 1 and batch_size >= len(tracks)):
+        ak_inclusive_jets, constituent_index = _clusterBatch(tracks, r, minPt)
+    else:
+        batches = [
+            tracks[start : start + batch_size]
+            for start in range(0, len(tracks), batch_size)
+        ]
+        if workers <= 1:
+            results = [_clusterBatch(batch, r, minPt) for batch in batches]
+        else:
+            results = list(
+                _clusteringPool(executor, workers).map(
+                    _clusterBatch, batches, repeat(r), repeat(minPt)
+                )
+            )
+        ak_inclusive_jets = ak.concatenate([jets for jets, _ in results])
+        constituent_index = ak.concatenate([index for _, index in results])
 
-    return ak_inclusive_jets, ak_inclusive_cluster
+    if return_indices:
+        return ak_inclusive_jets, constituent_index
+    return ak_inclusive_jets, getClusterTracks(tracks, constituent_index)
 
 
 def getTopTwoJets(self, tracks, indices, ak_inclusive_jets, ak_inclusive_cluster):
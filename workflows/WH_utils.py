@@ -2,6 +2,8 @@ import awkward as ak
 import numpy as np
 import vector
 
+import workflows.track_utils as track_utils
+
 
 def getGenModel(events):
     """
@@ -115,60 +117,15 @@ def getGenDarkPseudoscalars(events):
     return darkPseudoscalarParticles
 
 
-def getTracks(events, lepton=None, leptonIsolation=None):
-    Cands = ak.zip(
-        {
-            "pt": events.PFCands.trkPt,
-            "eta": events.PFCands.trkEta,
-            "phi": events.PFCands.trkPhi,
-            "mass": events.PFCands.mass,
-            # "pdgID": events.PFCands.pdgID
-        },
-        with_name="Momentum4D",
-    )
-    cut = (
-        (events.PFCands.fromPV > 1)
-        & (events.PFCands.trkPt >= 1)
-        & (abs(events.PFCands.trkEta) <= 2.5)
-        & (abs(events.PFCands.dz) < 0.05)
-        # & (events.PFCands.dzErr < 0.05)
-        & (abs(events.PFCands.d0) < 0.05)
-        & (events.PFCands.puppiWeight > 0.1)
-    )
-    Cleaned_cands = Cands[cut]
-    Cleaned_cands = ak.packed(Cleaned_cands)
-
-    # Prepare the Lost Track collection
-    LostTracks = ak.zip(
-        {
-            "pt": events.lostTracks.pt,
-            "eta": events.lostTracks.eta,
-            "phi": events.lostTracks.phi,
-            "mass": 0.0,
-        },
-        with_name="Momentum4D",
-    )
-    cut = (
-        (events.lostTracks.fromPV > 1)
-        & (events.lostTracks.pt >= 0.1)
-        & (abs(events.lostTracks.eta) <= 2.5)
-        & (abs(events.lostTracks.dz) < 0.05)
-        & (abs(events.lostTracks.d0) < 0.05)
-        # & (events.lostTracks.dzErr < 0.05)
-        & (events.lostTracks.puppiWeight > 0.1)
+def getTracks(events, lepton=None, leptonIsolation=None, report=None):
+    # tracks overlapping with the lepton are removed if leptonIsolation is given
+    return track_utils.getTracks(
+        track_utils.nanoEventsGetter(events),
+        "WH",
+        leptons=[lepton],
+        isolation=leptonIsolation,
+        report=report,
     )
-    Lost_Tracks_cands = LostTracks[cut]
-    Lost_Tracks_cands = ak.packed(Lost_Tracks_cands)
-
-    # select which tracks to use in the script
-    # dimensions of tracks = events x tracks in event x 4 momenta
-    tracks = ak.concatenate([Cleaned_cands, Lost_Tracks_cands], axis=1)
-
-    if leptonIsolation:
-        # Sorting out the tracks that overlap with the lepton
-        tracks = tracks[(tracks.deltaR(lepton) >= leptonIsolation)]
-
-    return tracks, Cleaned_cands
 
 
 def getLeptons(events):
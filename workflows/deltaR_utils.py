@@ -0,0 +1,118 @@
+"""
+deltaR matching between two collections of objects in each event, with numba kernels
+working directly on the counts and flat eta, phi arrays of the collections.
+These replace ak.cartesian / metric_table based matching, which build the full
+events x objects x other objects table of deltaR to only keep the minimum of each row.
+The objects can be events x objects arrays, or one object per event (e.g. a lepton).
+deltaR = sqrt(deta^2 + dphi^2), with dphi in [-pi, pi), as in vector and coffea.
+"""
+
+import awkward as ak
+import numba
+import numpy as np
+
+
+@numba.njit
+def _nearestKernel(offsets_a, eta_a, phi_a, offsets_b, eta_b, phi_b, index, deltaR):
+    for event in range(len(offsets_a) - 1):
+        start_b, stop_b = offsets_b[event], offsets_b[event + 1]
+        for i in range(offsets_a[event], offsets_a[event + 1]):
+            best, best_j = np.inf, -1
+            for j in range(start_b, stop_b):
+                dphi = (phi_a[i] - phi_b[j] + np.pi) % (2 * np.pi) - np.pi
+                deta = eta_a[i] - eta_b[j]
+                dr = np.sqrt(deta * deta + dphi * dphi)
+                if dr < best:
+                    best, best_j = dr, j - start_b
+            index[i] = best_j
+            deltaR[i] = best
+
+
+def _offsets(counts):
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets
+
+
+def flatObjects(objects):
+    """
+    Counts per event and flat eta, phi (float64) of objects.
+    """
+    if objects.ndim == 1:
+        counts = np.ones(len(objects), dtype=np.int64)
+        eta, phi = objects.eta, objects.phi
+    else:
+        counts = np.asarray(ak.num(objects, axis=1), dtype=np.int64)
+        eta, phi = ak.flatten(objects.eta), ak.flatten(objects.phi)
+    return (
+        counts,
+        np.asarray(eta, dtype=np.float64),
+        np.asarray(phi, dtype=np.float64),
+    )
+
+
+def nearestFlat(counts_a, eta_a, phi_a, counts_b, eta_b, phi_b):
+    """
+    For each object a, the index (within its event) of the nearest object b in deltaR,
+    and that deltaR, as flat arrays. -1 and inf if there is no object b in the event.
+    """
+    index = np.empty(len(eta_a), dtype=np.int64)
+    deltaR = np.empty(len(eta_a), dtype=np.float64)
+    _nearestKernel(
+        _offsets(counts_a),
+        np.asarray(eta_a, dtype=np.float64),
+        np.asarray(phi_a, dtype=np.float64),
+        _offsets(counts_b),
+        np.asarray(eta_b, dtype=np.float64),
+        np.asarray(phi_b, dtype=np.float64),
+        index,
+        deltaR,
+    )
+    return index, deltaR
+
+
+def nearest(a, b, threshold=None):
+    """
+    Index (within its event) of the nearest object b to each object a, and their
+    deltaR, as events x objects arrays. The index is -1 if there is no object b in
+    the event, or if the nearest one is further than threshold.
+    """
+    counts_a, eta_a, phi_a = flatObjects(a)
+    index, deltaR = nearestFlat(counts_a, eta_a, phi_a, *flatObjects(b))
+    if threshold is not None:
+        index[deltaR > threshold] = -1
+    return ak.unflatten(index, counts_a), ak.unflatten(deltaR, counts_a)
+
+
+def minDeltaR(a, b):
+    """
+    deltaR between each object a and the nearest object b, inf if there is none.
+    """
+    return nearest(a, b)[1]
+
+
+def anyWithinCone(a, b, cone):
+    """
+    True for the objects a with at least one object b within deltaR < cone.
+    """
+    return minDeltaR(a, b) < cone
+
+
+def takeNearest(values_b, index, fill=0):
+    """
+    values_b (events x objects b) of the objects b pointed to by index, the output of
+    nearest, and fill where index is -1.
+    """
+    counts = np.asarray(ak.num(index, axis=1), dtype=np.int64)
+    flat_index = np.asarray(ak.flatten(index))
+    offsets_b = _offsets(np.asarray(ak.num(values_b, axis=1), dtype=np.int64))
+    flat_values = np.asarray(ak.flatten(values_b))
+    if len(flat_values) == 0:
+        return ak.unflatten(
+            np.full(len(flat_index), fill, dtype=flat_values.dtype), counts
+        )
+    global_index = np.repeat(offsets_b[:-1], counts) + flat_index
+    taken = np.where(
+        flat_index >= 0, flat_values[np.where(flat_index >= 0, global_index, 0)], fill
+    )
+    return ak.unflatten(taken.astype(flat_values.dtype), counts)
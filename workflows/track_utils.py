@@ -0,0 +1,252 @@
+"""
+Track selection shared by the ggF, WH, ZH and scouting workflows.
+Each selection is a list of collections (e.g. PFCands and lostTracks), defined by
+the branches used as the output fields and a list of cuts on branches. Only those
+branches are read, the cuts are evaluated on the flat arrays into a single mask,
+and the selected tracks of all the collections are returned as one packed
+events x tracks Momentum4D array, with float32 kinematics.
+"""
+
+import operator
+from collections import defaultdict
+from time import perf_counter
+
+import awkward as ak
+import numpy as np
+
+from workflows import deltaR_utils
+
+OPERATORS = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+
+# fields: output field -> branch of the collection, or a constant
+# cuts: (branch, operator, value), abs(branch) cuts on the absolute value
+PFCANDS_GGF = {
+    "collection": "PFCands",
+    "fields": {"pt": "trkPt", "eta": "trkEta", "phi": "trkPhi", "mass": "mass"},
+    "cuts": [
+        ("fromPV", ">", 1),
+        ("trkPt", ">=", 0.75),
+        ("abs(trkEta)", "<=", 2.5),
+        ("abs(dz)", "<", 10),
+        ("dzErr", "<", 0.05),
+    ],
+}
+LOSTTRACKS_GGF = {
+    "collection": "lostTracks",
+    "fields": {"pt": "pt", "eta": "eta", "phi": "phi", "mass": 0.0},
+    "cuts": [
+        ("fromPV", ">", 1),
+        ("pt", ">=", 0.75),
+        ("abs(eta)", "<=", 1.0),
+        ("abs(dz)", "<", 10),
+        ("dzErr", "<", 0.05),
+    ],
+}
+PFCANDS_LEPTONIC = {
+    "collection": "PFCands",
+    "fields": {"pt": "trkPt", "eta": "trkEta", "phi": "trkPhi", "mass": "mass"},
+    "cuts": [
+        ("fromPV", ">", 1),
+        ("trkPt", ">=", 1),
+        ("abs(trkEta)", "<=", 2.5),
+        ("abs(dz)", "<", 0.05),
+        ("abs(d0)", "<", 0.05),
+        ("puppiWeight", ">", 0.1),
+    ],
+}
+LOSTTRACKS_WH = {
+    "collection": "lostTracks",
+    "fields": {"pt": "pt", "eta": "eta", "phi": "phi", "mass": 0.0},
+    "cuts": [
+        ("fromPV", ">", 1),
+        ("pt", ">=", 0.1),
+        ("abs(eta)", "<=", 2.5),
+        ("abs(dz)", "<", 0.05),
+        ("abs(d0)", "<", 0.05),
+        ("puppiWeight", ">", 0.1),
+    ],
+}
+PFCANDS_ZH = {
+    "collection": "PFCands",
+    "fields": dict(PFCANDS_LEPTONIC["fields"], pdgId="pdgId"),
+    "cuts": PFCANDS_LEPTONIC["cuts"],
+}
+LOSTTRACKS_ZH = {
+    "collection": "lostTracks",
+    "fields": {"pt": "pt", "eta": "eta", "phi": "phi", "mass": 0.0, "pdgId": -99},
+    "cuts": [
+        ("fromPV", ">", 1),
+        ("pt", ">=", 1),
+        ("abs(eta)", "<=", 2.5),
+        ("abs(dz)", "<", 0.05),
+        ("abs(d0)", "<", 0.05),
+        ("puppiWeight", ">", 0.1),
+    ],
+}
+OFFLINETRACK_SCOUTING = {
+    "collection": "offlineTrack",
+    "fields": {"pt": "pt", "eta": "eta", "phi": "phi", "mass": "mass"},
+    "cuts": [("pt", ">=", 0.75), ("abs(eta)", "<=", 2.4), ("quality", "==", 1)],
+}
+PFCAND_SCOUTING = {
+    "collection": "PFcand",
+    "fields": {"pt": "pt", "eta": "eta", "phi": "phi", "mass": "mass"},
+    "cuts": [
+        ("pt", ">=", 0.75),
+        ("abs(eta)", "<=", 2.4),
+        ("vertex", "==", 0),
+        ("q", "!=", 0),
+    ],
+}
+
+TRACK_SELECTIONS = {
+    "ggF": [PFCANDS_GGF, LOSTTRACKS_GGF],
+    "WH": [PFCANDS_LEPTONIC, LOSTTRACKS_WH],
+    "ZH": [PFCANDS_ZH, LOSTTRACKS_ZH],
+    "scouting": [PFCAND_SCOUTING],
+    "scouting_2016": [OFFLINETRACK_SCOUTING],
+}
+
+
+class TrackReport:
+    """
+    Bytes loaded (uncompressed) and time spent per stage of the track selection,
+    summed over the calls it is passed to.
+    """
+
+    def __init__(self):
+        self.nbytes = defaultdict(int)
+        self.timings = defaultdict(float)
+
+    def add(self, stage, seconds, nbytes=0):
+        self.timings[stage] += seconds
+        self.nbytes[stage] += nbytes
+
+    def __str__(self):
+        lines = ["Track selection:"]
+        for stage, seconds in self.timings.items():
+            line = f"  {stage:<30} {seconds:8.3f} s"
+            if self.nbytes[stage]:
+                line += f" {self.nbytes[stage] / 1024**2:8.1f} MB"
+            lines.append(line)
+        return "\n".join(lines)
+
+
+def nanoEventsGetter(events):
+    """
+    Branch getter for NanoEvents: only the branches that are requested are read.
+    """
+    return lambda collection, branch: events[collection][branch]
+
+
+def _branchName(name):
+    if name.startswith("abs(") and name.endswith(")"):
+        return name[4:-1], True
+    return name, False
+
+
+def _selectionBranches(spec):
+    branches = [b for b in spec["fields"].values() if isinstance(b, str)]
+    branches += [_branchName(name)[0] for name, _, _ in spec["cuts"]]
+    return list(dict.fromkeys(branches))
+
+
+def selectCollection(get, spec, leptons=(), isolation=None, report=None):
+    """
+    Select the tracks of one collection.
+    Returns the counts of selected tracks per event and the flat output fields.
+    """
+    start = perf_counter()
+    flat, counts, nbytes = {}, None, 0
+    for branch in _selectionBranches(spec):
+        array = get(spec["collection"], branch)
+        if counts is None:
+            counts = np.asarray(ak.num(array, axis=1), dtype=np.int64)
+        flat[branch] = np.asarray(ak.flatten(array))
+        nbytes += flat[branch].nbytes
+    if report is not None:
+        report.add("read " + spec["collection"], perf_counter() - start, nbytes)
+
+    # all the quality cuts, and the isolation from the leptons, in one mask
+    start = perf_counter()
+    mask = np.ones(counts.sum(), dtype=bool)
+    for name, op, value in spec["cuts"]:
+        branch, use_abs = _branchName(name)
+        values = np.abs(flat[branch]) if use_abs else flat[branch]
+        mask &= OPERATORS[op](values, value)
+    if isolation and len(leptons) > 0:
+        leptons = [deltaR_utils.flatObjects(lepton) for lepton in leptons]
+        _, minDeltaR = deltaR_utils.nearestFlat(
+            counts,
+            flat[spec["fields"]["eta"]],
+            flat[spec["fields"]["phi"]],
+            np.sum([counts for counts, _, _ in leptons], axis=0),
+            np.stack([eta for _, eta, _ in leptons], axis=1).ravel(),
+            np.stack([phi for _, _, phi in leptons], axis=1).ravel(),
+        )
+        mask &= minDeltaR >= isolation
+    event_index = np.repeat(np.arange(len(counts)), counts)[mask]
+    selected_counts = np.bincount(event_index, minlength=len(counts))
+    if report is not None:
+        report.add("mask " + spec["collection"], perf_counter() - start)
+
+    fields = {}
+    for field, branch in spec["fields"].items():
+        if isinstance(branch, str):
+            values = flat[branch][mask]
+        else:
+            values = np.full(mask.sum(), branch)
+        if values.dtype.kind == "f":
+            values = values.astype(np.float32)
+        elif values.dtype.kind in "iu":
+            values = values.astype(np.int32)
+        fields[field] = values
+    return selected_counts, event_index, fields
+
+
+def getTracks(get, selection, leptons=(), isolation=None, report=None):
+    """
+    Tracks passing the selection, a list of collection specs or the name of one of
+    TRACK_SELECTIONS, as a packed events x tracks Momentum4D array; in each event,
+    the tracks of the first collection come first. get(collection, branch) returns
+    a branch of the events, e.g. nanoEventsGetter(events).
+    If isolation is given, tracks within deltaR < isolation of any of the leptons
+    (one per event each) are removed.
+    Returns the tracks and the selected tracks of the first collection.
+    """
+    if isinstance(selection, str):
+        selection = TRACK_SELECTIONS[selection]
+    results = [
+        selectCollection(get, spec, leptons, isolation, report) for spec in selection
+    ]
+
+    start = perf_counter()
+    collections = [
+        ak.unflatten(ak.zip(fields, with_name="Momentum4D"), counts)
+        for counts, _, fields in results
+    ]
+    if len(results) == 1:
+        tracks = collections[0]
+    else:
+        # merge the collections event by event
+        order = np.argsort(
+            np.concatenate([event_index for _, event_index, _ in results]),
+            kind="stable",
+        )
+        fields = {
+            field: np.concatenate([r[2][field] for r in results])[order]
+            for field in results[0][2]
+        }
+        counts = np.sum([counts for counts, _, _ in results], axis=0)
+        tracks = ak.unflatten(ak.zip(fields, with_name="Momentum4D"), counts)
+    if report is not None:
+        report.add("build", perf_counter() - start)
+
+    return tracks, collections[0]
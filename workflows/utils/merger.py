@@ -31,14 +31,190 @@ def h5load(ifile, label):
         return 0, 0
 
 
+def merge_metadata(metadata_tot, metadata, isMC=True):
+    """
+    Add the metadata of one file to the running total: the first metadata is kept,
+    and for MC the gensumweight and the cutflows are summed.
+    """
+    if metadata_tot is None:
+        return dict(metadata)
+    if isMC:
+        metadata_tot["gensumweight"] += metadata["gensumweight"]
+        for key in metadata.keys():
+            if key.startswith("cutflow") and key in metadata_tot:
+                metadata_tot[key] += metadata[key]
+    return metadata_tot
+
+
+class StreamingMerger:
+    """
+    Merge DataFrames into HDF5 files by appending each of them to the output table
+    as it comes, instead of concatenating everything in memory.
+    The output rolls over to a new file once it holds more than max_rows rows or
+    max_size_mb MB (in-memory size of the appended DataFrames), or if a DataFrame
+    comes in that doesn't fit in its table: with columns the table doesn't have, or
+    with longer strings than the table was sized for by its first DataFrame.
+    Unlike concatenating all the DataFrames in memory, which unions their columns,
+    the columns of a table are fixed by its first DataFrame: DataFrames missing some
+    of them are filled with NaN, while extra columns start a new file, so a sample
+    can give more merged files than before. The differing columns are printed.
+    Each file gets the metadata added while it was open.
+    Output files are named outFile.format(i) if outFile contains '{}', otherwise
+    outFile, then outFile with _1, _2, ... appended.
+    on_close(fname) is called for every file written, e.g. to move it somewhere.
+    """
+
+    def __init__(
+        self,
+        outFile,
+        max_rows=None,
+        max_size_mb=None,
+        isMC=True,
+        on_close=None,
+        key="vars",
+    ):
+        self.outFile = outFile
+        self.max_rows = max_rows
+        self.max_size_mb = max_size_mb
+        self.isMC = isMC
+        self.on_close = on_close
+        self.key = key
+        self.files = []
+        self._store = None
+        self._reset()
+
+    def _reset(self):
+        self._store = None
+        self._dtypes = None
+        self._min_itemsize = {}
+        self._nrows = 0
+        self._size = 0
+        self.metadata = None
+
+    def _fileName(self, i):
+        if "{}" in self.outFile:
+            return self.outFile.format(i)
+        if i == 0:
+            return self.outFile
+        base, ext = os.path.splitext(self.outFile)
+        return f"{base}_{i}{ext}"
+
+    def _conform(self, df):
+        """
+        Match the columns and dtypes of the current output table,
+        or return None if the DataFrame can't be appended to it.
+        """
+        if list(df.columns) == list(self._dtypes.index) and all(
+            df.dtypes == self._dtypes
+        ):
+            return df
+        if not set(df.columns).issubset(self._dtypes.index):
+            return None
+        try:
+            return df.reindex(columns=self._dtypes.index).astype(self._dtypes)
+        except (ValueError, TypeError):
+            return None
+
+    def _fitsStrings(self, df):
+        """
+        Whether the strings of the object columns fit in the current output table,
+        whose string sizes are set by the first DataFrame appended to it.
+        """
+        return all(
+            df[c].astype(str).str.len().max() <= itemsize
+            for c, itemsize in self._min_itemsize.items()
+        )
+
+    def append(self, df, metadata=None):
+        """
+        Append a DataFrame to the current output file, and add its metadata.
+        Empty DataFrames only contribute their metadata.
+        """
+        isEmpty = df.shape[0] == 0 or "empty" in list(df.keys())
+
+        if not isEmpty and self._store is not None:
+            conformed = self._conform(df)
+            if conformed is None:
+                print(
+                    "Columns changed, starting a new output file. Extra columns:",
+                    sorted(set(df.columns) - set(self._dtypes.index)),
+                )
+                self.rollover()
+            else:
+                missing = set(self._dtypes.index) - set(df.columns)
+                if missing:
+                    print("Filling missing columns with NaN:", sorted(missing))
+                df = conformed
+                if not self._fitsStrings(df):
+                    print("Strings too long, starting a new output file.")
+                    self.rollover()
+
+        if metadata is not None:
+            self.metadata = merge_metadata(self.metadata, metadata, self.isMC)
+        if isEmpty:
+            return
+
+        if self._store is None:
+            fname = self._fileName(len(self.files))
+            self._store = pd.HDFStore(fname, mode="w")
+            self._dtypes = df.dtypes
+            self._min_itemsize = {
+                c: max(64, 2 * int(df[c].astype(str).str.len().max()))
+                for c in df.columns
+                if pd.api.types.is_string_dtype(df[c].dtype)
+            }
+
+        self._store.append(
+            self.key,
+            df,
+            format="table",
+            index=False,
+            min_itemsize=self._min_itemsize or None,
+        )
+        self._nrows += df.shape[0]
+        self._size += df.memory_usage(deep=True).sum() / 1024**2
+
+        if (self.max_rows is not None and self._nrows > self.max_rows) or (
+            self.max_size_mb is not None and self._size > self.max_size_mb
+        ):
+            self.rollover()
+
+    def rollover(self):
+        """
+        Close the current output file, and start a new one for the next DataFrames.
+        """
+        fname = self._fileName(len(self.files))
+        if self._store is None:
+            # nothing appended, still save the metadata
+            print("No events in", fname)
+            self._store = pd.HDFStore(fname, mode="w")
+            self._store.put(self.key, pd.DataFrame(["empty"], columns=["empty"]))
+        self._store.get_storer(self.key).attrs.metadata = (
+            self.metadata if self.metadata is not None else 0
+        )
+        self._store.close()
+        self.files.append(fname)
+        self._reset()
+        if self.on_close is not None:
+            self.on_close(fname)
+
+    def close(self):
+        """
+        Close the last output file. It is written even if it is empty, unless it
+        would hold neither events nor metadata and other files were written already.
+        """
+        if self._store is not None or self.metadata is not None or not self.files:
+            self.rollover()
+        return self.files
+
+
 def merge(options, pattern="condor_*.hdf5", outFile="out.hdf5"):
     files = glob.glob(pattern)
     if len(files) == 0:
         print("No .hdf5 files found")
         sys.exit()
 
-    df_tot = None
-    metadata_tot = None
+    merger = StreamingMerger(outFile, isMC=options.isMC)
     for ifile, file in enumerate(files):
         df, metadata = h5load(file, "vars")
 
@@ -47,30 +223,12 @@ def merge(options, pattern="condor_*.hdf5", outFile="out.hdf5"):
             print("Something screwed up.")
             sys.exit()
 
-        ### MERGE METADATA
-        if metadata_tot is None:
-            metadata_tot = metadata
-        elif options.isMC:
-            metadata_tot["gensumweight"] += metadata["gensumweight"]
-
-        # no need to add empty ones
-        if "empty" in list(df.keys()):
-            continue
-
-        ### MERGE DF
-        if df_tot is None:
-            df_tot = df
-        else:
-            df_tot = pd.concat((df_tot, df))
+        ### MERGE DF AND METADATA, empty ones only add their metadata
+        merger.append(df, metadata)
+        del df
 
     # SAVE OUTPUTS
-    if df_tot is None:
-        print("No events in df_tot.")
-        df_tot = pd.DataFrame(["empty"], columns=["empty"])
-    store = pd.HDFStore(outFile)
-    store.put("vars", df_tot)
-    store.get_storer("vars").attrs.metadata = metadata_tot
-    store.close()
+    merger.close()
 
     # clean up the chunk files that we have already merged together
     for file in files:
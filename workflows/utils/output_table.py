@@ -0,0 +1,124 @@
+import awkward as ak
+import numpy as np
+import pandas as pd
+
+
+def to_numpy_column(value):
+    """
+    Convert a column (awkward array, list, pandas Series, numpy array or scalar)
+    to a numpy array, with missing values as NaN.
+    """
+    if isinstance(value, ak.Array):
+        value = ak.to_numpy(value, allow_missing=True)
+    elif isinstance(value, pd.Series):
+        value = value.to_numpy()
+    if np.ma.isMaskedArray(value):
+        if np.ma.is_masked(value):
+            return np.ma.filled(value.astype(np.float64), np.nan)
+        return np.ma.getdata(value)
+    return np.asarray(value)
+
+
+class OutputTable:
+    """
+    A table of per-event output variables, backed by one numpy array per column.
+    The number of rows is fixed, either at construction or by the first full column
+    that is stored. Columns filled only for a subset of the events through loc() are
+    preallocated as float_dtype arrays filled with NaN, so that scattering values is
+    a plain numpy assignment, instead of a pandas reindexing and column insertion.
+    The table is converted to a pandas DataFrame (or Arrow table) once, at the end.
+
+    Examples
+    --------
+        out = OutputTable(4)
+        out["event"] = [1, 2, 3, 4]
+        out.loc[[0, 2], "SUEP_S1"] = [0.5, 0.6]
+        out.to_pandas()  # SUEP_S1 is NaN for events 1 and 3
+    """
+
+    def __init__(self, nrows=None, float_dtype=np.float32):
+        self._nrows = nrows
+        self._float_dtype = float_dtype
+        self._columns = {}
+
+    def __repr__(self):
+        return "OutputTable(nrows=%r, columns=%r)" % (self._nrows, self.columns)
+
+    def __len__(self):
+        return 0 if self._nrows is None else self._nrows
+
+    def __contains__(self, key):
+        return key in self._columns
+
+    @property
+    def nrows(self):
+        return self._nrows
+
+    @property
+    def columns(self):
+        return list(self._columns.keys())
+
+    def keys(self):
+        return self._columns.keys()
+
+    def setNRows(self, nrows):
+        if self._nrows is not None and self._nrows != nrows:
+            raise ValueError(
+                "OutputTable already has %i rows, cannot set it to %i"
+                % (self._nrows, nrows)
+            )
+        self._nrows = nrows
+
+    def __setitem__(self, key, value):
+        """
+        Store a full column, keeping the dtype of the values.
+        Scalars are broadcast to all the rows.
+        """
+        if not isinstance(key, str):
+            raise ValueError("Column name must be a string not %r." % type(key))
+        value = to_numpy_column(value)
+        if value.ndim == 0:
+            dtype = self._float_dtype if value.dtype.kind == "f" else value.dtype
+            value = np.full(len(self), value, dtype=dtype)
+        self.setNRows(len(value))
+        self._columns[key] = value
+
+    def __getitem__(self, key):
+        if key not in self._columns:
+            raise KeyError(f"Key {key} does not exist in OutputTable")
+        return self._columns[key]
+
+    @property
+    def loc(self):
+        """
+        pandas-like indexer, out.loc[indices, key] = value is the same as
+        out.fill(indices, key, value).
+        """
+        return _OutputTableIndexer(self)
+
+    def fill(self, indices, key, value):
+        """
+        Store value for the rows in indices, creating the column if needed.
+        """
+        if self._nrows is None:
+            raise ValueError("The number of rows of the OutputTable is not set.")
+        if key not in self._columns:
+            self._columns[key] = np.full(self._nrows, np.nan, dtype=self._float_dtype)
+        self._columns[key][indices] = to_numpy_column(value)
+
+    def to_pandas(self):
+        return pd.DataFrame(self._columns, index=pd.RangeIndex(len(self)))
+
+    def to_arrow(self, metadata=None):
+        import pyarrow as pa
+
+        return pa.table(self._columns, metadata=metadata)
+
+
+class _OutputTableIndexer:
+    def __init__(self, table):
+        self._table = table
+
+    def __setitem__(self, key, value):
+        indices, column = key
+        self._table.fill(indices, column, value)
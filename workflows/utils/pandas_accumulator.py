@@ -1,6 +1,8 @@
 import pandas as pd
 from coffea.processor.accumulator import AccumulatorABC
 
+from workflows.utils.output_table import OutputTable
+
 
 class pandas_accumulator(AccumulatorABC):
     """An appendable pandas table
@@ -28,6 +30,18 @@ class pandas_accumulator(AccumulatorABC):
             raise ValueError("pandas_accumulator only works with pandas DataFrames")
         self._empty = pd.DataFrame()
         self._value = value
+        # columns filled in this chunk are kept in numpy arrays until the value is needed
+        self._table = OutputTable()
+
+    def _flush(self):
+        if len(self._table.columns) == 0:
+            return
+        table = self._table.to_pandas()
+        if len(self._value.columns) == 0:
+            self._value = table
+        else:
+            self._value = pd.concat((self._value, table), axis=1)
+        self._table = OutputTable()
 
     def __repr__(self):
         return "pandas_accumulator(\n%r\n)" % self.value
@@ -43,19 +57,23 @@ class pandas_accumulator(AccumulatorABC):
                 "Cannot add two column_accumulator objects of dissimilar shape (%r vs %r)"
                 % (self._empty.shape, other._empty.shape)
             )
+        self._flush()
+        other._flush()
         self._value = pd.concat((self._value, other._value))
 
     def loc(self, indices, key, value):
-        self._value.loc[indices, key] = value
+        self._table.fill(indices, key, value)
 
     def __setitem__(self, key, value):
         if not isinstance(key, str):
             raise ValueError("Column name must be a string not %r." % type(key))
-        self._value[key] = value
+        self._table[key] = value
 
     def __getitem__(self, key):
         if not isinstance(key, str):
             raise ValueError("Column name must be a string not %r." % type(key))
+        if key in self._table:
+            return self._table[key]
         if key not in self._value.keys():
             raise KeyError(f"Key {key} does not exist in accumulator")
         return self._value[key]
@@ -65,4 +83,5 @@ class pandas_accumulator(AccumulatorABC):
         """The current value of the column
         Returns a numpy array where the first dimension is the column dimension
         """
+        self._flush()
         return self._value
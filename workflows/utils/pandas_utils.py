@@ -7,6 +7,8 @@ import awkward as ak
 import coffea
 import pandas as pd
 
+from workflows.utils import parquet_utils
+
 
 def ak_to_pandas(self, jet_collection: ak.Array) -> pd.DataFrame:
     out_df = pd.DataFrame()
@@ -29,31 +31,64 @@ def h5store(
     store.get_storer(gname).attrs.metadata = kwargs
 
 
+def hdf5_store(fname: str, dfs, df_names, metadata: dict) -> None:
+    store = pd.HDFStore(fname)
+    for out, gname in zip(dfs, df_names):
+        h5store(None, store, out, fname, gname, **metadata)
+    store.close()
+
+
+def parquet_store(fname: str, dfs, df_names, metadata: dict) -> None:
+    if len(dfs) != 1:
+        raise ValueError(
+            "Parquet output holds a single DataFrame, got " + str(list(df_names))
+        )
+    parquet_utils.parquet_store(fname, dfs[0], metadata)
+
+
+# output backends, chosen by the extension of the output file
+OUTPUT_BACKENDS = {
+    ".hdf5": hdf5_store,
+    ".h5": hdf5_store,
+    ".parquet": parquet_store,
+}
+
+
+def get_output_backend(fname: str):
+    extension = os.path.splitext(fname)[1]
+    if extension not in OUTPUT_BACKENDS:
+        raise ValueError(
+            "No output backend for "
+            + fname
+            + ", options are "
+            + str(list(OUTPUT_BACKENDS.keys()))
+        )
+    return OUTPUT_BACKENDS[extension]
+
+
 def save_dfs(self, dfs, df_names, fname="out.hdf5", metadata=None):
+    """
+    Save the DataFrames and metadata to fname, in HDF5 or Parquet depending on
+    its extension, and copy it to self.output_location.
+    """
     subdirs = []
-    store = pd.HDFStore(fname)
     if self.output_location is not None:
-        # pandas to hdf5
-        for out, gname in zip(dfs, df_names):
-            if metadata is None:
-                if self.isMC:
-                    metadata = dict(
-                        gensumweight=self.gensumweight,
-                        era=self.era,
-                        mc=self.isMC,
-                        sample=self.sample,
-                    )
-                else:
-                    metadata = dict(era=self.era, mc=self.isMC, sample=self.sample)
-
-            store_fin = h5store(self, store, out, fname, gname, **metadata)
-
-        store.close()
+        if metadata is None:
+            if self.isMC:
+                metadata = dict(
+                    gensumweight=self.gensumweight,
+                    era=self.era,
+                    mc=self.isMC,
+                    sample=self.sample,
+                )
+            else:
+                metadata = dict(era=self.era, mc=self.isMC, sample=self.sample)
+
+        get_output_backend(fname)(fname, dfs, df_names, metadata)
 
         dump_table(self, fname, self.output_location, subdirs)
     else:
         print("self.output_location is None")
-        store.close()
 
 
 def format_dataframe(dataframe: pd.DataFrame):
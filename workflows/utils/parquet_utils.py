@@ -0,0 +1,49 @@
+"""
+Parquet output for the ntuples, as an alternative to the PyTables HDF5 files.
+The metadata dict is stored as JSON in the footer of the file (the Arrow schema
+metadata, under the "metadata" key), next to the one written by pandas, so it doesn't
+depend on the pandas/pytables versions used to write and read it back, and the
+columns can be read selectively (see histmaker/fill_utils.parquet_load).
+"""
+
+import json
+
+import numpy as np
+import pandas as pd
+
+METADATA_KEY = b"metadata"
+
+
+def _to_json(value):
+    # numpy scalars and arrays, e.g. the cutflows
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return str(value)
+
+
+def parquet_store(
+    fname: str, df: pd.DataFrame, metadata: dict = None, compression: str = "zstd"
+) -> None:
+    """
+    Write a DataFrame to a compressed Parquet file, with the metadata in its footer.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pa.Table.from_pandas(df)
+    schema_metadata = dict(table.schema.metadata or {})
+    schema_metadata[METADATA_KEY] = json.dumps(metadata or {}, default=_to_json)
+    table = table.replace_schema_metadata(schema_metadata)
+    pq.write_table(table, fname, compression=compression)
+
+
+def parquet_metadata(fname: str) -> dict:
+    """
+    Read only the metadata of a Parquet ntuple.
+    """
+    import pyarrow.parquet as pq
+
+    schema_metadata = pq.read_schema(fname).metadata or {}
+    return json.loads(schema_metadata.get(METADATA_KEY, b"{}"))
@@ -0,0 +1,82 @@
+from time import perf_counter
+
+
+class StageCache:
+    """
+    Memoizes the stages of a processor for one chunk of events, and times them.
+    The stages that don't depend on the systematic variation (event selection,
+    object building, ...) are computed by the first variation that needs them and
+    reused by the others, which only recompute the stages they actually change
+    (e.g. track killing and clustering). Build a new one for every chunk.
+
+    Examples
+    --------
+        stages = StageCache()
+        events = stages.get("preselection", self.preselection, events)
+        with stages.time("clustering_track_down"):
+            jets, clusters = SUEP_utils.FastJetReclustering(tracks, r=1.5, minPt=150)
+        print(stages.report())
+    """
+
+    def __init__(self):
+        self._results = {}
+        self.timings = {}
+        self.reused = {}
+
+    def __contains__(self, name):
+        return name in self._results
+
+    def get(self, name, func, *args, **kwargs):
+        """
+        Return the result of func(*args, **kwargs), computed only the first time
+        the stage name is requested in this chunk.
+        """
+        if name in self._results:
+            self.reused[name] = self.reused.get(name, 0) + 1
+            return self._results[name]
+        with self.time(name):
+            result = func(*args, **kwargs)
+        self._results[name] = result
+        return result
+
+    def time(self, name):
+        """
+        Context manager adding the time spent in its block to the stage name,
+        for the stages that are recomputed for each variation.
+        """
+        return _StageTimer(self, name)
+
+    def saved(self):
+        """
+        Time saved by reusing the memoized stages, in seconds.
+        """
+        return sum(self.timings[name] * n for name, n in self.reused.items())
+
+    def report(self):
+        lines = ["Stage timings:"]
+        for name, seconds in self.timings.items():
+            line = f"  {name:<30} {seconds:8.3f} s"
+            if name in self.reused:
+                line += f" (reused {self.reused[name]}x)"
+            lines.append(line)
+        lines.append(f"  {'total':<30} {sum(self.timings.values()):8.3f} s")
+        if self.reused:
+            lines.append(f"  {'saved by reuse':<30} {self.saved():8.3f} s")
+        return "\n".join(lines)
+
+
+class _StageTimer:
+    def __init__(self, cache, name):
+        self._cache = cache
+        self._name = name
+
+    def __enter__(self):
+        self._start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = perf_counter() - self._start
+        self._cache.timings[self._name] = (
+            self._cache.timings.get(self._name, 0.0) + elapsed
+        )
+        return False